@@ -2,19 +2,79 @@
 """
 審査状態シート（日別(YT)）の読み取り
 不承認広告の検出と情報取得
+必要な列（A, Z〜AB）だけを一定行数ずつ読み、シート全体をメモリに載せない。
+APPROVAL_QUERY_PUSHDOWN=1 では不承認の行だけをgvizクエリでスプレッドシート側で絞り込んで取得する
 """
 
 import os
+import json
 import logging
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, NamedTuple, Optional
 from pathlib import Path
 import gspread
+from gspread.utils import ValueRenderOption
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2 import service_account
 
 # ロガー設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 不承認の行を絞り込むgvizクエリ（Google Visualization API Query Language。IN がないため matches で書く）
+# 空白・大文字小文字の扱いは全行の読み取りと同じにする
+DISAPPROVED_QUERY = (
+    "select A, Z, AA, AB "
+    "where A is not null and AB matches '\\s*不承認\\s*' "
+    "and (AA is null or not (lower(AA) matches '\\s*(removed|paused)\\s*'))"
+)
+
+
+class GvizQueryError(Exception):
+    """gvizクエリの失敗（列を絞った全行の読み取りに切り替える）"""
+
+
+def parse_gviz_response(text: str) -> List[list]:
+    """
+    gvizのJSON応答（google.visualization.Query.setResponse(...) で囲まれている）から各行の値を取り出す
+    値は書式なし（数値は整数なら int）、空のセルは ''
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        raise GvizQueryError(f"応答を解釈できません: {text[:100]}")
+    try:
+        payload = json.loads(text[start:end + 1])
+    except ValueError as e:
+        raise GvizQueryError(f"応答を解釈できません: {e}")
+    if payload.get('status') == 'error':
+        raise GvizQueryError("; ".join(
+            error.get('detailed_message') or error.get('message', '') for error in payload.get('errors', [])
+        ))
+
+    rows = []
+    for row in payload.get('table', {}).get('rows', []):
+        values = []
+        for cell in row.get('c', []):
+            value = cell.get('v') if cell else None
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            values.append('' if value is None else value)
+        rows.append(values)
+    return rows
+
+
+class StatusRow(NamedTuple):
+    """審査状態シートの1行（使う列のみ）"""
+    row_number: Optional[int]  # gvizクエリでは行番号が返らないためNone
+    ad_group_name: str  # A列: 広告グループ名
+    account_id: str  # Z列: アカウントID（ハイフンなし）
+    cp_status: str  # AA列: CP状態（小文字）
+    approval_status: str  # AB列: 承認ステータス
+
+
+def _cell(row: list, index: int) -> str:
+    return str(row[index]).strip() if len(row) > index else ''
+
+
 class ApprovalStatusReader:
     """審査状態シートの読み取りクラス"""
     
@@ -22,6 +82,17 @@ class ApprovalStatusReader:
     APPROVAL_SPREADSHEET_ID = '1yxEYTX-9e9PkIPCh62uJTvAigzyDHv_sSjTfv3qU9M0'
     APPROVAL_SHEET_NAME = '日別(YT)'
     
+    # データは6行目から（ヘッダーが5行目）
+    FIRST_DATA_ROW = 6
+    # 1回の読み取りで取得する行数
+    PAGE_ROWS = 5000
+    
+    # 不承認の行だけをgvizクエリで取得する（失敗した場合は全行の読み取り）
+    QUERY_PUSHDOWN = os.getenv('APPROVAL_QUERY_PUSHDOWN', '0') == '1'
+    # gvizクエリのエンドポイント（{spreadsheet_id} を置き換える）
+    GVIZ_ENDPOINT = os.getenv(
+        'APPROVAL_GVIZ_ENDPOINT', 'https://docs.google.com/spreadsheets/d/{spreadsheet_id}/gviz/tq')
+    
     def __init__(self, credentials_path: Optional[str] = None):
         """
         初期化
@@ -50,6 +121,8 @@ class ApprovalStatusReader:
             
             # gspreadクライアント初期化
             self.client = gspread.authorize(creds)
+            # gvizクエリ用
+            self.session = AuthorizedSession(creds)
             
             # スプレッドシートを開く
             self.spreadsheet = self.client.open_by_key(self.APPROVAL_SPREADSHEET_ID)
@@ -61,6 +134,114 @@ class ApprovalStatusReader:
             logger.error(f"接続エラー: {e}")
             raise
     
+    def iter_rows(self) -> Iterator[StatusRow]:
+        """
+        データ行を順に返す（A列とZ〜AB列だけを PAGE_ROWS 行ずつ batch_get で取得）
+        値は書式なし（UNFORMATTED_VALUE）で読む
+        """
+        last_row = self.sheet.row_count
+        for start in range(self.FIRST_DATA_ROW, last_row + 1, self.PAGE_ROWS):
+            end = min(start + self.PAGE_ROWS - 1, last_row)
+            names, statuses = self.sheet.batch_get(
+                [f"A{start}:A{end}", f"Z{start}:AB{end}"],
+                value_render_option=ValueRenderOption.unformatted
+            )
+            # 末尾の空行・空セルは返らないため、足りない分は空として扱う
+            for offset in range(max(len(names), len(statuses))):
+                name_row = names[offset] if offset < len(names) else []
+                status_row = statuses[offset] if offset < len(statuses) else []
+                yield StatusRow(
+                    row_number=start + offset,
+                    ad_group_name=_cell(name_row, 0),
+                    account_id=_cell(status_row, 0).replace('-', ''),
+                    cp_status=_cell(status_row, 1).lower(),
+                    approval_status=_cell(status_row, 2)
+                )
+    
+    def iter_disapproved_ads(self) -> Iterator[Dict[str, str]]:
+        """不承認広告を順に返す（get_disapproved_ads の各要素と同じ形式）"""
+        for row in self.iter_rows():
+            ad_group_name = row.ad_group_name
+            
+            # CP状態の確認
+            if row.cp_status in ['removed', 'paused']:
+                logger.info(f"CP状態が{row.cp_status}のためスキップ: {ad_group_name}")
+                continue
+            
+            # 不承認チェック
+            if row.approval_status == '不承認' and ad_group_name:
+                logger.info(f"不承認広告検出: {ad_group_name} (行{row.row_number})")
+                yield self._disapproved_ad(row)
+    
+    @staticmethod
+    def _disapproved_ad(row: StatusRow) -> Dict[str, str]:
+        ad_group_name = row.ad_group_name
+        # 広告グループ名を解析（例: "YT_案件名_動画名_MCC..."）
+        parts = ad_group_name.split('_')
+        
+        # YT_で始まる場合は2番目が案件名
+        if parts[0] == 'YT' and len(parts) > 1:
+            project_name = parts[1]  # NB, OM, SBC など
+            # MCCより前の部分を動画名として使用
+            video_name_parts = []
+            for part in parts[2:]:
+                if 'MCC' in part:
+                    break
+                video_name_parts.append(part)
+            # 案件名を含めた完全な動画名を作成
+            video_name = f"{project_name}_{'_'.join(video_name_parts)}" if video_name_parts else ad_group_name
+        else:
+            # YT_で始まらない場合は従来の処理
+            project_name = parts[0] if parts else ''
+            video_name = '_'.join(parts[1:]) if len(parts) > 1 else ad_group_name
+        
+        return {
+            'ad_group_name': ad_group_name,
+            'project_name': project_name,
+            'video_name': video_name,
+            'account_id': row.account_id,
+            'status': row.approval_status,
+            'row_number': row.row_number  # 行番号（デバッグ用）
+        }
+    
+    def query_disapproved_ads(self) -> List[Dict[str, str]]:
+        """
+        不承認の行だけをgvizクエリで取得（row_number はNone）
+        
+        Raises:
+            GvizQueryError: クエリが失敗した場合、または列の型の推定で値が欠けた行がある場合
+        """
+        response = self.session.get(
+            self.GVIZ_ENDPOINT.format(spreadsheet_id=self.APPROVAL_SPREADSHEET_ID),
+            params={
+                'tqx': 'out:json',
+                'sheet': self.APPROVAL_SHEET_NAME,
+                'headers': self.FIRST_DATA_ROW - 1,
+                'tq': DISAPPROVED_QUERY,
+            },
+            timeout=60
+        )
+        if response.status_code != 200:
+            raise GvizQueryError(f"HTTP {response.status_code}")
+        
+        disapproved_ads = []
+        for values in parse_gviz_response(response.text):
+            row = StatusRow(
+                row_number=None,
+                ad_group_name=_cell(values, 0),
+                account_id=_cell(values, 1).replace('-', ''),
+                cp_status=_cell(values, 2).lower(),
+                approval_status=_cell(values, 3)
+            )
+            # gvizは列ごとに型を1つに決め、合わない値を空にするため、欠けていれば全行の読み取りに切り替える
+            if not row.account_id:
+                raise GvizQueryError(f"アカウントIDが取得できません: {row.ad_group_name}")
+            # 全行の読み取りと同じ条件で確認
+            if row.approval_status == '不承認' and row.ad_group_name and row.cp_status not in ['removed', 'paused']:
+                logger.info(f"不承認広告検出: {row.ad_group_name}")
+                disapproved_ads.append(self._disapproved_ad(row))
+        return disapproved_ads
+    
     def get_disapproved_ads(self) -> List[Dict[str, str]]:
         """
         不承認広告を取得
@@ -74,65 +255,16 @@ class ApprovalStatusReader:
                 'status': '不承認'
             }, ...]
         """
+        if self.QUERY_PUSHDOWN:
+            try:
+                disapproved_ads = self.query_disapproved_ads()
+                logger.info(f"不承認広告 {len(disapproved_ads)}件検出（クエリ）")
+                return disapproved_ads
+            except Exception as e:
+                logger.warning(f"クエリで取得できないため全行を読み取ります: {e}")
+        
         try:
-            # シート全体を取得
-            all_values = self.sheet.get_all_values()
-            
-            if len(all_values) < 6:  # ヘッダーが5行目
-                logger.warning("データが見つかりません")
-                return []
-            
-            disapproved_ads = []
-            
-            # データ行を処理（6行目から）
-            for i, row in enumerate(all_values[5:], start=6):
-                if len(row) < 28:  # AB列（インデックス27）まで必要
-                    continue
-                
-                ad_group_name = str(row[0]).strip()  # A列: 広告グループ名
-                
-                # CP状態の確認（AA列 = インデックス26）
-                if len(row) > 26:
-                    cp_status = str(row[26]).strip().lower()  # AA列: CP状態
-                    if cp_status in ['removed', 'paused']:
-                        logger.info(f"CP状態が{cp_status}のためスキップ: {ad_group_name}")
-                        continue
-                
-                approval_status = str(row[27]).strip()  # AB列: 承認ステータス
-                account_id = str(row[25]).strip().replace('-', '')  # Z列: アカウントID
-                
-                # 不承認チェック
-                if approval_status == '不承認' and ad_group_name:
-                    # 広告グループ名を解析（例: "YT_案件名_動画名_MCC..."）
-                    parts = ad_group_name.split('_')
-                    
-                    # YT_で始まる場合は2番目が案件名
-                    if parts[0] == 'YT' and len(parts) > 1:
-                        project_name = parts[1]  # NB, OM, SBC など
-                        # MCCより前の部分を動画名として使用
-                        video_name_parts = []
-                        for part in parts[2:]:
-                            if 'MCC' in part:
-                                break
-                            video_name_parts.append(part)
-                        # 案件名を含めた完全な動画名を作成
-                        video_name = f"{project_name}_{'_'.join(video_name_parts)}" if video_name_parts else ad_group_name
-                    else:
-                        # YT_で始まらない場合は従来の処理
-                        project_name = parts[0] if parts else ''
-                        video_name = '_'.join(parts[1:]) if len(parts) > 1 else ad_group_name
-                    
-                    disapproved_ads.append({
-                        'ad_group_name': ad_group_name,
-                        'project_name': project_name,
-                        'video_name': video_name,
-                        'account_id': account_id,
-                        'status': approval_status,
-                        'row_number': i  # 行番号（デバッグ用）
-                    })
-                    
-                    logger.info(f"不承認広告検出: {ad_group_name} (行{i})")
-            
+            disapproved_ads = list(self.iter_disapproved_ads())
             logger.info(f"不承認広告 {len(disapproved_ads)}件検出")
             return disapproved_ads
             
@@ -142,7 +274,7 @@ class ApprovalStatusReader:
     
     def get_ad_by_name(self, ad_group_name: str) -> Optional[Dict[str, str]]:
         """
-        広告グループ名で特定の広告情報を取得
+        広告グループ名で特定の広告情報を取得（見つかった時点で読み取りをやめる）
         
         Args:
             ad_group_name: 広告グループ名
@@ -151,17 +283,15 @@ class ApprovalStatusReader:
             広告情報、見つからない場合はNone
         """
         try:
-            all_values = self.sheet.get_all_values()
-            
-            for i, row in enumerate(all_values[5:], start=6):
-                if len(row) > 0 and str(row[0]).strip() == ad_group_name:
+            for row in self.iter_rows():
+                if row.ad_group_name == ad_group_name:
                     return {
                         'ad_group_name': ad_group_name,
                         'project_name': ad_group_name.split('_')[0],
                         'video_name': '_'.join(ad_group_name.split('_')[1:]),
-                        'account_id': str(row[25]).strip().replace('-', '') if len(row) > 25 else '',
-                        'status': str(row[27]).strip() if len(row) > 27 else '',
-                        'row_number': i
+                        'account_id': row.account_id,
+                        'status': row.approval_status,
+                        'row_number': row.row_number
                     }
             
             return None
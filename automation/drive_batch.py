@@ -0,0 +1,38 @@
+"""
+Google Drive APIのバッチリクエスト
+複数の files.list / files.get を1回のHTTP往復にまとめて実行する（1バッチ最大100件）
+"""
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Drive APIのバッチリクエストに含められる件数の上限
+MAX_BATCH_SIZE = 100
+
+
+def execute_batch(service, requests: List, batch_size: int = MAX_BATCH_SIZE) -> List[Optional[dict]]:
+    """
+    リクエストをバッチにまとめて実行
+
+    Args:
+        service: Google Drive APIサービス
+        requests: service.files().list(...) 等の未実行のリクエスト
+
+    Returns:
+        requests と同じ順のレスポンス（失敗したリクエストはNone。ほかのリクエストには影響しない）
+    """
+    responses: List[Optional[dict]] = [None] * len(requests)
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            logger.warning(f"バッチ内のリクエストが失敗しました: {exception}")
+            return
+        responses[int(request_id)] = response
+
+    for start in range(0, len(requests), batch_size):
+        batch = service.new_batch_http_request(callback=callback)
+        for index in range(start, min(start + batch_size, len(requests))):
+            batch.add(requests[index], request_id=str(index))
+        batch.execute()
+    return responses
@@ -0,0 +1,269 @@
+"""
+Google Driveの案件フォルダのメタデータミラー（SQLite）
+初回は各フォルダの一覧を全件取得し、以降は保存したstartPageTokenから changes.list で
+変更分だけを反映する。トークンが無効になった場合や対象フォルダが変わった場合は全件を取り直す
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from googleapiclient.errors import HttpError
+
+from automation.drive_name_index import is_video, name_key, normalize_name
+
+logger = logging.getLogger(__name__)
+
+# ミラーに保存する項目
+MIRROR_FIELDS = "id, name, mimeType, md5Checksum, size, modifiedTime, parents, trashed, videoMediaMetadata"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    mime_type TEXT,
+    md5_checksum TEXT,
+    size INTEGER,
+    modified_time TEXT,
+    video_media_metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_name ON files (parent_id, name_key);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class DriveMirror:
+    """案件フォルダ直下のファイルのメタデータをSQLiteに保持し、Changes APIで差分同期する"""
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, service, db_path: str, folder_ids: Iterable[str]):
+        """
+        Args:
+            service: Google Drive APIサービス
+            db_path: SQLiteファイルのパス（実行間で保持する）
+            folder_ids: ミラーする案件フォルダのID
+        """
+        self.service = service
+        self.db_path = db_path
+        self.folder_ids = sorted(set(folder_ids))
+        self.synced = False
+        # 同期に使ったAPI呼び出し回数（ページ数）
+        self.api_calls = 0
+        # 同期とクエリを直列化する（1つの接続を複数スレッドで使うため）
+        self._lock = threading.RLock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    # メタ情報
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # 同期
+
+    def ensure_synced(self):
+        """この実行でまだ同期していなければ同期（初回のlookupで呼ばれる）"""
+        with self._lock:
+            if not self.synced:
+                self.sync()
+
+    def sync(self, full: bool = False):
+        """
+        変更分を反映（full=True、トークン未保存、対象フォルダの変更、トークン無効の場合は全件を取り直す）
+        """
+        token = self._get_meta('start_page_token')
+        if full or not token or self._get_meta('folder_ids') != json.dumps(self.folder_ids):
+            self.full_resync()
+            return
+        try:
+            self._apply_changes(token)
+        except HttpError as e:
+            if e.resp.status not in (400, 404, 410):
+                raise
+            logger.warning(f"変更トークンが無効のため全件を取り直します: {e}")
+            self.full_resync()
+
+    def full_resync(self):
+        """各フォルダの一覧を全件取得してミラーを作り直す"""
+        # 一覧の取得中に起きた変更も次回の差分同期で拾えるよう、トークンを先に取得する
+        token = self.service.changes().getStartPageToken(supportsAllDrives=True).execute()['startPageToken']
+        self.api_calls += 1
+        files = []
+        for folder_id in self.folder_ids:
+            files += self._list_folder(folder_id)
+        with self._conn:
+            self._conn.execute("DELETE FROM files")
+            for file_info in files:
+                self._upsert(file_info)
+            self._set_meta('start_page_token', token)
+            self._set_meta('folder_ids', json.dumps(self.folder_ids))
+            self._set_meta('synced_at', datetime.now().isoformat())
+        self.synced = True
+        logger.info(f"Driveミラーを全件同期: {len(files)}件（{len(self.folder_ids)}フォルダ）")
+
+    def _list_folder(self, folder_id: str) -> List[dict]:
+        files = []
+        page_token = None
+        while True:
+            results = self.service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                fields=f"nextPageToken, files({MIRROR_FIELDS})",
+                pageSize=self.PAGE_SIZE,
+                pageToken=page_token,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            ).execute()
+            self.api_calls += 1
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def _apply_changes(self, token: str):
+        """changes.list の差分を反映してトークンを進める"""
+        updated = removed = 0
+        with self._conn:
+            while True:
+                results = self.service.changes().list(
+                    pageToken=token,
+                    fields=f"nextPageToken, newStartPageToken, "
+                           f"changes(changeType, fileId, removed, file({MIRROR_FIELDS}))",
+                    pageSize=self.PAGE_SIZE,
+                    spaces='drive',
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True
+                ).execute()
+                self.api_calls += 1
+                for change in results.get('changes', []):
+                    # 共有ドライブ自体の変更（changeType: drive）にはファイルがない
+                    if change.get('changeType') != 'file' or not change.get('fileId'):
+                        continue
+                    file_info = change.get('file')
+                    if self._in_mirror(file_info) and not change.get('removed'):
+                        self._upsert(file_info)
+                        updated += 1
+                    else:
+                        # 削除・ゴミ箱・対象フォルダ外への移動（対象外のファイルは何も起きない）
+                        removed += self._conn.execute(
+                            "DELETE FROM files WHERE id = ?", (change.get('fileId'),)
+                        ).rowcount
+                if 'newStartPageToken' in results:
+                    token = results['newStartPageToken']
+                    break
+                token = results['nextPageToken']
+            self._set_meta('start_page_token', token)
+            self._set_meta('synced_at', datetime.now().isoformat())
+        self.synced = True
+        logger.info(f"Driveミラーを差分同期: 更新 {updated}件 / 削除 {removed}件")
+
+    def _in_mirror(self, file_info: Optional[dict]) -> bool:
+        if not file_info or file_info.get('trashed'):
+            return False
+        return any(parent in self.folder_ids for parent in file_info.get('parents', []))
+
+    def _upsert(self, file_info: dict):
+        parent_id = next(p for p in file_info.get('parents', []) if p in self.folder_ids)
+        metadata = file_info.get('videoMediaMetadata')
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (id, parent_id, name, name_key, mime_type, md5_checksum, size, "
+            "modified_time, video_media_metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                file_info['id'], parent_id, file_info['name'], name_key(file_info['name']),
+                file_info.get('mimeType'), file_info.get('md5Checksum'),
+                int(file_info['size']) if file_info.get('size') else None,
+                file_info.get('modifiedTime'),
+                json.dumps(metadata) if metadata else None,
+            )
+        )
+
+    # 検索
+
+    @staticmethod
+    def _to_file_info(row: sqlite3.Row) -> dict:
+        """Drive APIのファイル情報と同じ形式にする"""
+        file_info = {
+            'id': row['id'],
+            'name': row['name'],
+            'mimeType': row['mime_type'],
+            'md5Checksum': row['md5_checksum'],
+            'size': str(row['size']) if row['size'] is not None else None,
+            'modifiedTime': row['modified_time'],
+        }
+        if row['video_media_metadata']:
+            file_info['videoMediaMetadata'] = json.loads(row['video_media_metadata'])
+        return file_info
+
+    def _videos(self, folder_id: str, where: str = "", params: tuple = ()) -> List[dict]:
+        with self._lock:
+            self.ensure_synced()
+            rows = self._conn.execute(
+                f"SELECT * FROM files WHERE parent_id = ? {where} ORDER BY name", (folder_id, *params)
+            ).fetchall()
+        return [f for f in map(self._to_file_info, rows) if is_video(f)]
+
+    def lookup(self, folder_id: str, video_name: str) -> Optional[dict]:
+        """動画名（拡張子なし）に一致するファイル（DriveNameIndex.lookup と同じ規則）"""
+        if folder_id not in self.folder_ids:
+            return None
+        candidates = self._videos(folder_id, "AND name_key = ?", (normalize_name(video_name),))
+        if not candidates:
+            return None
+        # 同名の候補がある場合は .mp4 を優先
+        candidates.sort(key=lambda f: not f['name'].lower().endswith('.mp4'))
+        if len(candidates) > 1:
+            logger.warning(f"同じ名前の動画が{len(candidates)}件あります: "
+                           + ", ".join(f['name'] for f in candidates))
+        return candidates[0]
+
+    def video_names(self, folder_id: str) -> List[str]:
+        return [f['name'] for f in self._videos(folder_id)]
+
+    def status(self) -> Dict:
+        counts = dict(self._conn.execute(
+            "SELECT parent_id, COUNT(*) FROM files GROUP BY parent_id"
+        ).fetchall())
+        return {
+            'db_path': self.db_path,
+            'synced_at': self._get_meta('synced_at'),
+            'files': {folder_id: counts.get(folder_id, 0) for folder_id in self.folder_ids},
+        }
+
+
+# CLI使用例
+if __name__ == "__main__":
+    import argparse
+
+    from automation.google_drive_finder import GoogleDriveFinder
+
+    parser = argparse.ArgumentParser(description='Google Drive案件フォルダのメタデータミラー')
+    parser.add_argument('--full-resync', action='store_true', help='差分ではなく全件を取り直す')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    finder = GoogleDriveFinder()
+    if not finder.mirror:
+        raise SystemExit("Driveミラーが無効です（DRIVE_MIRROR_PATH）")
+    finder.mirror.sync(full=args.full_resync)
+    status = finder.mirror.status()
+    print(f"ミラー: {status['db_path']}（同期: {status['synced_at']}, API呼び出し {finder.mirror.api_calls}回）")
+    for project, folder_id in finder.PROJECT_FOLDERS.items():
+        print(f"  {project}: {status['files'].get(folder_id, 0)}件")
@@ -0,0 +1,224 @@
+"""
+Google Driveフォルダのファイル名インデックス
+フォルダごとに1回だけ一覧を取得し（ページングで全件）、正規化したファイル名から引けるようにする。
+広告ごとの検索クエリが不要になり、APIの呼び出し回数は広告数ではなくフォルダ数に比例する。
+recursive=True ではサブフォルダも幅優先でたどり（同じ階層のフォルダは並列に取得）、配下の動画をまとめて索引にする
+"""
+import logging
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from automation.drive_batch import execute_batch
+
+logger = logging.getLogger(__name__)
+
+# 動画として扱う拡張子（mimeTypeがvideo/でない場合の判定用）
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+def normalize_name(name: str) -> str:
+    """
+    比較用のファイル名（NFC・スペースはアンダースコア）
+    Driveのファイル名はNFDの場合があり、広告グループ名との違いはスペースとアンダースコアのみ許容する
+    """
+    return unicodedata.normalize('NFC', name).strip().replace(' ', '_')
+
+
+def is_video(file_info: dict) -> bool:
+    return 'video' in file_info.get('mimeType', '').lower() \
+        or Path(file_info['name']).suffix.lower() in VIDEO_EXTENSIONS
+
+
+def name_key(file_name: str) -> str:
+    """ファイル名のキー（動画の拡張子は除く）"""
+    path = Path(file_name)
+    stem = path.stem if path.suffix.lower() in VIDEO_EXTENSIONS else file_name
+    return normalize_name(stem)
+
+
+class DriveNameIndex:
+    """フォルダ内の動画ファイルを正規化した名前で引くインデックス（実行中はメモリに保持）"""
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, service, file_fields: str, recursive: bool = False, workers: int = 1,
+                 service_factory: Optional[Callable] = None):
+        """
+        Args:
+            service: Google Drive APIサービス
+            file_fields: 取得する項目（例: "id, name, mimeType, md5Checksum, size"。mimeTypeは必須）
+            recursive: サブフォルダもたどる
+            workers: サブフォルダの一覧を同時に取得する数
+            service_factory: 並列取得するスレッドごとのサービスを作る関数（サービスはスレッド間で共有できないため）
+        """
+        self.service = service
+        self.file_fields = file_fields
+        self.recursive = recursive
+        self.workers = max(1, workers) if service_factory else 1
+        self.service_factory = service_factory
+        self._folders: Dict[str, Dict[str, List[dict]]] = {}
+        # 見つからない場合の近い名前の検索用（フォルダごとに初回の検索時に作成）
+        self._near_miss = {}
+        # たどったフォルダの構成（フォルダID → サブフォルダID、実行中は保持）
+        self.tree: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._calls_lock = threading.Lock()
+        # フォルダ一覧の取得に使ったAPI呼び出し回数（ページ数）
+        self.api_calls = 0
+
+    def _thread_service(self):
+        """このスレッドで使うサービス（並列取得のワーカーはそれぞれ作る）"""
+        if not self.service_factory or threading.current_thread() is threading.main_thread():
+            return self.service
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._local.service = self.service_factory()
+        return service
+
+    def _list_request(self, folder_id: str, page_token: Optional[str] = None, service=None):
+        return (service or self.service).files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields=f"nextPageToken, files({self.file_fields})",
+            pageSize=self.PAGE_SIZE,
+            pageToken=page_token,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        )
+
+    def _list_folder(self, folder_id: str) -> List[dict]:
+        """フォルダ直下のファイルをすべて取得"""
+        service = self._thread_service()
+        files = []
+        page_token = None
+        while True:
+            results = self._list_request(folder_id, page_token, service).execute()
+            with self._calls_lock:
+                self.api_calls += 1
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def _walk(self, root_ids: List[str]) -> Dict[str, List[dict]]:
+        """
+        各フォルダ以下を幅優先でたどり、配下のファイルを浅い階層から順に返す
+        同じ階層のフォルダは workers 個ずつ並列に一覧を取得する
+        """
+        files = {root_id: [] for root_id in root_ids}
+        # 取得するフォルダ → 属する案件フォルダ
+        level = {root_id: root_id for root_id in root_ids}
+        visited = set(level)
+        depth = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while level:
+                listings = executor.map(self._list_folder, list(level))
+                next_level = {}
+                for (folder_id, root_id), children in zip(list(level.items()), listings):
+                    subfolders = [f['id'] for f in children if f.get('mimeType') == FOLDER_MIME_TYPE]
+                    self.tree[folder_id] = subfolders
+                    files[root_id].extend(f for f in children if f.get('mimeType') != FOLDER_MIME_TYPE)
+                    for subfolder_id in subfolders:
+                        if subfolder_id not in visited:
+                            visited.add(subfolder_id)
+                            next_level[subfolder_id] = root_id
+                level = next_level
+                depth += 1
+        logger.info(f"サブフォルダをたどりました: {len(visited)}フォルダ（{depth}階層）")
+        return files
+
+    def _build(self, folder_id: str, files: List[dict]) -> Dict[str, List[dict]]:
+        index = {}
+        for file_info in files:
+            if is_video(file_info):
+                index.setdefault(name_key(file_info['name']), []).append(file_info)
+        # 同名の候補がある場合は .mp4 を優先（従来の検索順。サブフォルダをたどった場合は次に浅い階層を優先）
+        for candidates in index.values():
+            candidates.sort(key=lambda f: Path(f['name']).suffix.lower() != '.mp4')
+        self._folders[folder_id] = index
+        logger.info(f"フォルダ一覧を取得: {folder_id}（{len(files)}件, 動画 "
+                    f"{sum(len(c) for c in index.values())}件）")
+        return index
+
+    def folder(self, folder_id: str) -> Dict[str, List[dict]]:
+        """フォルダのインデックス（初回のみ一覧を取得）"""
+        with self._lock:
+            index = self._folders.get(folder_id)
+            if index is None:
+                files = self._walk([folder_id])[folder_id] if self.recursive else self._list_folder(folder_id)
+                index = self._build(folder_id, files)
+            return index
+
+    def prefetch(self, folder_ids: Iterable[str]):
+        """
+        まだ取得していないフォルダの一覧をバッチリクエストでまとめて取得
+        各フォルダの同じページ目を1回の往復で取得する（失敗したフォルダは次の folder() で個別に取り直す）
+        recursive=True の場合はサブフォルダも含めて並列にたどる
+        """
+        with self._lock:
+            if self.recursive:
+                pending = [folder_id for folder_id in dict.fromkeys(folder_ids) if folder_id not in self._folders]
+                if pending:
+                    for folder_id, files in self._walk(pending).items():
+                        self._build(folder_id, files)
+                return
+            page_tokens = {folder_id: None for folder_id in folder_ids if folder_id not in self._folders}
+            files = {folder_id: [] for folder_id in page_tokens}
+            while page_tokens:
+                folder_ids = list(page_tokens)
+                responses = execute_batch(
+                    self.service, [self._list_request(folder_id, page_tokens[folder_id]) for folder_id in folder_ids]
+                )
+                self.api_calls += len(folder_ids)
+                page_tokens = {}
+                for folder_id, results in zip(folder_ids, responses):
+                    if results is None:
+                        continue
+                    files[folder_id].extend(results.get('files', []))
+                    if results.get('nextPageToken'):
+                        page_tokens[folder_id] = results['nextPageToken']
+                    else:
+                        self._build(folder_id, files[folder_id])
+
+    def lookup(self, folder_id: str, video_name: str) -> Optional[dict]:
+        """動画名（拡張子なし）に一致するファイル"""
+        candidates = self.folder(folder_id).get(normalize_name(video_name))
+        if not candidates:
+            return None
+        if len(candidates) > 1:
+            logger.warning(f"同じ名前の動画が{len(candidates)}件あります: "
+                           + ", ".join(f['name'] for f in candidates))
+        return candidates[0]
+
+    def video_names(self, folder_id: str) -> List[str]:
+        """フォルダ内の動画ファイル名（見つからない場合の確認用）"""
+        return sorted(f['name'] for candidates in self.folder(folder_id).values() for f in candidates)
+
+    def near_misses(self, folder_id: str, video_name: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """
+        動画名に近いファイル名（見つからない場合の確認用）
+
+        Returns:
+            [(ファイル名, 類似度 0.0〜1.0)] 類似度の高い順
+        """
+        from automation.near_miss_index import NearMissIndex
+
+        index = self._near_miss.get(folder_id)
+        if index is None:
+            index = self._near_miss[folder_id] = NearMissIndex(self.video_names(folder_id))
+        return index.query(video_name, limit=limit)
+
+    def invalidate(self, folder_id: Optional[str] = None):
+        """インデックスを破棄（次の検索で一覧を取り直す）"""
+        with self._lock:
+            if folder_id is None:
+                self._folders.clear()
+                self._near_miss.clear()
+                self.tree.clear()
+            else:
+                self._folders.pop(folder_id, None)
+                self._near_miss.pop(folder_id, None)
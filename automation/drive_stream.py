@@ -0,0 +1,183 @@
+"""
+Google Driveの動画をダウンロードしながら利用する
+ダウンロードはバックグラウンドで一時ファイルに書き込み（キャッシュ用のコピーを兼ねる）、
+書き込み中のファイルを先頭から名前付きパイプ（FIFO）に流してffmpegに渡す
+"""
+import errno
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+from googleapiclient.http import MediaIoBaseDownload
+
+logger = logging.getLogger(__name__)
+
+# 名前付きパイプが使えるか（Windowsでは不可）
+STREAMING_SUPPORTED = hasattr(os, 'mkfifo')
+
+
+class DriveStreamingDownload:
+    """Driveのファイルをバックグラウンドでダウンロードし、途中のデータを読めるようにする"""
+
+    CHUNK_SIZE = 4 * 1024 * 1024
+    FEED_SIZE = 1024 * 1024
+
+    def __init__(self, service, file_id: str, output_path: Path, expected_size: int = 0,
+                 expected_md5: Optional[str] = None):
+        """
+        Args:
+            service: Google Drive APIサービス
+            file_id: ダウンロードするファイルのID
+            output_path: 保存先（ダウンロード完了後はそのまま元動画として使える）
+            expected_size: ファイルサイズ（分かっていれば完了時に照合する）
+            expected_md5: Driveのmd5Checksum（分かっていれば受信しながら計算したMD5と照合する）
+        """
+        self.service = service
+        self.file_id = file_id
+        self.output_path = Path(output_path)
+        self.expected_size = expected_size
+        self.expected_md5 = expected_md5
+        self._md5 = hashlib.md5()
+        self.bytes_written = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._condition = threading.Condition()
+        self._file = None
+        self._thread: Optional[threading.Thread] = None
+        self._feeder: Optional[threading.Thread] = None
+        self._fifo_path: Optional[str] = None
+        self._cancelled = False
+
+    def start(self) -> 'DriveStreamingDownload':
+        self._file = open(self.output_path, 'wb')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            request = self.service.files().get_media(fileId=self.file_id)
+            # MediaIoBaseDownload は受け取ったデータを self.write() に渡す
+            downloader = MediaIoBaseDownload(self, request, chunksize=self.CHUNK_SIZE)
+            done = False
+            last_logged = -1
+            while not done:
+                status, done = downloader.next_chunk()
+                if status:
+                    progress = int(status.progress() * 100)
+                    if progress // 20 != last_logged // 20:
+                        last_logged = progress
+                        logger.info(f"ダウンロード進捗: {progress}%")
+            if self.expected_size and self.bytes_written != self.expected_size:
+                raise IOError(f"ダウンロードサイズが一致しません: {self.bytes_written} / {self.expected_size}")
+            if self.expected_md5 and self._md5.hexdigest() != self.expected_md5:
+                raise IOError(f"MD5が一致しません: {self._md5.hexdigest()} / Drive {self.expected_md5}")
+            logger.info(f"ダウンロード完了: {self.output_path}")
+        except Exception as e:
+            logger.error(f"ダウンロードエラー: {e}")
+            self.error = e
+        finally:
+            self._file.close()
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    def write(self, data: bytes):
+        """MediaIoBaseDownloadから呼ばれる"""
+        self._file.write(data)
+        self._file.flush()
+        self._md5.update(data)
+        with self._condition:
+            self.bytes_written += len(data)
+            self._condition.notify_all()
+
+    def wait_for_bytes(self, size: int, timeout: Optional[float] = None) -> bytes:
+        """
+        先頭sizeバイト（ダウンロードが先に終わった場合はファイル全体）を返す
+
+        Raises:
+            TimeoutError: timeout秒以内にデータが揃わなかった場合
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.done or self.bytes_written >= size, timeout):
+                raise TimeoutError(f"ダウンロードが進みません（{self.bytes_written}バイト）")
+            available = min(size, self.bytes_written)
+        with open(self.output_path, 'rb') as f:
+            return f.read(available)
+
+    def wait(self, timeout: Optional[float] = None) -> Path:
+        """
+        ダウンロード完了を待って保存先を返す
+
+        Raises:
+            ダウンロード中に発生した例外
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.done, timeout):
+                raise TimeoutError("ダウンロードが完了しません")
+        if self.error:
+            raise self.error
+        return self.output_path
+
+    def open_fifo(self) -> str:
+        """
+        ダウンロード中のファイルを先頭から流す名前付きパイプを作成
+        ffmpegがパイプを開くと、書き込み済みの部分から順に渡し、以降は到着したデータを追いかける
+        """
+        fifo_dir = tempfile.mkdtemp(prefix='drive_stream_')
+        self._fifo_path = os.path.join(fifo_dir, 'input.fifo')
+        os.mkfifo(self._fifo_path)
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+        return self._fifo_path
+
+    def _feed(self):
+        try:
+            # 読み手（ffmpeg）がパイプを開くまでここで待つ
+            with open(self._fifo_path, 'wb') as fifo, open(self.output_path, 'rb') as source:
+                position = 0
+                while not self._cancelled:
+                    with self._condition:
+                        self._condition.wait_for(
+                            lambda: self._cancelled or self.done or self.bytes_written > position
+                        )
+                        available = self.bytes_written - position
+                        finished = self.done
+                    if available <= 0:
+                        if finished:
+                            break
+                        continue
+                    chunk = source.read(min(available, self.FEED_SIZE))
+                    fifo.write(chunk)
+                    position += len(chunk)
+        except BrokenPipeError:
+            # ffmpegが入力を最後まで読まずに終了した（-tで打ち切った等）
+            logger.debug("ffmpegがパイプを閉じました")
+        except OSError as e:
+            if e.errno != errno.EPIPE:
+                logger.error(f"パイプへの書き込みエラー: {e}")
+
+    def close(self):
+        """パイプへの転送を止めてパイプを削除（ダウンロード自体は続行する）"""
+        if not self._fifo_path:
+            return
+        self._cancelled = True
+        with self._condition:
+            self._condition.notify_all()
+        # ffmpegがパイプを開かずに終了した場合、書き込み側のopenが戻るよう読み手として開いて閉じる
+        try:
+            fd = os.open(self._fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+            os.close(fd)
+        except OSError:
+            pass
+        if self._feeder:
+            self._feeder.join(timeout=5)
+        try:
+            os.remove(self._fifo_path)
+            os.rmdir(os.path.dirname(self._fifo_path))
+        except OSError:
+            pass
+        self._fifo_path = None
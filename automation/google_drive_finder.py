@@ -6,10 +6,9 @@ import io
 import logging
 import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterable, Optional
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +23,12 @@ class GoogleDriveFinder:
         'SBC': '1NXeyriGAJyYihRCQl1tFB7JHz2CeNRFP'  # SBC_CRフォルダ
     }
     
+    # 検索結果として取得する項目（md5Checksumは合成キャッシュのキーに使う）
+    FILE_FIELDS = "id, name, mimeType, md5Checksum, size"
+    
+    # 動画が見つからない場合に表示する近い名前の数
+    NEAR_MISS_LIMIT = 5
+    
     def __init__(self, credentials_file: str = None, folder_id: str = None):
         """
         Args:
@@ -41,6 +46,36 @@ class GoogleDriveFinder:
         self.service = self._init_service(credentials_file)
         self.temp_dir = Path(tempfile.gettempdir()) / "ad_videos_temp"
         self.temp_dir.mkdir(exist_ok=True)
+        # 案件フォルダのファイル名インデックス（このインスタンスを使う間はフォルダごとに1回だけ一覧を取得）
+        from automation.drive_name_index import DriveNameIndex
+        from config import Config
+        # DRIVE_RECURSIVE_SEARCH=1 では案件フォルダのサブフォルダ（日付・撮影ごと等）もたどる
+        self.name_index = DriveNameIndex(
+            self.service, self.FILE_FIELDS,
+            recursive=Config.DRIVE_RECURSIVE_SEARCH,
+            workers=Config.DRIVE_LIST_WORKERS,
+            service_factory=lambda: build('drive', 'v3', credentials=self.credentials, cache_discovery=False)
+        )
+        # 実行間で保持するメタデータミラー（Changes APIで差分同期）。同期済みのミラーにない動画はフォルダにもないものとし、
+        # ミラーが無効・同期できない場合だけ name_index で探す
+        self.mirror = None
+        self._mirror_near_miss = {}
+        if Config.DRIVE_MIRROR_PATH:
+            from automation.drive_mirror import DriveMirror
+            self.mirror = DriveMirror(self.service, Config.DRIVE_MIRROR_PATH, self.PROJECT_FOLDERS.values())
+        # resolve_many で見つかったファイル（広告グループ名 → ファイル情報）
+        self.resolved: Dict[str, dict] = {}
+        # 実行間で保持する元動画のキャッシュ（ファイルID＋md5Checksum）
+        self.source_cache = None
+        if Config.SOURCE_CACHE_DIR:
+            from automation.source_cache import SourceCache
+            self.source_cache = SourceCache()
+        # 大きなファイルは複数のRangeリクエストで並列に取得する（中断しても続きから再開）
+        self.ranged_downloader = None
+        self.ranged_min_bytes = Config.RANGED_DOWNLOAD_MIN_MB * 1024 * 1024
+        if Config.RANGED_DOWNLOAD_WORKERS > 1:
+            from automation.ranged_downloader import RangedDownloader
+            self.ranged_downloader = RangedDownloader(self.credentials)
     
     def _init_service(self, credentials_file: str):
         """Google Drive APIサービスを初期化"""
@@ -50,6 +85,8 @@ class GoogleDriveFinder:
                 scopes=['https://www.googleapis.com/auth/drive']
             )
             service = build('drive', 'v3', credentials=credentials)
+            # 並列レンジダウンロードのHTTPセッションでも使う
+            self.credentials = credentials
             logger.info("Google Drive API初期化成功")
             return service
         except Exception as e:
@@ -145,6 +182,21 @@ class GoogleDriveFinder:
         Returns:
             ダウンロードした動画ファイルのパス
         """
+        file_info = self.resolve_video_by_ad_group(ad_group_name)
+        if not file_info:
+            return None
+        return self.download(file_info, self.parse_ad_group_name(ad_group_name)['video_name'])
+    
+    def resolve_video_by_ad_group(self, ad_group_name: str) -> Optional[dict]:
+        """
+        広告グループ名から動画ファイルを特定（ダウンロードはしない）
+        
+        Returns:
+            ファイル情報 {'id', 'name', 'mimeType', 'md5Checksum', 'size'}
+        """
+        if ad_group_name in self.resolved:
+            return self.resolved[ad_group_name]
+        
         # 広告グループ名を解析
         parsed = self.parse_ad_group_name(ad_group_name)
         project = parsed['project']
@@ -160,116 +212,176 @@ class GoogleDriveFinder:
         if not folder_id:
             logger.error(f"案件 {project} のフォルダIDが設定されていません")
             # フォールバック：デフォルトフォルダで検索
-            return self.find_and_download(video_name)
+            return self.resolve_by_name(video_name)
         
         # 案件フォルダ内で動画を検索
-        return self.find_in_project_folder(folder_id, project, video_name)
+        return self.resolve_in_project_folder(folder_id, project, video_name)
+    
+    def resolve_many(self, ad_group_names: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """
+        複数の広告グループ名から動画ファイルをまとめて特定（ダウンロードはしない）
+        必要な案件フォルダの一覧と、案件フォルダのない広告の名前検索はバッチリクエストにまとめて取得するため、
+        HTTPの往復回数は広告数ではなくページ数・100件ごとのバッチ数で決まる。
+        結果は resolve_video_by_ad_group と同じで、見つかった広告は以降の個別の検索でもAPIを呼ばない
+        
+        Returns:
+            広告グループ名 → ファイル情報（見つからない場合はNone）
+        """
+        from automation.drive_batch import execute_batch
+        
+        names = list(dict.fromkeys(ad_group_names))
+        results = {}
+        in_folders = []  # (広告グループ名, フォルダID, 動画名)
+        by_name = []  # (広告グループ名, 動画名)
+        for ad_group_name in names:
+            parsed = self.parse_ad_group_name(ad_group_name)
+            folder_id = self.PROJECT_FOLDERS.get(parsed['project'])
+            if not folder_id:
+                by_name.append((ad_group_name, parsed['video_name']))
+                continue
+            file_info = self._lookup_mirror(folder_id, parsed['video_name'])
+            if file_info or self._mirror_is_authoritative():
+                results[ad_group_name] = file_info
+            else:
+                in_folders.append((ad_group_name, folder_id, parsed['video_name']))
+        
+        if in_folders:
+            try:
+                self.name_index.prefetch({folder_id for _, folder_id, _ in in_folders})
+            except Exception as e:
+                logger.warning(f"フォルダ一覧のバッチ取得に失敗しました（個別に取得します）: {e}")
+            for ad_group_name, folder_id, video_name in in_folders:
+                try:
+                    results[ad_group_name] = self.name_index.lookup(folder_id, video_name)
+                except Exception as e:
+                    logger.error(f"検索エラー: {e}")
+        
+        if by_name:
+            try:
+                responses = execute_batch(self.service, [self._name_search_request(video_name)
+                                                         for _, video_name in by_name])
+            except Exception as e:
+                logger.error(f"検索エラー: {e}")
+                responses = [None] * len(by_name)
+            for (ad_group_name, _), response in zip(by_name, responses):
+                files = (response or {}).get('files', [])
+                results[ad_group_name] = files[0] if files else None
+        
+        self.resolved.update((name, file_info) for name, file_info in results.items() if file_info)
+        found = sum(1 for name in names if results.get(name))
+        logger.info(f"まとめて検索: {found}/{len(names)}件 発見（フォルダ一覧 {len({f for _, f, _ in in_folders})}件, "
+                    f"名前検索 {len(by_name)}件）")
+        return {name: results.get(name) for name in names}
+    
+    def download(self, file_info: dict, ad_name: str, dest_dir: Optional[Path] = None) -> Optional[Path]:
+        """
+        resolve_* で特定したファイルをダウンロード
+        
+        Args:
+            dest_dir: 保存先フォルダ（ジョブごとの作業フォルダ等。省略時は共通の一時フォルダ）
+        """
+        ext = Path(file_info['name']).suffix or '.mp4'
+        output_path = Path(dest_dir or self.temp_dir) / f"{ad_name}{ext}"
+        try:
+            if self.source_cache:
+                return self.source_cache.fetch(file_info, output_path, self._download_file)
+            return self._download_file(file_info, output_path)
+        except Exception as e:
+            logger.error(f"ダウンロードエラー: {e}")
+            return None
+    
+    def has_cached_source(self, file_info: dict) -> bool:
+        """元動画がキャッシュ済みか（ダウンロードが不要か）"""
+        return bool(self.source_cache) and self.source_cache.contains(file_info)
+    
+    def store_source(self, file_info: dict, path: Path):
+        """open_stream でダウンロードし終えた元動画をキャッシュに登録"""
+        key = self.source_cache.key_for(file_info) if self.source_cache else None
+        if key:
+            self.source_cache.store(key, path, file_info)
+    
+    def open_stream(self, file_info: dict, ad_name: str, dest_dir: Optional[Path] = None):
+        """
+        resolve_* で特定したファイルのダウンロードをバックグラウンドで開始
+        
+        Returns:
+            DriveStreamingDownload（ダウンロード中のデータを読める）
+        """
+        from automation.drive_stream import DriveStreamingDownload
+        
+        ext = Path(file_info['name']).suffix or '.mp4'
+        return DriveStreamingDownload(
+            self.service, file_info['id'], Path(dest_dir or self.temp_dir) / f"{ad_name}{ext}",
+            expected_size=int(file_info.get('size') or 0),
+            expected_md5=file_info.get('md5Checksum')
+        ).start()
     
     def find_in_project_folder(self, folder_id: str, project: str, video_name: str) -> Optional[Path]:
         """
         特定の案件フォルダから動画を検索してダウンロード
         """
+        file_info = self.resolve_in_project_folder(folder_id, project, video_name)
+        if not file_info:
+            return None
+        return self.download(file_info, video_name)
+    
+    def resolve_in_project_folder(self, folder_id: str, project: str, video_name: str) -> Optional[dict]:
+        """
+        特定の案件フォルダから動画を検索（ダウンロードはしない）
+        フォルダの一覧は実行中に1回だけ取得し、以降の広告はインデックスから引く
+        （NFC/NFD・スペースとアンダースコア・拡張子の有無の違いは同じ名前として扱う）
+        """
         try:
-            import unicodedata
-            
-            # Unicode正規化を適用（NFD形式）- Google Driveのファイル名形式に合わせる
-            search_patterns = [
-                unicodedata.normalize('NFD', video_name + '.mp4'),  # NFD形式で完全一致
-                unicodedata.normalize('NFD', video_name),  # 拡張子なし
-                video_name + '.mp4',  # 元の形式でも試す
-                video_name,
-            ]
-            
-            for pattern in search_patterns:
-                logger.info(f"{project}フォルダで検索: {pattern}")
-                
-                # 完全一致検索を優先
-                query = f"'{folder_id}' in parents and name = '{pattern}'"
-                logger.info(f"クエリ: {query}")
-                
-                # supportsAllDrivesとincludeItemsFromAllDrivesを追加
-                results = self.service.files().list(
-                    q=query,
-                    fields="files(id, name, mimeType)",
-                    pageSize=20,
-                    supportsAllDrives=True,
-                    includeItemsFromAllDrives=True
-                ).execute()
-                
-                files = results.get('files', [])
-                logger.info(f"検索結果: {len(files)}個のファイル")
-                
-                # 動画ファイルのみをフィルタ
-                video_files = [
-                    f for f in files 
-                    if 'video' in f.get('mimeType', '').lower() 
-                    or any(ext in f['name'].lower() for ext in ['.mp4', '.mov', '.avi', '.mkv'])
-                ]
-                
-                if video_files:
-                    # 最も一致度の高いファイルを選択
-                    best_match = self._find_best_match(video_files, video_name)
-                    if best_match:
-                        logger.info(f"動画ファイル発見: {best_match['name']}")
-                        return self._download_file(best_match['id'], best_match['name'], video_name)
+            logger.info(f"{project}フォルダで検索: {video_name}")
+            file_info = self._lookup_mirror(folder_id, video_name)
+            if not file_info and not self._mirror_is_authoritative():
+                file_info = self.name_index.lookup(folder_id, video_name)
+            if file_info:
+                logger.info(f"動画ファイル発見: {file_info['name']}")
+                return file_info
             
             logger.warning(f"動画が見つかりません: {video_name}")
-            self._list_folder_contents(folder_id, project)
+            self._list_folder_contents(folder_id, project, video_name)
             return None
             
         except Exception as e:
             logger.error(f"検索エラー: {e}")
             return None
     
-    def _find_best_match(self, files: list, target_name: str) -> Optional[dict]:
-        """最も一致度の高いファイルを選択"""
-        if not files:
+    def _lookup_mirror(self, folder_id: str, video_name: str) -> Optional[dict]:
+        """メタデータミラーから検索（同期に失敗した場合はこの実行ではミラーを使わない）"""
+        if not self.mirror:
             return None
-        
-        # ファイル名から拡張子を除去して比較
-        from pathlib import Path
-        
-        # 完全一致を最優先
-        for file in files:
-            file_stem = Path(file['name']).stem
-            # 完全一致チェック（スペースとアンダースコアの違いは許容）
-            if file_stem == target_name:
-                logger.info(f"完全一致: {file['name']}")
-                return file
-            if file_stem.replace(' ', '_') == target_name:
-                logger.info(f"完全一致（スペース→アンダースコア）: {file['name']}")
-                return file
-            if file_stem.replace('_', ' ') == target_name:
-                logger.info(f"完全一致（アンダースコア→スペース）: {file['name']}")
-                return file
-        
-        # 完全一致がない場合はNone（曖昧な一致は使わない）
-        logger.warning(f"完全一致するファイルが見つかりません: {target_name}")
-        logger.warning(f"候補ファイル:")
-        for file in files[:5]:  # 最初の5個だけ表示
-            logger.warning(f"  - {file['name']}")
-        
-        return None
-    
-    def _list_folder_contents(self, folder_id: str, project: str):
-        """フォルダ内のファイル一覧を表示（デバッグ用）"""
         try:
-            query = f"'{folder_id}' in parents"
-            results = self.service.files().list(
-                q=query,
-                fields="files(name, mimeType)",
-                pageSize=30,
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
-            
-            files = results.get('files', [])
-            logger.info(f"\n{project}フォルダ内の動画ファイル:")
-            for file in files:
-                if 'video' in file.get('mimeType', '') or any(ext in file['name'].lower() for ext in ['.mp4', '.mov', '.avi']):
-                    logger.info(f"  - {file['name']}")
+            file_info = self.mirror.lookup(folder_id, video_name)
         except Exception as e:
-            logger.error(f"フォルダ内容取得エラー: {e}")
+            logger.warning(f"Driveミラーを使わずにフォルダ一覧から検索します: {e}")
+            self.mirror = None
+            return None
+        if file_info:
+            logger.info(f"Driveミラーで発見: {file_info['name']}")
+        return file_info
+    
+    def _mirror_is_authoritative(self) -> bool:
+        """
+        ミラーにない動画をフォルダにもないとみなせるか（同期済みの場合）
+        サブフォルダのファイルはミラーの対象外のため、DRIVE_RECURSIVE_SEARCH では一覧も引く
+        """
+        return bool(self.mirror) and self.mirror.synced and not self.name_index.recursive
+    
+    def _list_folder_contents(self, folder_id: str, project: str, video_name: str):
+        """フォルダ内で動画名に近いファイルを表示（デバッグ用、ミラーまたは取得済みのインデックスから）"""
+        if self._mirror_is_authoritative():
+            from automation.near_miss_index import NearMissIndex
+            index = self._mirror_near_miss.get(folder_id)
+            if index is None:
+                index = self._mirror_near_miss[folder_id] = NearMissIndex(self.mirror.video_names(folder_id))
+            candidates = index.query(video_name, limit=self.NEAR_MISS_LIMIT)
+        else:
+            candidates = self.name_index.near_misses(folder_id, video_name, self.NEAR_MISS_LIMIT)
+        logger.info(f"\n{project}フォルダ内の近い名前の動画ファイル:")
+        for name, score in candidates:
+            logger.info(f"  - {name}（類似度 {score:.2f}）")
     
     def find_and_download(self, ad_name: str) -> Optional[Path]:
         """
@@ -281,24 +393,18 @@ class GoogleDriveFinder:
         Returns:
             Path: ダウンロードした動画ファイルのパス
         """
+        file_info = self.resolve_by_name(ad_name)
+        if not file_info:
+            return None
+        return self.download(file_info, ad_name)
+    
+    def resolve_by_name(self, ad_name: str) -> Optional[dict]:
+        """
+        広告名で動画を検索（ダウンロードはしない）
+        """
         try:
-            # 1. ファイルを検索
-            query_parts = [
-                f"name contains '{ad_name}'",
-                "mimeType contains 'video/'"
-            ]
-            
-            if self.folder_id:
-                query_parts.append(f"'{self.folder_id}' in parents")
-            
-            query = " and ".join(query_parts)
-            
             logger.info(f"Google Driveで検索: {ad_name}")
-            results = self.service.files().list(
-                q=query,
-                fields="files(id, name, mimeType)",
-                pageSize=10
-            ).execute()
+            results = self._name_search_request(ad_name).execute()
             
             files = results.get('files', [])
             
@@ -309,51 +415,53 @@ class GoogleDriveFinder:
             # 最初に見つかったファイルを使用
             file_info = files[0]
             logger.info(f"動画ファイル発見: {file_info['name']}")
-            
-            # 2. ファイルをダウンロード
-            return self._download_file(file_info['id'], file_info['name'], ad_name)
+            return file_info
             
         except Exception as e:
-            logger.error(f"検索・ダウンロードエラー: {e}")
+            logger.error(f"検索エラー: {e}")
             return None
     
-    def _download_file(self, file_id: str, file_name: str, ad_name: str) -> Optional[Path]:
+    def _name_search_request(self, ad_name: str):
+        """広告名を含む動画ファイルの検索リクエスト（未実行）"""
+        query_parts = [
+            f"name contains '{ad_name}'",
+            "mimeType contains 'video/'"
+        ]
+        
+        if self.folder_id:
+            query_parts.append(f"'{self.folder_id}' in parents")
+        
+        return self.service.files().list(
+            q=" and ".join(query_parts),
+            fields=f"files({self.FILE_FIELDS})",
+            pageSize=10
+        )
+    
+    def _download_file(self, file_info: dict, output_path: Path) -> Path:
         """
-        ファイルIDから動画をダウンロード
+        ファイルをダウンロードしてDriveのmd5Checksumと照合
+        RANGED_DOWNLOAD_MIN_MB以上のファイルは並列のRangeリクエストで取得する（同じ保存先なら中断した続きから）
         
         Args:
-            file_id: Google DriveのファイルID
-            file_name: オリジナルのファイル名
-            ad_name: 広告名
+            file_info: resolve_* で取得したファイル情報
+            output_path: 保存先
             
         Returns:
             Path: ダウンロードしたファイルのパス
-        """
-        try:
-            # 拡張子を取得
-            ext = Path(file_name).suffix or '.mp4'
-            output_path = self.temp_dir / f"{ad_name}{ext}"
-            
-            # ダウンロード実行
-            request = self.service.files().get_media(fileId=file_id)
-            
-            with open(output_path, 'wb') as f:
-                downloader = MediaIoBaseDownload(f, request)
-                done = False
-                
-                while not done:
-                    status, done = downloader.next_chunk()
-                    if status:
-                        progress = int(status.progress() * 100)
-                        if progress % 20 == 0:
-                            logger.info(f"ダウンロード進捗: {progress}%")
             
-            logger.info(f"ダウンロード完了: {output_path}")
-            return output_path
-            
-        except Exception as e:
-            logger.error(f"ダウンロードエラー: {e}")
-            return None
+        Raises:
+            ChecksumMismatchError: ダウンロードした内容がDriveのmd5Checksumと一致しない場合
+        """
+        from automation.source_cache import download_with_md5, verify_md5
+        
+        size = int(file_info.get('size') or 0)
+        if self.ranged_downloader and size >= self.ranged_min_bytes:
+            return self.ranged_downloader.download(file_info, output_path)
+        
+        md5 = download_with_md5(self.service, file_info['id'], output_path)
+        verify_md5(output_path, md5, file_info.get('md5Checksum'))
+        logger.info(f"ダウンロード完了（MD5一致）: {output_path}")
+        return output_path
     
     def list_videos(self, limit: int = 100):
         """
@@ -0,0 +1,174 @@
+"""
+見つからない動画名に近いファイル名の検索（トライグラム＋編集距離）
+フォルダの動画ファイル名（正規化したキー）から3文字単位の転置インデックスを作り、
+共通するトライグラムの多い候補を編集距離で並べ替えて上位を返す。数万件のフォルダでも1件数ミリ秒で引ける
+"""
+import heapq
+import logging
+from collections import Counter
+from operator import itemgetter
+from typing import Dict, Iterable, List, Tuple
+
+from automation.drive_name_index import name_key, normalize_name
+
+logger = logging.getLogger(__name__)
+
+# 編集距離で並べ替える候補数（返す件数がこれより多い場合はその件数）
+RERANK_CANDIDATES = 30
+# これより多くのファイル名に含まれるトライグラム（「_撮影」等）は候補の絞り込みに使わない
+COMMON_TRIGRAM_RATIO = 0.2
+COMMON_TRIGRAM_MIN_FILES = 1000
+
+
+def comparison_key(name: str) -> str:
+    return name.lower()
+
+
+def trigrams(key: str) -> List[str]:
+    """前後に空白を足した3文字ずつの集合（2文字以下の名前も比較できるように）"""
+    padded = f"  {key} "
+    return list({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+def edit_distance(a: str, b: str) -> int:
+    """レーベンシュタイン距離"""
+    # 表記揺れは名前の一部だけのことが多いため、共通の先頭・末尾を除いてから計算する
+    prefix = 0
+    while prefix < min(len(a), len(b)) and a[prefix] == b[prefix]:
+        prefix += 1
+    a, b = a[prefix:], b[prefix:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    """編集距離による類似度（1.0で一致）"""
+    if not a and not b:
+        return 1.0
+    return 1.0 - edit_distance(a, b) / max(len(a), len(b))
+
+
+class NearMissIndex:
+    """ファイル名のトライグラム転置インデックス"""
+
+    def __init__(self, file_names: Iterable[str]):
+        self.names: List[str] = []
+        self.keys: List[str] = []
+        self.sizes: List[int] = []
+        self.postings: Dict[str, List[int]] = {}
+        for file_name in file_names:
+            key = comparison_key(name_key(file_name))
+            grams = trigrams(key)
+            doc_id = len(self.names)
+            self.names.append(file_name)
+            self.keys.append(key)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(doc_id)
+        self.common_limit = max(COMMON_TRIGRAM_MIN_FILES, int(len(self.names) * COMMON_TRIGRAM_RATIO))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def query(self, video_name: str, limit: int = 5, min_similarity: float = 0.0) -> List[Tuple[str, float]]:
+        """
+        動画名に近いファイル名
+
+        Args:
+            video_name: 探した動画名（拡張子なし）
+            limit: 返す件数
+            min_similarity: これより似ていない候補は返さない
+
+        Returns:
+            [(ファイル名, 類似度 0.0〜1.0)] 類似度の高い順
+        """
+        key = comparison_key(normalize_name(video_name))
+        grams = [gram for gram in trigrams(key) if gram in self.postings]
+        if not grams:
+            return []
+        # 多くのファイルに共通するトライグラムは数え上げが重いうえ候補を区別しないため、
+        # ほかのトライグラムで候補が見つかる場合は使わない
+        rare = [gram for gram in grams if len(self.postings[gram]) <= self.common_limit]
+        shared = Counter()
+        for gram in rare or grams:
+            shared.update(self.postings[gram])
+
+        # 共通トライグラムの数で候補を絞り、割合（Dice係数）の上位を編集距離で並べ替える
+        rerank = max(RERANK_CANDIDATES, limit)
+        query_size = len(trigrams(key))
+        candidates = heapq.nlargest(
+            rerank,
+            heapq.nlargest(rerank * 4, shared.items(), key=itemgetter(1)),
+            key=lambda item: 2 * item[1] / (query_size + self.sizes[item[0]])
+        )
+        scored = [(self.names[doc_id], similarity(key, self.keys[doc_id])) for doc_id, _ in candidates]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return [(name, score) for name, score in scored[:limit] if score >= min_similarity]
+
+
+# ベンチマーク: インデックスの作成と検索の時間
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description='近い名前の検索インデックスのベンチマーク')
+    parser.add_argument('-n', '--files', type=int, default=50000, help='合成するファイル名の数')
+    parser.add_argument('-q', '--queries', type=int, default=200, help='検索回数')
+    parser.add_argument('--project', help='合成データの代わりに案件フォルダ（NB/OM/SBC）のファイル名を使う')
+    args = parser.parse_args()
+
+    random.seed(0)
+    if args.project:
+        from automation.google_drive_finder import GoogleDriveFinder
+
+        finder = GoogleDriveFinder()
+        names = finder.name_index.video_names(finder.PROJECT_FOLDERS[args.project])
+    else:
+        words = ['売れっ子イラストレーター', '老後は考えるな', 'お家で趣味のイラストをお仕事にする', 'AIツール素材',
+                 '副業', '在宅ワーク', '未経験OK', 'スキルアップ', 'フリー素材', '比較', '体験談', '初心者向け']
+        names = [
+            f"{random.choice(words)}_撮影{random.randint(1, 99):02d}_{random.choice(words)}"
+            f"{random.choice(['', '_v2', '_縦', '_横'])}_{i}.mp4"
+            for i in range(args.files)
+        ]
+    if not names:
+        raise SystemExit("ファイル名がありません")
+
+    def typo(name: str) -> str:
+        """1〜2文字の削除・置換・アンダースコアの欠落"""
+        stem = Path(name).stem
+        for _ in range(random.randint(1, 2)):
+            position = random.randrange(len(stem))
+            stem = random.choice([stem[:position] + stem[position + 1:],
+                                  stem[:position] + 'ー' + stem[position + 1:],
+                                  stem.replace('_', '', 1)])
+        return stem
+
+    start = time.perf_counter()
+    index = NearMissIndex(names)
+    build_time = time.perf_counter() - start
+
+    targets = [random.choice(names) for _ in range(args.queries)]
+    queries = [typo(name) for name in targets]
+    start = time.perf_counter()
+    results = [index.query(query, limit=5) for query in queries]
+    query_time = (time.perf_counter() - start) / len(queries)
+
+    top1 = sum(1 for target, result in zip(targets, results) if result and result[0][0] == target)
+    top5 = sum(1 for target, result in zip(targets, results) if target in [name for name, _ in result])
+    print(f"ファイル名: {len(index)}件, トライグラム: {len(index.postings)}種類")
+    print(f"  作成: {build_time * 1000:.1f} ms")
+    print(f"  検索: {query_time * 1000:.2f} ms/件（{len(queries)}件）")
+    print(f"  正解が1位: {top1 / len(queries):.0%} / 上位5件以内: {top5 / len(queries):.0%}")
+    print(f"  例: {queries[0]} → " + ", ".join(f"{name}（{score:.2f}）" for name, score in results[0][:3]))
@@ -0,0 +1,202 @@
+"""
+大きなGoogle Driveファイルの並列レンジダウンロード
+ファイルを一定サイズの区間に分け、複数のHTTP Rangeリクエストで同時に取得して事前に確保したファイルへ書き込む。
+完了した区間はサイドカー（<出力>.parts.json）に記録し、中断したダウンロードは残りの区間から再開する。
+完了後はDriveのmd5Checksumと照合し、ファイルごとのスループットをログと last_stats に残す
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from google.auth.transport.requests import AuthorizedSession
+
+from automation.source_cache import verify_md5
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DRIVE_MEDIA_URL = "https://www.googleapis.com/drive/v3/files/{file_id}?alt=media&supportsAllDrives=true"
+READ_SIZE = 1024 * 1024
+
+
+def file_md5(path: Path) -> str:
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RangedDownloader:
+    """DriveファイルをHTTP Rangeで並列にダウンロードする（中断再開・MD5照合付き）"""
+
+    def __init__(self, credentials, workers: Optional[int] = None, part_size: Optional[int] = None,
+                 retries: Optional[int] = None):
+        """
+        Args:
+            credentials: Google APIの認証情報（サービスアカウント等）
+            workers: 同時に取得する区間数
+            part_size: 区間のサイズ（バイト）
+            retries: 区間ごとの再試行回数（途中で切れた場合は受信済みの位置から再開）
+        """
+        self.credentials = credentials
+        self.workers = workers or Config.RANGED_DOWNLOAD_WORKERS
+        self.part_size = part_size or Config.RANGED_DOWNLOAD_PART_MB * 1024 * 1024
+        self.retries = Config.RANGED_DOWNLOAD_RETRIES if retries is None else retries
+        self._local = threading.local()
+        # 直近のダウンロードの計測値（バイト数・秒数・MB/s・再開したバイト数・再試行回数）
+        self.last_stats: Dict = {}
+
+    def _session(self) -> AuthorizedSession:
+        """スレッドごとのHTTPセッション（接続を区間間で使い回す）"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = AuthorizedSession(self.credentials)
+        return session
+
+    @staticmethod
+    def sidecar_path(output_path: Path) -> Path:
+        return Path(f"{output_path}.parts.json")
+
+    def _parts(self, size: int) -> List[Tuple[int, int]]:
+        return [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+
+    def _load_progress(self, file_info: dict, output_path: Path, size: int) -> Set[int]:
+        """前回の中断時点で完了していた区間（同じファイル・同じ区切りの場合のみ）"""
+        sidecar = self.sidecar_path(output_path)
+        try:
+            with open(sidecar, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        same_file = (state.get('file_id'), state.get('md5Checksum'), state.get('size'), state.get('part_size')) == \
+            (file_info['id'], file_info.get('md5Checksum'), size, self.part_size)
+        if not same_file or not output_path.exists() or output_path.stat().st_size != size:
+            return set()
+        return set(state.get('completed', []))
+
+    def _save_progress(self, file_info: dict, output_path: Path, size: int, completed: Set[int]):
+        sidecar = self.sidecar_path(output_path)
+        tmp_path = f"{sidecar}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'file_id': file_info['id'],
+                'md5Checksum': file_info.get('md5Checksum'),
+                'size': size,
+                'part_size': self.part_size,
+                'completed': sorted(completed),
+            }, f)
+        os.replace(tmp_path, sidecar)
+
+    def _fetch_part(self, url: str, fd: int, start: int, end: int, on_bytes) -> int:
+        """
+        区間 [start, end] を取得してファイルの同じ位置に書き込む
+
+        Returns:
+            再試行した回数
+        """
+        position = start
+        attempt = 0
+        while True:
+            try:
+                with self._session().get(url, headers={'Range': f"bytes={position}-{end}"},
+                                         stream=True, timeout=60) as response:
+                    if response.status_code != 206:
+                        raise IOError(f"Rangeリクエストが受け付けられません: HTTP {response.status_code}")
+                    for chunk in response.iter_content(READ_SIZE):
+                        os.pwrite(fd, chunk, position)
+                        position += len(chunk)
+                        on_bytes(len(chunk))
+                if position != end + 1:
+                    raise IOError(f"区間の途中で切断されました: {position}/{end + 1}")
+                return attempt
+            except Exception as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                logger.warning(f"区間 {start}-{end} を {position} から再試行します（{attempt}/{self.retries}）: {e}")
+                time.sleep(min(2 ** attempt, 30))
+
+    def download(self, file_info: dict, output_path: Path) -> Path:
+        """
+        ダウンロードしてDriveのmd5Checksumと照合
+
+        Raises:
+            ChecksumMismatchError: 内容が一致しない場合（ファイルと進捗は削除し、次回は最初から取得する）
+        """
+        output_path = Path(output_path)
+        size = int(file_info['size'])
+        url = DRIVE_MEDIA_URL.format(file_id=file_info['id'])
+        parts = self._parts(size)
+        completed = self._load_progress(file_info, output_path, size)
+
+        if not completed:
+            # 全体のサイズを先に確保し、各区間は自分の位置に書き込む
+            with open(output_path, 'wb') as f:
+                f.truncate(size)
+        resumed_bytes = sum(end - start + 1 for index, (start, end) in enumerate(parts) if index in completed)
+        if completed:
+            logger.info(f"中断したダウンロードを再開: {output_path.name}（{resumed_bytes / 1024 / 1024:.1f}MB 取得済み）")
+
+        lock = threading.Lock()
+        progress = {'bytes': resumed_bytes, 'logged': resumed_bytes * 10 // max(size, 1), 'retries': 0}
+        started = time.time()
+
+        def on_bytes(count: int):
+            with lock:
+                progress['bytes'] += count
+                step = progress['bytes'] * 10 // size
+                if step > progress['logged']:
+                    progress['logged'] = step
+                    elapsed = time.time() - started
+                    rate = (progress['bytes'] - resumed_bytes) / 1024 / 1024 / max(elapsed, 1e-6)
+                    logger.info(f"ダウンロード進捗: {step * 10}%（{rate:.1f}MB/s）")
+
+        def fetch(index: int):
+            start, end = parts[index]
+            retries = self._fetch_part(url, fd, start, end, on_bytes)
+            with lock:
+                completed.add(index)
+                progress['retries'] += retries
+                self._save_progress(file_info, output_path, size, completed)
+
+        fd = os.open(output_path, os.O_WRONLY)
+        try:
+            pending = [index for index in range(len(parts)) if index not in completed]
+            with ThreadPoolExecutor(max_workers=min(self.workers, max(len(pending), 1))) as executor:
+                for future in [executor.submit(fetch, index) for index in pending]:
+                    future.result()
+        finally:
+            os.close(fd)
+
+        elapsed = time.time() - started
+        downloaded = size - resumed_bytes
+        self.last_stats = {
+            'file_id': file_info['id'],
+            'bytes': size,
+            'downloaded_bytes': downloaded,
+            'resumed_bytes': resumed_bytes,
+            'seconds': elapsed,
+            'mb_per_second': downloaded / 1024 / 1024 / max(elapsed, 1e-6),
+            'parts': len(parts),
+            'workers': self.workers,
+            'retries': progress['retries'],
+        }
+
+        try:
+            verify_md5(output_path, file_md5(output_path), file_info.get('md5Checksum'))
+        finally:
+            # 一致しなかった場合も壊れた区間を特定できないため、次回は最初から取り直す
+            self.sidecar_path(output_path).unlink(missing_ok=True)
+        logger.info(
+            f"ダウンロード完了（MD5一致）: {output_path.name} {size / 1024 / 1024:.1f}MB / {elapsed:.1f}秒 "
+            f"= {self.last_stats['mb_per_second']:.1f}MB/s（{len(parts)}区間, {self.workers}並列, "
+            f"再開 {resumed_bytes / 1024 / 1024:.1f}MB, 再試行 {progress['retries']}回）"
+        )
+        return output_path
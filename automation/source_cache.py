@@ -0,0 +1,166 @@
+"""
+Google Driveの元動画のキャッシュ
+DriveのファイルIDとmd5Checksumをキーに、ダウンロードした元動画を実行間で保持する（容量上限付きLRU）。
+ヒットした場合はダウンロードせず、ミスした場合はダウンロードしてMD5をDriveの値と照合する。
+ダウンロード中のファイルはキャッシュ内に置くため、中断しても次の実行で続きから取得できる
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from googleapiclient.http import MediaIoBaseDownload
+
+from config import Config
+from file_cache import FileCache, link_or_copy
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class ChecksumMismatchError(IOError):
+    """ダウンロードした内容がDriveのmd5Checksumと一致しない"""
+
+
+class Md5Writer:
+    """書き込みながらMD5を計算するファイルラッパー（MediaIoBaseDownloadの書き込み先）"""
+
+    def __init__(self, file):
+        self.file = file
+        self.md5 = hashlib.md5()
+        self.bytes_written = 0
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.md5.update(data)
+        self.bytes_written += len(data)
+
+
+def download_with_md5(service, file_id: str, output_path: Path) -> str:
+    """
+    Driveのファイルをダウンロードし、内容のMD5（16進）を返す
+    ファイルを読み直さずに、受信したデータからそのまま計算する
+    """
+    request = service.files().get_media(fileId=file_id)
+    with open(output_path, 'wb') as f:
+        writer = Md5Writer(f)
+        downloader = MediaIoBaseDownload(writer, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+        done = False
+        last_logged = -1
+        while not done:
+            status, done = downloader.next_chunk()
+            if status:
+                progress = int(status.progress() * 100)
+                if progress // 20 != last_logged // 20:
+                    last_logged = progress
+                    logger.info(f"ダウンロード進捗: {progress}%")
+    return writer.md5.hexdigest()
+
+
+def verify_md5(path: Path, actual: str, expected: Optional[str]):
+    """
+    Raises:
+        ChecksumMismatchError: 一致しない場合（ダウンロードしたファイルは削除する）
+    """
+    if expected and actual != expected:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        raise ChecksumMismatchError(f"MD5が一致しません: {Path(path).name}（{actual} / Drive {expected}）")
+
+
+class SourceCache(FileCache):
+    """元動画のキャッシュ（キーはDriveのファイルID＋md5Checksum）"""
+
+    PARTIAL_PREFIX = '.partial_'
+    # この時間更新されていないダウンロード途中のファイルは削除する
+    PARTIAL_MAX_AGE_HOURS = 24
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        super().__init__(
+            root or Config.SOURCE_CACHE_DIR,
+            Config.SOURCE_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes,
+            name='元動画キャッシュ'
+        )
+        # 同じ元動画を複数のジョブが同時に取得しないよう、キーごとに直列化する
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._key_locks_guard = threading.Lock()
+        self._remove_stale_partials()
+
+    def _remove_stale_partials(self):
+        expire_before = time.time() - self.PARTIAL_MAX_AGE_HOURS * 3600
+        for path in self.root.glob(f"{self.PARTIAL_PREFIX}*"):
+            try:
+                if path.stat().st_mtime < expire_before:
+                    path.unlink()
+                    logger.info(f"{self.name} 途中のダウンロードを削除（期限切れ）: {path.name}")
+            except FileNotFoundError:
+                pass
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._key_locks_guard:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def key_for(file_info: dict) -> Optional[str]:
+        """キャッシュキー（md5Checksumがないファイル（Googleドキュメント等）はキャッシュしない）"""
+        if not file_info.get('md5Checksum'):
+            return None
+        return f"{file_info['id']}_{file_info['md5Checksum']}"
+
+    def contains(self, file_info: dict) -> bool:
+        key = self.key_for(file_info)
+        return bool(key) and self.path_for(key).is_file()
+
+    def fetch(self, file_info: dict, output_path: Path, download: Callable[[dict, Path], Path]) -> Path:
+        """
+        元動画を output_path に用意する（ヒットすればキャッシュからリンク、ミスすればダウンロードして登録）
+
+        Args:
+            download: ダウンロードしてmd5Checksumと照合する関数（file_info, 保存先）
+                      保存先はキャッシュ内の途中ファイルで、中断した場合は次回同じパスで呼ばれる
+
+        Raises:
+            ChecksumMismatchError: ダウンロードした内容がDriveのmd5Checksumと一致しない場合
+        """
+        output_path = Path(output_path)
+        if output_path.exists():
+            output_path.unlink()
+
+        key = self.key_for(file_info)
+        if not key:
+            return download(file_info, output_path)
+
+        with self._key_lock(key):
+            cached = self.get(key)
+            if not cached:
+                partial = self.root / f"{self.PARTIAL_PREFIX}{key}"
+                download(file_info, partial)
+                cached = self.store(key, partial, file_info, move=True)
+                if not cached:
+                    # 登録できなかった場合はダウンロードしたファイルをそのまま使う
+                    os.replace(partial, output_path)
+                    return output_path
+            else:
+                logger.info(f"ダウンロード省略（キャッシュ済み）: {output_path}")
+            link_or_copy(str(cached), str(output_path))
+        return output_path
+
+    def store(self, key: str, path: Path, file_info: dict, move: bool = False) -> Optional[Path]:
+        """ダウンロード済みの元動画を登録（失敗しても処理は続けられるため警告のみ）"""
+        try:
+            return self.put(key, str(path), {
+                'drive_file_id': file_info['id'],
+                'drive_file_name': file_info['name'],
+                'md5Checksum': file_info['md5Checksum'],
+                'cached_at': datetime.now().isoformat(),
+            }, move=move)
+        except OSError as e:
+            logger.warning(f"元動画キャッシュへの登録に失敗しました: {e}")
+            return None
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+複数動画の一括合成
+ディレクトリ・globパターン・マニフェスト（JSON/CSV）で指定した動画をプロセスプールで並列に合成する
+"""
+
+import csv
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import Config
+from resource_scheduler import ResourceScheduler
+from video_merger_auto_bg import VideoMergerWithAutoBG
+
+logger = logging.getLogger(__name__)
+
+
+def _is_video_file(path: Path) -> bool:
+    return path.is_file() and path.suffix.lower().lstrip('.') in Config.ALLOWED_EXTENSIONS
+
+
+def load_jobs(source: str, output_dir: str, main_scale: float = Config.DEFAULT_MAIN_SCALE,
+              disclaimer_text: Optional[str] = Config.DEFAULT_DISCLAIMER_TEXT) -> List[Dict]:
+    """
+    入力指定からジョブ一覧を作成
+
+    Args:
+        source: ディレクトリ、globパターン、またはマニフェスト（.json / .csv）
+            マニフェストの各項目: main_video（必須）, output_video, main_scale,
+            disclaimer_text, share_background
+        output_dir: output_video省略時の出力先ディレクトリ
+
+    Returns:
+        [{'main_video', 'output_video', 'main_scale', 'disclaimer_text', 'share_background'}, ...]
+    """
+    source_path = Path(source)
+    entries: List[Dict] = []
+
+    if source_path.is_dir():
+        entries = [{'main_video': str(p)} for p in sorted(source_path.iterdir()) if _is_video_file(p)]
+    elif source_path.suffix.lower() == '.json' and source_path.is_file():
+        with open(source_path, encoding='utf-8') as f:
+            data = json.load(f)
+        entries = data['jobs'] if isinstance(data, dict) else data
+    elif source_path.suffix.lower() == '.csv' and source_path.is_file():
+        with open(source_path, encoding='utf-8', newline='') as f:
+            entries = [{k: v for k, v in row.items() if v not in (None, '')} for row in csv.DictReader(f)]
+    else:
+        entries = [{'main_video': p} for p in sorted(glob.glob(source)) if _is_video_file(Path(p))]
+
+    jobs = []
+    for entry in entries:
+        main_video = entry['main_video']
+        output_video = entry.get('output_video') or str(
+            Path(output_dir) / f"{Path(main_video).stem}_merged.mp4"
+        )
+        share_background = entry.get('share_background', True)
+        if isinstance(share_background, str):
+            share_background = share_background.strip().lower() not in ('false', '0', 'no', '')
+        jobs.append({
+            'main_video': main_video,
+            'output_video': output_video,
+            'main_scale': float(entry.get('main_scale', main_scale)),
+            'disclaimer_text': entry.get('disclaimer_text', disclaimer_text),
+            'share_background': share_background,
+        })
+    return jobs
+
+
+def _run_job(job: Dict) -> Dict:
+    """ワーカープロセスで1件を合成（プロセスプールから呼ばれるためモジュール関数）"""
+    merger = VideoMergerWithAutoBG()
+    output_video = job['output_video']
+    # 途中で止まった出力を完了扱いにしないよう、一時ファイルに書いてから置き換える
+    partial_path = str(Path(output_video).with_suffix('.partial' + Path(output_video).suffix))
+    start = time.time()
+    try:
+        if job.get('background_video'):
+            # 並列ジョブ同士でコアを奪い合うため、セグメント並列は使わない
+            result = merger.merge_videos(
+                job['main_video'], job['background_video'], partial_path,
+                job['main_scale'], job['disclaimer_text'], parallel=False, threads=job.get('threads')
+            )
+        else:
+            result = merger.process_with_auto_background(
+                job['main_video'], partial_path,
+                main_scale=job['main_scale'], disclaimer_text=job['disclaimer_text'], parallel=False,
+                threads=job.get('threads')
+            )
+        os.replace(partial_path, output_video)
+    except Exception as e:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return {'job': job, 'status': 'failed', 'error': str(e), 'elapsed': time.time() - start}
+
+    info = merger.get_video_info(job['main_video'])
+    return {
+        'job': job,
+        'status': 'done',
+        'elapsed': time.time() - start,
+        'duration': result['duration'],
+        'frames': result['duration'] * (info.get('fps') or 30),
+        'bytes': os.path.getsize(output_video),
+    }
+
+
+class BatchMerger:
+    """ジョブ一覧をプロセスプールで合成し、スループットを集計する"""
+
+    def __init__(self, workers: int = Config.BATCH_WORKERS, background_video: Optional[str] = None,
+                 overwrite: bool = False):
+        """
+        Args:
+            workers: 同時に実行する合成数
+            background_video: 全ジョブ共通で使う背景動画（省略時は向きごとに1本生成して共有）
+            overwrite: 既存の出力を作り直すか（Falseなら既存出力はスキップして再開）
+        """
+        self.workers = max(1, workers)
+        self.background_video = background_video
+        self.overwrite = overwrite
+        self.merger = VideoMergerWithAutoBG()
+
+    def _prepare_backgrounds(self, jobs: List[Dict], infos: List[Dict], generated: List[str]):
+        """
+        共有可能なジョブに背景を割り当てる
+        生成した一時背景は途中で失敗しても削除できるよう、生成した時点で generated に追加する
+        """
+        shared = {}
+        for job, info in zip(jobs, infos):
+            if self.background_video:
+                job['background_video'] = self.background_video
+                continue
+            if not job['share_background']:
+                continue
+
+            orientation = info['orientation']
+            if orientation not in shared:
+                logger.info(f"共有背景を生成: {orientation}")
+                bg_video = self.merger.generate_background_with_replicate(orientation, info['duration'])
+                if not bg_video:
+                    raise RuntimeError("背景動画の生成に失敗しました")
+                generated.append(bg_video)
+                shared[orientation] = bg_video
+            job['background_video'] = shared[orientation]
+
+    def run(self, jobs: List[Dict]) -> Dict:
+        """
+        ジョブを実行してサマリーを返す
+
+        Returns:
+            {'done', 'skipped', 'failed', 'elapsed', 'videos_per_min', 'encode_fps', 'total_bytes', 'results'}
+        """
+        pending = []
+        skipped = 0
+        for job in jobs:
+            output = Path(job['output_video'])
+            if not self.overwrite and output.exists() and output.stat().st_size > 0:
+                logger.info(f"出力済みのためスキップ: {output}")
+                skipped += 1
+                continue
+            output.parent.mkdir(parents=True, exist_ok=True)
+            pending.append(job)
+
+        # 同時実行数をコア数以内に抑え、コアをジョブ間で分け合う
+        work_dir = os.path.commonpath([str(Path(job['output_video']).parent.resolve()) for job in pending]) \
+            if pending else '.'
+        scheduler = ResourceScheduler(work_dir, max_jobs=self.workers)
+        threads = scheduler.thread_budget()
+        print(f"ジョブ: {len(jobs)}件（実行 {len(pending)}件, スキップ {skipped}件, "
+              f"{scheduler.max_jobs}並列, 各{threads}スレッド）")
+
+        start = time.time()
+        results = []
+        generated_backgrounds = []
+        try:
+            # 読めない入力はそのジョブだけ失敗にして、残りのジョブは続ける
+            runnable, infos = [], []
+            for job in pending:
+                try:
+                    info = self.merger.get_video_info(job['main_video'])
+                except Exception as e:
+                    results.append({'job': job, 'status': 'failed', 'error': str(e), 'elapsed': 0.0})
+                    print(f"❌ {job['main_video']}: {e}")
+                    continue
+                runnable.append(job)
+                infos.append(info)
+
+            self._prepare_backgrounds(runnable, infos, generated_backgrounds)
+            with ProcessPoolExecutor(max_workers=scheduler.max_jobs) as executor:
+                futures = []
+                for job, info in zip(runnable, infos):
+                    # 推定メモリ・空き容量が足りるまで次のジョブを投入しない
+                    width, height, _ = self.merger.determine_output_size(info)
+                    token = scheduler.acquire(scheduler.estimate(info, width, height))
+                    future = executor.submit(_run_job, dict(job, threads=threads))
+                    future.add_done_callback(lambda _, token=token: scheduler.release(token))
+                    futures.append(future)
+                for future in as_completed(futures):
+                    result = future.result()
+                    results.append(result)
+                    if result['status'] == 'done':
+                        print(f"✅ [{len(results)}/{len(pending)}] {result['job']['output_video']} "
+                              f"({result['elapsed']:.1f}秒)")
+                    else:
+                        print(f"❌ [{len(results)}/{len(pending)}] {result['job']['main_video']}: {result['error']}")
+        finally:
+            for bg_video in generated_backgrounds:
+                if os.path.exists(bg_video):
+                    os.remove(bg_video)
+
+        elapsed = time.time() - start
+        done = [r for r in results if r['status'] == 'done']
+        total_frames = sum(r['frames'] for r in done)
+        return {
+            'done': len(done),
+            'skipped': skipped,
+            'failed': len(results) - len(done),
+            'elapsed': elapsed,
+            'videos_per_min': len(done) / (elapsed / 60) if elapsed > 0 else 0.0,
+            'encode_fps': total_frames / elapsed if elapsed > 0 else 0.0,
+            'total_bytes': sum(r['bytes'] for r in done),
+            'results': results,
+        }
+
+
+def print_summary(summary: Dict):
+    """スループットのサマリーを表示"""
+    print(f"\n{'=' * 40}")
+    print("📊 一括合成サマリー")
+    print(f"   成功: {summary['done']}件 / 失敗: {summary['failed']}件 / スキップ: {summary['skipped']}件")
+    print(f"   所要時間: {summary['elapsed']:.1f}秒")
+    print(f"   スループット: {summary['videos_per_min']:.2f} 本/分")
+    print(f"   エンコード速度: {summary['encode_fps']:.1f} fps")
+    print(f"   出力合計: {summary['total_bytes'] / 1024 / 1024:.1f} MB")
+    print(f"{'=' * 40}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='動画の一括合成')
+    parser.add_argument('source', help='入力ディレクトリ、globパターン、またはマニフェスト（.json/.csv）')
+    parser.add_argument('--output-dir', default=Config.OUTPUT_FOLDER, help='出力先ディレクトリ')
+    parser.add_argument('--workers', type=int, default=Config.BATCH_WORKERS, help='同時合成数')
+    parser.add_argument('--background', help='全動画で共通に使う背景動画')
+    parser.add_argument('--main-scale', type=float, default=Config.DEFAULT_MAIN_SCALE,
+                        help='メイン動画のスケール（0.1-1.0）')
+    parser.add_argument('--text', default=Config.DEFAULT_DISCLAIMER_TEXT, help='注意書きテキスト')
+    parser.add_argument('--overwrite', action='store_true', help='既存の出力も作り直す')
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.source, args.output_dir, args.main_scale, args.text)
+    if not jobs:
+        print(f"対象の動画が見つかりません: {args.source}")
+        return 1
+
+    batch = BatchMerger(workers=args.workers, background_video=args.background, overwrite=args.overwrite)
+    summary = batch.run(jobs)
+    print_summary(summary)
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
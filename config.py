@@ -1,5 +1,7 @@
 import os
 import platform
+import tempfile
+from functools import lru_cache
 
 class Config:
     """アプリケーション設定"""
@@ -44,8 +46,9 @@ class Config:
             ]
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_font_path():
-        """最初に見つかった有効なフォントパスを返す"""
+        """最初に見つかった有効なフォントパスを返す（プロセス内で一度だけ探索）"""
         font_paths = Config.get_font_paths()
         for font_path in font_paths:
             if os.path.exists(font_path):
@@ -61,6 +64,98 @@ class Config:
     VERTICAL_FONT_SIZE = 28
     TEXT_BOX_PADDING = 15
     
+    # 免責事項オーバーレイPNGのキャッシュ先
+    DISCLAIMER_CACHE_DIR = os.environ.get(
+        'DISCLAIMER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'disclaimer_cache'))
+    
+    # 出力キャンバス（短辺の候補）。元動画の短辺以上で最小のものを使い、なければ最大のもの
+    OUTPUT_CANVAS_LADDER = [int(v) for v in os.environ.get('OUTPUT_CANVAS_LADDER', '720,1080').split(',')]
+    # 出力フレームレートの上限（0: 元動画のまま）
+    MAX_OUTPUT_FPS = float(os.environ.get('MAX_OUTPUT_FPS', '0'))
+    
+    # ドラフト（確認用プロキシ）の設定
+    DRAFT_SHORT_SIDE = int(os.environ.get('DRAFT_SHORT_SIDE', '360'))
+    DRAFT_MAX_FPS = 15
+    DRAFT_PRESET = 'ultrafast'
+    DRAFT_CRF = 30
+    DRAFT_SECONDS = float(os.environ.get('DRAFT_SECONDS', '10'))  # 0: 全体
+    DRAFT_BACKGROUND_COLOR = '0x3a5a40'  # 仮の背景色
+    
+    # レート制御（0: 無効）。出力サイズ上限（MB）または長さ当たりの上限ビットレート（kbps）
+    RATE_CONTROL_MAX_SIZE_MB = float(os.environ.get('RATE_CONTROL_MAX_SIZE_MB', '0'))
+    RATE_CONTROL_MAX_KBPS = float(os.environ.get('RATE_CONTROL_MAX_KBPS', '0'))
+    RATE_CONTROL_SAMPLES = 3  # 複雑さ計測のサンプル数
+    RATE_CONTROL_SAMPLE_SECONDS = 2.0  # サンプル1つの長さ
+    RATE_CONTROL_PROBE_CRF = 23  # 試しエンコードのCRF
+    RATE_CONTROL_MAX_CRF = 32  # これ以上は画質劣化が目立つため上げない
+    RATE_CONTROL_MIN_VIDEO_KBPS = 500
+    
+    # 並列合成設定（長尺動画をキーフレーム境界で分割して並列エンコード）
+    PARALLEL_MERGE_MIN_DURATION = float(os.environ.get('PARALLEL_MERGE_MIN_DURATION', '45'))  # 秒
+    PARALLEL_MERGE_WORKERS = int(os.environ.get('PARALLEL_MERGE_WORKERS', '0'))  # 0: CPU数から自動
+    PARALLEL_SEGMENT_MIN_SECONDS = 10  # 1セグメントの最短長
+    
+    # ffmpeg実行管理（秒）
+    FFMPEG_TIMEOUT = float(os.environ.get('FFMPEG_TIMEOUT', '1200'))  # 0: 無制限
+    FFMPEG_STALL_TIMEOUT = float(os.environ.get('FFMPEG_STALL_TIMEOUT', '60'))
+    FFPROBE_TIMEOUT = float(os.environ.get('FFPROBE_TIMEOUT', '30'))
+    FFMPEG_PROGRESS_LOG_INTERVAL = 10
+    FFMPEG_STDERR_TAIL_LINES = 30
+    
+    # エンコードプロファイル（encode_tuner.pyで作成）
+    ENCODE_PROFILE_PATH = os.environ.get(
+        'ENCODE_PROFILE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'encode_profiles.json'))
+    # 長さの区分（名前, 上限秒）
+    ENCODE_DURATION_BUCKETS = [('short', 15), ('medium', 60), ('long', float('inf'))]
+    
+    # 一括合成の同時実行数
+    BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '2'))
+    
+    # Driveからのダウンロード中に合成を始める（moovが先頭にあるMP4のみ、それ以外はダウンロード完了後）
+    STREAM_DRIVE_DOWNLOAD = os.environ.get('STREAM_DRIVE_DOWNLOAD', '0') == '1'
+    STREAM_HEADER_MAX_MB = 16  # 先頭でmoovを探す上限
+    STREAM_STALL_TIMEOUT = float(os.environ.get('STREAM_STALL_TIMEOUT', '120'))  # 秒
+    
+    # 合成中の動画をYouTubeにアップロードする（断片化MP4で出力し、書き込み済みの範囲から送る）
+    UPLOAD_WHILE_ENCODING = os.environ.get('UPLOAD_WHILE_ENCODING', '0') == '1'
+    PROGRESSIVE_UPLOAD_CHUNK_MB = 8  # レジューマブルアップロードのチャンク（256KBの倍数）
+    
+    # Google Driveの案件フォルダのメタデータミラー（SQLite、Changes APIで差分同期。空文字で無効）
+    DRIVE_MIRROR_PATH = os.environ.get('DRIVE_MIRROR_PATH', os.path.join(tempfile.gettempdir(), 'drive_mirror.sqlite3'))
+    
+    # 案件フォルダのサブフォルダも幅優先でたどって動画を探す（同じ階層のフォルダはDRIVE_LIST_WORKERS個ずつ並列に取得）
+    DRIVE_RECURSIVE_SEARCH = os.environ.get('DRIVE_RECURSIVE_SEARCH', '0') == '1'
+    DRIVE_LIST_WORKERS = int(os.environ.get('DRIVE_LIST_WORKERS', '8'))
+    
+    # Google Driveの元動画のキャッシュ（ファイルID＋md5Checksum。永続ボリュームを指定すれば実行間で共有、空文字で無効）
+    SOURCE_CACHE_DIR = os.environ.get('SOURCE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'source_cache'))
+    SOURCE_CACHE_MAX_MB = int(os.environ.get('SOURCE_CACHE_MAX_MB', '4096'))
+    
+    # 大きな元動画の並列レンジダウンロード（区間ごとに同時取得し、中断しても続きから再開。1で無効）
+    RANGED_DOWNLOAD_WORKERS = int(os.environ.get('RANGED_DOWNLOAD_WORKERS', '4'))
+    RANGED_DOWNLOAD_PART_MB = int(os.environ.get('RANGED_DOWNLOAD_PART_MB', '16'))
+    RANGED_DOWNLOAD_MIN_MB = int(os.environ.get('RANGED_DOWNLOAD_MIN_MB', '64'))  # これより小さいファイルは1接続で取得
+    RANGED_DOWNLOAD_RETRIES = 5  # 区間ごと（受信済みの位置から再開）
+    
+    # 合成済み動画のキャッシュ（アップロード失敗時の再エンコード防止）
+    RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'render_cache'))
+    RENDER_CACHE_MAX_MB = int(os.environ.get('RENDER_CACHE_MAX_MB', '2048'))
+    
+    # 同時実行ジョブの資源管理（resource_scheduler.pyでキャリブレーション）
+    RESOURCE_CALIBRATION_PATH = os.environ.get(
+        'RESOURCE_CALIBRATION_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resource_calibration.json'))
+    RESOURCE_MEMORY_RESERVE_MB = int(os.environ.get('RESOURCE_MEMORY_RESERVE_MB', '512'))  # OS等に残す分
+    RESOURCE_DISK_RESERVE_MB = int(os.environ.get('RESOURCE_DISK_RESERVE_MB', '1024'))
+    
+    # ジョブごとの作業フォルダ（workspace.py）
+    WORKSPACE_DIR = os.environ.get('WORKSPACE_DIR', os.path.join(tempfile.gettempdir(), 'video_merger_workspace'))
+    WORKSPACE_MAX_MB = int(os.environ.get('WORKSPACE_MAX_MB', '10240'))  # 合計の上限（0で無制限）
+    WORKSPACE_RETENTION_HOURS = float(os.environ.get('WORKSPACE_RETENTION_HOURS', '24'))  # 終了後に残す時間
+    # 中間ファイル（セグメント・試しエンコード）の置き場所。/dev/shm 等を指定するとRAM上で処理する
+    WORKSPACE_SCRATCH_DIR = os.environ.get('WORKSPACE_SCRATCH_DIR', '')
+    WORKSPACE_SCRATCH_MIN_FREE_MB = int(os.environ.get('WORKSPACE_SCRATCH_MIN_FREE_MB', '1024'))
+    
     # Replicate API設定
     REPLICATE_MODEL_VERSION = "b6519549e375404f45af5ef2e4b01f651d4014f3b57d3270b430e0523bad9835"
     VIDEO_DURATION = 5  # 秒
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+免責事項テキストの画像化
+drawtextで毎フレーム描画する代わりに、Pillowで一度だけ透過PNGを作成してキャッシュする
+"""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import Config
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# drawtextの boxcolor=gray@0.7 に相当
+BOX_COLOR = (128, 128, 128, int(255 * 0.7))
+TEXT_COLOR = (255, 255, 255, 255)
+# drawtextの y=20 からボックス余白を引いた位置
+TEXT_TOP = 20
+
+# プロセス内キャッシュ（キー → PNGパス）
+_overlay_cache: Dict[str, str] = {}
+
+
+def overlay_cache_key(text: str, font_path: str, font_size: int, orientation: str,
+                      padding: Optional[int] = None) -> str:
+    """テキスト・フォント・サイズ・向き・余白からキャッシュキーを作成"""
+    padding = Config.TEXT_BOX_PADDING if padding is None else padding
+    source = "\0".join([text, font_path, str(font_size), orientation, str(padding)])
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+
+
+def render_disclaimer_overlay(text: str, font_path: str, font_size: int,
+                              orientation: str, padding: Optional[int] = None) -> Optional[str]:
+    """
+    免責事項テキストを背景ボックス付きの透過PNGとして描画
+
+    Args:
+        padding: ボックスの余白（省略時は Config.TEXT_BOX_PADDING）
+
+    Returns:
+        PNGファイルのパス。Pillowが使えない場合はNone
+    """
+    if not PIL_AVAILABLE:
+        return None
+
+    padding = Config.TEXT_BOX_PADDING if padding is None else padding
+    key = overlay_cache_key(text, font_path, font_size, orientation, padding)
+    cached = _overlay_cache.get(key)
+    if cached and os.path.exists(cached):
+        return cached
+
+    cache_dir = Path(Config.DISCLAIMER_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    output_path = cache_dir / f"disclaimer_{key}.png"
+
+    if not output_path.exists():
+        font = ImageFont.truetype(font_path, font_size)
+        left, _top, right, _bottom = font.getbbox(text)
+        ascent, descent = font.getmetrics()
+        text_width = right - left
+        text_height = ascent + descent
+
+        image = Image.new('RGBA', (text_width + padding * 2, text_height + padding * 2), BOX_COLOR)
+        draw = ImageDraw.Draw(image)
+        draw.text((padding - left, padding), text, font=font, fill=TEXT_COLOR)
+
+        # 並行実行でも壊れたPNGを読まないよう一時ファイルから置き換える
+        tmp_path = output_path.with_suffix(f".{os.getpid()}.tmp")
+        image.save(tmp_path, format='PNG')
+        os.replace(tmp_path, output_path)
+        logger.info(f"免責事項オーバーレイを作成: {output_path}")
+
+    _overlay_cache[key] = str(output_path)
+    return str(output_path)
+
+
+def overlay_position(padding: Optional[int] = None, top: int = TEXT_TOP) -> str:
+    """オーバーレイ画像の配置（drawtextの x=(w-text_w)/2:y=top と同じ位置）"""
+    padding = Config.TEXT_BOX_PADDING if padding is None else padding
+    return f"x=(W-w)/2:y={top - padding}"
+
+
+# ベンチマーク: drawtextとPNGオーバーレイのエンコード速度比較（1080x1920）
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import time
+    from ffmpeg_runner import run_ffmpeg
+    from video_merger_auto_bg import VideoMergerWithAutoBG
+
+    parser = argparse.ArgumentParser(description='免責事項の描画方式ごとのエンコード速度比較')
+    parser.add_argument('--duration', type=float, default=15, help='テスト動画の長さ（秒）')
+    parser.add_argument('--text', default=Config.DEFAULT_DISCLAIMER_TEXT, help='免責事項テキスト')
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='disclaimer_bench_'))
+    main_video = str(work_dir / 'main.mp4')
+    bg_video = str(work_dir / 'bg.mp4')
+
+    # 1080x1920のテスト素材を生成
+    run_ffmpeg([
+        'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f'testsrc2=size=1080x1920:rate=30:duration={args.duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={args.duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', '-y', main_video
+    ], label='テスト素材')
+    run_ffmpeg([
+        'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'mandelbrot=size=480x852:rate=30',
+        '-t', '5', '-c:v', 'libx264', '-preset', 'ultrafast', '-y', bg_video
+    ], label='テスト背景')
+
+    merger = VideoMergerWithAutoBG()
+    timings = {}
+    for label, rasterized in (('drawtext', False), ('PNGオーバーレイ', True)):
+        merger.use_rasterized_disclaimer = rasterized
+        start = time.perf_counter()
+        merger.merge_videos(main_video, bg_video, str(work_dir / f'out_{int(rasterized)}.mp4'),
+                            disclaimer_text=args.text)
+        timings[label] = time.perf_counter() - start
+
+    print("\n=== エンコード時間（1080x1920） ===")
+    for label, elapsed in timings.items():
+        print(f"  {label}: {elapsed:.2f}秒 ({args.duration / elapsed:.2f}x 実時間)")
+    print(f"  作業ディレクトリ: {work_dir}")
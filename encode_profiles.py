@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+エンコード設定（プロファイル）の管理
+向き×長さの区分ごとに、チューナーで選んだ preset / CRF / tune / threads を保存・読み込みする
+"""
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# チューニング前の既定値（従来のハードコード設定）
+DEFAULT_PROFILE = {
+    'preset': 'faster',
+    'crf': None,
+    'tune': None,
+    'threads': None,
+    'audio_bitrate': '192k',
+    'maxrate_kbps': None,
+}
+
+_profiles_cache = {'key': None, 'data': {}}
+
+
+def duration_bucket(duration: float) -> str:
+    """動画の長さを区分（short / medium / long）に分類"""
+    for name, upper in Config.ENCODE_DURATION_BUCKETS:
+        if duration <= upper:
+            return name
+    return Config.ENCODE_DURATION_BUCKETS[-1][0]
+
+
+def profile_key(orientation: str, bucket: str) -> str:
+    return f"{orientation}/{bucket}"
+
+
+def _load_all(path: str) -> Dict:
+    """プロファイルファイルを読み込む（同じファイルで更新時刻が変わらなければキャッシュを返す）"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    key = (os.path.abspath(path), mtime)
+    if _profiles_cache['key'] != key:
+        try:
+            with open(path, encoding='utf-8') as f:
+                _profiles_cache['data'] = json.load(f).get('profiles', {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"エンコードプロファイルを読み込めません: {path}: {e}")
+            _profiles_cache['data'] = {}
+        _profiles_cache['key'] = key
+    return _profiles_cache['data']
+
+
+def load_profile(orientation: str, duration: float, path: Optional[str] = None) -> Dict:
+    """
+    向きと長さに対応するプロファイルを取得
+
+    Returns:
+        DEFAULT_PROFILE と同じキーを持つ辞書（未登録の項目は既定値）
+    """
+    profiles = _load_all(path or Config.ENCODE_PROFILE_PATH)
+    saved = profiles.get(profile_key(orientation, duration_bucket(duration)), {})
+    profile = dict(DEFAULT_PROFILE)
+    profile.update({k: v for k, v in saved.get('settings', {}).items() if k in DEFAULT_PROFILE})
+    return profile
+
+
+def save_profile(orientation: str, bucket: str, settings: Dict, metrics: Dict,
+                 path: Optional[str] = None):
+    """チューニング結果をプロファイルファイルに保存"""
+    path = path or Config.ENCODE_PROFILE_PATH
+    data = {'profiles': {}}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    data.setdefault('profiles', {})[profile_key(orientation, bucket)] = {
+        'settings': {k: settings.get(k, DEFAULT_PROFILE[k]) for k in DEFAULT_PROFILE},
+        'metrics': metrics,
+    }
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"エンコードプロファイルを保存: {profile_key(orientation, bucket)} → {path}")
+
+
+def video_encoder_args(profile: Dict, threads: Optional[int] = None) -> List[str]:
+    """プロファイルからlibx264の引数を作成（threadsを指定した場合はプロファイルより優先）"""
+    args = ['-c:v', 'libx264', '-preset', profile['preset']]
+    if profile.get('crf') is not None:
+        args += ['-crf', str(profile['crf'])]
+    if profile.get('tune'):
+        args += ['-tune', profile['tune']]
+    if profile.get('maxrate_kbps'):
+        maxrate = int(profile['maxrate_kbps'])
+        args += ['-maxrate', f"{maxrate}k", '-bufsize', f"{maxrate * 2}k"]
+    threads = threads or profile.get('threads')
+    if threads:
+        args += ['-threads', str(threads)]
+    return args
+
+
+def audio_encoder_args(profile: Dict) -> List[str]:
+    return ['-c:a', 'aac', '-b:a', profile.get('audio_bitrate') or DEFAULT_PROFILE['audio_bitrate']]
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+エンコード設定の自動チューナー
+代表的な動画で preset / CRF / tune / threads の組み合わせを試し、
+エンコード時間・出力サイズ・SSIMを計測して向き×長さの区分ごとにプロファイルを保存する
+"""
+
+import itertools
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from config import Config
+from encode_profiles import DEFAULT_PROFILE, duration_bucket, save_profile, video_encoder_args
+from ffmpeg_runner import run_ffmpeg
+from video_merger_auto_bg import VideoMergerWithAutoBG
+
+logger = logging.getLogger(__name__)
+
+SSIM_PATTERN = re.compile(r'SSIM .*All:([0-9.]+)')
+PSNR_PATTERN = re.compile(r'PSNR .*average:([0-9.]+|inf)')
+
+
+class EncodeTuner:
+    """エンコード設定の組み合わせを計測して最適なプロファイルを選ぶ"""
+
+    def __init__(self, presets: List[str], crfs: List[Optional[int]], tunes: List[Optional[str]],
+                 threads: List[Optional[int]], min_ssim: float = 0.97):
+        self.candidates = [
+            {'preset': p, 'crf': c, 'tune': t, 'threads': n, 'audio_bitrate': DEFAULT_PROFILE['audio_bitrate']}
+            for p, c, t, n in itertools.product(presets, crfs, tunes, threads)
+        ]
+        self.min_ssim = min_ssim
+        self.merger = VideoMergerWithAutoBG()
+
+    def measure(self, clip: str, settings: Dict, work_dir: str) -> Dict:
+        """1つの設定で動画をエンコードし、時間・サイズ・品質を計測"""
+        info = self.merger.get_video_info(clip)
+        width, height, _ = self.merger.determine_output_size(info)
+        scale = f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
+        output = os.path.join(work_dir, 'candidate.mp4')
+
+        encoded = run_ffmpeg([
+            'ffmpeg', '-i', clip, '-vf', scale, '-an',
+            *video_encoder_args(settings), '-y', output
+        ], duration=info['duration'], label='チューニング')
+
+        # 同じ拡大縮小をした元動画と比較（SSIMとPSNRを1回のデコードで計測）
+        quality = run_ffmpeg([
+            'ffmpeg', '-i', output, '-i', clip,
+            '-lavfi', f"[0:v]split[a][b];[1:v]{scale},split[r1][r2];[a][r1]ssim;[b][r2]psnr",
+            '-f', 'null', '-'
+        ], duration=info['duration'], label='品質計測')
+        ssim_match = SSIM_PATTERN.findall(quality['stderr_tail'])
+        psnr_match = PSNR_PATTERN.findall(quality['stderr_tail'])
+
+        return {
+            'encode_seconds': encoded['elapsed'],
+            'bytes': os.path.getsize(output),
+            'ssim': float(ssim_match[-1]) if ssim_match else None,
+            'psnr': float(psnr_match[-1]) if psnr_match and psnr_match[-1] != 'inf' else None,
+        }
+
+    def tune(self, clips: List[str]) -> Dict[tuple, Dict]:
+        """
+        動画を向き×長さの区分に分け、区分ごとに最適な設定を選ぶ
+
+        Returns:
+            {(orientation, bucket): {'settings': ..., 'metrics': ...}}
+        """
+        groups = defaultdict(list)
+        for clip in clips:
+            info = self.merger.get_video_info(clip)
+            groups[(info['orientation'], duration_bucket(info['duration']))].append(clip)
+
+        chosen = {}
+        work_dir = tempfile.mkdtemp(prefix='encode_tuner_')
+        try:
+            for (orientation, bucket), group_clips in groups.items():
+                print(f"\n=== {orientation}/{bucket}: {len(group_clips)}本 ===")
+                baseline = self._measure_group(group_clips, DEFAULT_PROFILE, work_dir)
+                print(f"  基準 {self._describe(DEFAULT_PROFILE)}: {self._format(baseline)}")
+
+                best = None
+                for settings in self.candidates:
+                    metrics = self._measure_group(group_clips, settings, work_dir)
+                    # 基準に対する時間×サイズの比（小さいほど良い）
+                    metrics['score'] = (metrics['encode_seconds'] / baseline['encode_seconds']) * \
+                                       (metrics['bytes'] / baseline['bytes'])
+                    acceptable = metrics['ssim'] is not None and metrics['ssim'] >= self.min_ssim
+                    print(f"  {'  ' if acceptable else '✗ '}{self._describe(settings)}: {self._format(metrics)}")
+                    if acceptable and (best is None or metrics['score'] < best['metrics']['score']):
+                        best = {'settings': settings, 'metrics': metrics}
+
+                if best is None:
+                    print(f"  SSIM {self.min_ssim} 以上の設定がないため既定値を維持")
+                    baseline['score'] = 1.0
+                    best = {'settings': dict(DEFAULT_PROFILE), 'metrics': baseline}
+                print(f"  → 採用: {self._describe(best['settings'])}")
+                chosen[(orientation, bucket)] = best
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return chosen
+
+    def _measure_group(self, clips: List[str], settings: Dict, work_dir: str) -> Dict:
+        results = [self.measure(clip, settings, work_dir) for clip in clips]
+        ssims = [r['ssim'] for r in results if r['ssim'] is not None]
+        psnrs = [r['psnr'] for r in results if r['psnr'] is not None]
+        return {
+            'encode_seconds': sum(r['encode_seconds'] for r in results),
+            'bytes': sum(r['bytes'] for r in results),
+            'ssim': min(ssims) if ssims else None,
+            'psnr': sum(psnrs) / len(psnrs) if psnrs else None,
+        }
+
+    @staticmethod
+    def _describe(settings: Dict) -> str:
+        return (f"preset={settings['preset']} crf={settings['crf']} "
+                f"tune={settings['tune']} threads={settings['threads']}")
+
+    @staticmethod
+    def _format(metrics: Dict) -> str:
+        psnr = f"{metrics['psnr']:.1f}dB" if metrics.get('psnr') is not None else '-'
+        ssim = f"{metrics['ssim']:.4f}" if metrics.get('ssim') is not None else '-'
+        text = (f"{metrics['encode_seconds']:.1f}秒, {metrics['bytes'] / 1024 / 1024:.1f}MB, "
+                f"SSIM(最小)={ssim}, PSNR={psnr}")
+        if 'score' in metrics:
+            text += f", スコア={metrics['score']:.3f}"
+        return text
+
+
+def _optional_list(values: List[str], cast):
+    """'none' を None として扱うリスト変換"""
+    return [None if v.lower() == 'none' else cast(v) for v in values]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='エンコード設定の自動チューニング')
+    parser.add_argument('clips', nargs='+', help='代表的な動画ファイル')
+    parser.add_argument('--presets', nargs='+', default=['veryfast', 'faster', 'fast', 'medium'])
+    parser.add_argument('--crfs', nargs='+', default=['none', '21', '23', '26'],
+                        help="CRF値（'none' はlibx264の既定値）")
+    parser.add_argument('--tunes', nargs='+', default=['none', 'film'], help="tune（'none' は指定なし）")
+    parser.add_argument('--threads', nargs='+', default=['none'], help="スレッド数（'none' は自動）")
+    parser.add_argument('--min-ssim', type=float, default=0.97, help='採用する最低SSIM')
+    parser.add_argument('--output', default=Config.ENCODE_PROFILE_PATH, help='プロファイルの保存先')
+    parser.add_argument('--dry-run', action='store_true', help='計測のみで保存しない')
+    args = parser.parse_args()
+
+    tuner = EncodeTuner(
+        presets=args.presets,
+        crfs=_optional_list(args.crfs, int),
+        tunes=_optional_list(args.tunes, str),
+        threads=_optional_list(args.threads, int),
+        min_ssim=args.min_ssim
+    )
+    results = tuner.tune(args.clips)
+
+    if not args.dry_run:
+        for (orientation, bucket), best in results.items():
+            save_profile(orientation, bucket, best['settings'], best['metrics'], path=args.output)
+        print(f"\nプロファイルを保存しました: {args.output}")
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+ffmpeg / ffprobe の実行管理
+-progress 出力を解析して進捗イベントにし、停止（ストール）やタイムアウト時にプロセスを終了させる
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class FFmpegError(RuntimeError):
+    """ffmpeg / ffprobe の失敗（終了コード異常・ストール・タイムアウト）"""
+
+    def __init__(self, message: str, returncode: Optional[int] = None, stderr_tail: str = ''):
+        if stderr_tail:
+            message = f"{message}\n--- stderr (末尾) ---\n{stderr_tail}"
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+
+
+def _parse_out_time(fields: Dict[str, str]) -> Optional[float]:
+    """out_time_us / out_time_ms（どちらもマイクロ秒）/ out_time（HH:MM:SS.ffffff）を秒に変換"""
+    for key in ('out_time_us', 'out_time_ms'):
+        value = fields.get(key, '')
+        if value.lstrip('-').isdigit():
+            return max(int(value), 0) / 1_000_000
+    value = fields.get('out_time', '')
+    if value.count(':') == 2:
+        try:
+            hours, minutes, seconds = value.split(':')
+            return max(int(hours) * 3600 + int(minutes) * 60 + float(seconds), 0.0)
+        except ValueError:
+            return None
+    return None
+
+
+def parse_progress_block(fields: Dict[str, str]) -> Dict:
+    """-progress の1ブロック（key=value の集まり）を進捗イベントに変換"""
+    def to_float(value: str) -> Optional[float]:
+        try:
+            return float(value.rstrip('x'))
+        except (AttributeError, ValueError):
+            return None
+
+    frame = fields.get('frame', '')
+    return {
+        'frame': int(frame) if frame.isdigit() else None,
+        'fps': to_float(fields.get('fps')),
+        'speed': to_float(fields.get('speed')),
+        'out_time': _parse_out_time(fields),
+        'progress': fields.get('progress'),
+    }
+
+
+def _reap(process: subprocess.Popen, block: bool = False):
+    """
+    終了したプロセスを回収し、その資源使用量を返す（os.wait4 が使えない環境では None）
+    終了していなければ returncode は None のまま
+    """
+    if not hasattr(os, 'wait4'):
+        process.wait() if block else process.poll()
+        return None
+    pid, status, usage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    if pid == 0:
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return usage
+
+
+def run_ffmpeg(cmd: List[str], duration: Optional[float] = None,
+               timeout: Optional[float] = None, stall_timeout: Optional[float] = None,
+               on_progress: Optional[Callable[[Dict], None]] = None,
+               label: str = 'ffmpeg') -> Dict:
+    """
+    ffmpegを監視付きで実行
+
+    Args:
+        cmd: ffmpegコマンド（先頭は 'ffmpeg'）
+        duration: 出力の長さ（秒）。進捗率の表示に使う
+        timeout: 全体の制限時間（秒）。省略時は Config.FFMPEG_TIMEOUT
+        stall_timeout: 進捗が止まってから終了させるまでの秒数。省略時は Config.FFMPEG_STALL_TIMEOUT
+        on_progress: 進捗イベントごとに呼ばれる関数
+        label: ログ表示用の名前
+
+    Returns:
+        {'returncode', 'elapsed', 'frame', 'fps', 'speed', 'out_time', 'stderr_tail', 'max_rss_mb'}
+        max_rss_mb はffmpegプロセスの最大RSS（取得できない環境では None）
+
+    Raises:
+        FFmpegError: 異常終了・ストール・タイムアウト時（stderrの末尾を含む）
+    """
+    timeout = Config.FFMPEG_TIMEOUT if timeout is None else timeout
+    stall_timeout = Config.FFMPEG_STALL_TIMEOUT if stall_timeout is None else stall_timeout
+
+    full_cmd = [cmd[0], '-nostats', '-progress', 'pipe:1', *cmd[1:]]
+    process = subprocess.Popen(
+        full_cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace'
+    )
+
+    stderr_lines = deque(maxlen=Config.FFMPEG_STDERR_TAIL_LINES)
+    state = {'last': {}, 'last_advance': time.monotonic(), 'position': None}
+    lock = threading.Lock()
+
+    def read_progress():
+        fields = {}
+        for line in process.stdout:
+            key, sep, value = line.strip().partition('=')
+            if not sep:
+                continue
+            fields[key] = value
+            if key != 'progress':
+                continue
+            event = parse_progress_block(fields)
+            fields = {}
+            with lock:
+                # 一部の項目が欠けたブロックは直前の値で補う
+                event = {k: v if v is not None else state['last'].get(k) for k, v in event.items()}
+                position = (event['out_time'], event['frame'])
+                if position != state['position']:
+                    state['position'] = position
+                    state['last_advance'] = time.monotonic()
+                state['last'] = event
+            if on_progress:
+                try:
+                    on_progress(event)
+                except Exception as e:
+                    logger.warning(f"進捗コールバックでエラー: {e}")
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_lines.append(line.rstrip())
+
+    readers = [threading.Thread(target=read_progress, daemon=True),
+               threading.Thread(target=read_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    start = time.monotonic()
+    last_log = start
+    failure = None
+    usage = None
+    while True:
+        usage = _reap(process)
+        if process.returncode is not None:
+            break
+        time.sleep(0.5)
+        now = time.monotonic()
+        with lock:
+            last_event = dict(state['last'])
+            stalled_for = now - state['last_advance']
+
+        if timeout and now - start > timeout:
+            failure = f"{label}: 制限時間（{timeout:.0f}秒）を超えたため終了しました"
+        elif stall_timeout and stalled_for > stall_timeout:
+            failure = f"{label}: {stall_timeout:.0f}秒間進捗がないため終了しました（ストール）"
+        if failure:
+            process.kill()
+            usage = _reap(process, block=True)
+            break
+
+        if now - last_log >= Config.FFMPEG_PROGRESS_LOG_INTERVAL and last_event.get('out_time') is not None:
+            last_log = now
+            percent = f" ({last_event['out_time'] / duration * 100:.0f}%)" if duration else ""
+            logger.info(
+                f"{label} 進捗: {last_event['out_time']:.1f}秒{percent} "
+                f"frame={last_event.get('frame')} fps={last_event.get('fps')} speed={last_event.get('speed')}x"
+            )
+
+    for reader in readers:
+        reader.join(timeout=5)
+
+    elapsed = time.monotonic() - start
+    stderr_tail = "\n".join(stderr_lines)
+    if failure:
+        logger.error(failure)
+        raise FFmpegError(failure, process.returncode, stderr_tail)
+    if process.returncode != 0:
+        raise FFmpegError(f"{label}が異常終了しました（終了コード {process.returncode}）",
+                          process.returncode, stderr_tail)
+
+    with lock:
+        last_event = dict(state['last'])
+    return {
+        'returncode': process.returncode,
+        'elapsed': elapsed,
+        'frame': last_event.get('frame'),
+        'fps': last_event.get('fps'),
+        'speed': last_event.get('speed'),
+        'out_time': last_event.get('out_time'),
+        'stderr_tail': stderr_tail,
+        # ru_maxrss はLinuxではKB
+        'max_rss_mb': usage.ru_maxrss / 1024 if usage else None,
+    }
+
+
+def run_probe(cmd: List[str], timeout: Optional[float] = None) -> str:
+    """
+    ffprobeを制限時間付きで実行して標準出力を返す
+
+    Raises:
+        FFmpegError: 異常終了・タイムアウト時
+    """
+    timeout = Config.FFPROBE_TIMEOUT if timeout is None else timeout
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, errors='replace', timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        stderr = e.stderr.decode(errors='replace') if isinstance(e.stderr, bytes) else (e.stderr or '')
+        raise FFmpegError(f"{cmd[0]}: 制限時間（{timeout:.0f}秒）を超えました", None,
+                          "\n".join(stderr.splitlines()[-Config.FFMPEG_STDERR_TAIL_LINES:]))
+    if result.returncode != 0:
+        raise FFmpegError(f"{cmd[0]}が異常終了しました（終了コード {result.returncode}）", result.returncode,
+                          "\n".join(result.stderr.splitlines()[-Config.FFMPEG_STDERR_TAIL_LINES:]))
+    return result.stdout
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+サイズ上限付きのファイルキャッシュ（LRU）
+キーごとに1ファイルと付随情報（JSON）を保存し、合計サイズが上限を超えたら最も古く使われたものから削除する
+最終利用時刻はファイルの更新時刻で管理するため、複数プロセス・複数回の実行で共有できる
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(source: str, dest: str):
+    """同じファイルシステムならハードリンク、それ以外はコピー（destは存在しないこと）"""
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+class FileCache:
+    """キー → ファイルのキャッシュ"""
+
+    def __init__(self, root: str, max_bytes: int, suffix: str = '', name: str = 'cache'):
+        """
+        Args:
+            root: 保存先ディレクトリ
+            max_bytes: 合計サイズの上限（0以下で無制限）
+            suffix: 保存するファイルの拡張子（'.mp4' 等）
+            name: ログ表示用の名前
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key: str) -> Path:
+        return self.root / f"{key}{self.suffix}"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.root / f"{key}.meta.json"
+
+    def get(self, key: str) -> Optional[Path]:
+        """キャッシュ済みのファイルパス（なければNone）。見つかった場合は最終利用時刻を更新"""
+        path = self.path_for(key)
+        if path.is_file():
+            now = time.time()
+            os.utime(path, (now, now))
+            self.hits += 1
+            logger.info(f"{self.name} ヒット: {key[:12]} ({self.hits}ヒット / {self.misses}ミス)")
+            return path
+        self.misses += 1
+        logger.info(f"{self.name} ミス: {key[:12]} ({self.hits}ヒット / {self.misses}ミス)")
+        return None
+
+    def metadata(self, key: str) -> Dict:
+        try:
+            with open(self._meta_path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def put(self, key: str, source: str, metadata: Optional[Dict] = None, move: bool = False) -> Optional[Path]:
+        """
+        ファイルをキャッシュに登録（同じファイルシステムならハードリンク、それ以外はコピー）
+
+        Args:
+            source: 登録するファイル
+            metadata: 付随情報（JSONで保存）
+            move: Trueなら元ファイルを移動する
+
+        Returns:
+            登録したパス（上限より大きいファイルは登録せず None。元ファイルはそのまま残す）
+        """
+        size = os.path.getsize(source)
+        if 0 < self.max_bytes < size:
+            logger.info(f"{self.name} 登録省略（容量上限より大きい）: {key[:12]} ({size / 1024 / 1024:.1f}MB)")
+            return None
+
+        path = self.path_for(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp_', suffix=self.suffix)
+        os.close(fd)
+        try:
+            if move:
+                shutil.move(source, tmp_path)
+            else:
+                os.remove(tmp_path)
+                link_or_copy(source, tmp_path)
+            # 他のプロセスから書きかけのファイルが見えないよう置き換えで登録する
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if metadata is not None:
+            meta_tmp = f"{self._meta_path(key)}.tmp"
+            with open(meta_tmp, 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            os.replace(meta_tmp, self._meta_path(key))
+
+        now = time.time()
+        os.utime(path, (now, now))
+        logger.info(f"{self.name} 登録: {key[:12]} ({path.stat().st_size / 1024 / 1024:.1f}MB)")
+        self.evict(keep=key)
+        return path
+
+    def remove(self, key: str):
+        for path in (self.path_for(key), self._meta_path(key)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def total_bytes(self) -> int:
+        return sum(path.stat().st_size for path in self._entries())
+
+    def _entries(self):
+        """キャッシュ本体のファイル（書き込み中の一時ファイル等の . で始まるファイルと付随情報を除く）"""
+        return [path for path in self.root.glob(f"*{self.suffix}")
+                if path.is_file() and not path.name.startswith('.')
+                and not path.name.endswith('.meta.json')]
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        合計サイズが上限以下になるまで、最終利用時刻が古いものから削除
+
+        Args:
+            keep: 削除しないキー（登録した直後のもの。返したパスが消えないようにする）
+        """
+        if self.max_bytes <= 0:
+            return
+        keep_path = self.path_for(keep) if keep else None
+        entries = []
+        for path in self._entries():
+            if path == keep_path:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if keep_path:
+            try:
+                total += keep_path.stat().st_size
+            except FileNotFoundError:
+                pass
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            key = path.name[:-len(self.suffix)] if self.suffix else path.name
+            self.remove(key)
+            total -= size
+            logger.info(f"{self.name} 削除（容量上限）: {key[:12]} ({size / 1024 / 1024:.1f}MB)")
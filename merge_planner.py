@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+合成コマンドの最適化（ファストパス判定）
+入力の情報から、省略できる変換（音声の再エンコード・不要なスケール/クロップ）を判定する
+"""
+
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from encode_profiles import audio_encoder_args
+
+logger = logging.getLogger(__name__)
+
+# ストリームコピーできる音声（MP4ヘッダーのサンプルエントリ名 / ffprobeのコーデック名）
+COPYABLE_AUDIO_CODECS = {'mp4a', 'aac'}
+# AACをそのまま格納できる出力コンテナ
+AAC_CONTAINERS = {'.mp4', '.m4v', '.mov'}
+
+
+class MergePlanner:
+    """1回の合成について、最も軽い有効なコマンド構成を選ぶ"""
+
+    # プロセス内の累計（ファストパスのヒット率計測用）
+    stats = Counter()
+    plans = 0
+
+    def __init__(self, main_info: Dict, background_info: Optional[Dict] = None):
+        self.main_info = main_info
+        self.background_info = background_info
+        self.fast_paths: List[str] = []
+        MergePlanner.plans += 1
+
+    def _take(self, name: str):
+        if name not in self.fast_paths:
+            self.fast_paths.append(name)
+            MergePlanner.stats[name] += 1
+
+    def background_filter(self, width: int, height: int) -> Optional[str]:
+        """
+        背景を出力サイズに合わせるフィルター
+
+        Returns:
+            フィルター文字列。変換不要ならNone（入力をそのまま使う）
+        """
+        bg = self.background_info
+        if bg and bg['width'] == width and bg['height'] == height:
+            self._take('bg_passthrough')
+            return None
+        if bg and bg['width'] * height == bg['height'] * width:
+            # アスペクト比が同じならクロップは不要
+            self._take('bg_scale_only')
+            return f"scale={width}:{height}"
+        return (f"scale={width}:{height}:force_original_aspect_ratio=increase,"
+                f"crop={width}:{height}")
+
+    def main_filter(self, target_width: int, target_height: int) -> Optional[str]:
+        """
+        メイン動画を目標サイズ内に収めるフィルター
+
+        Returns:
+            フィルター文字列。すでに目標サイズに収まっていればNone
+        """
+        width, height = self.main_info.get('width'), self.main_info.get('height')
+        if width and height and width <= target_width and height <= target_height \
+                and (width == target_width or height == target_height):
+            self._take('main_passthrough')
+            return None
+        return f"scale={target_width}:{target_height}:force_original_aspect_ratio=decrease"
+
+    def audio_args(self, profile: Dict, output_path: str) -> List[str]:
+        """音声の引数（AACをMP4系に出力する場合はストリームコピー）"""
+        audio_codec = (self.main_info.get('audio_codec') or '').lower()
+        if not audio_codec:
+            self._take('no_audio')
+            return ['-an']
+        if audio_codec in COPYABLE_AUDIO_CODECS and Path(output_path).suffix.lower() in AAC_CONTAINERS:
+            self._take('audio_copy')
+            return ['-c:a', 'copy']
+        return audio_encoder_args(profile)
+
+    def log_summary(self):
+        """今回採用したファストパスと累計のヒット率をログ出力"""
+        taken = ', '.join(self.fast_paths) if self.fast_paths else 'なし'
+        rates = ', '.join(
+            f"{name} {count}/{MergePlanner.plans}" for name, count in sorted(MergePlanner.stats.items())
+        )
+        logger.info(f"Fast paths: {taken}" + (f" (累計: {rates})" if rates else ""))
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+MP4/MOVヘッダーの軽量リーダー
+ffprobeを起動せずに moov/trak/tkhd/mdhd アトムから解像度・長さ・回転を読み取る
+"""
+
+import math
+import mmap
+import struct
+from typing import Dict, Iterator, Optional, Tuple
+
+
+class Mp4HeaderError(ValueError):
+    """MP4ヘッダーを解析できない場合の例外"""
+
+
+def _iter_boxes(buf, start: int, end: int, strict: bool = False) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    [start, end) の範囲のアトムを (type, payload開始位置, 終端位置) で列挙
+    strict=True なら範囲を超えるアトム（途中で切れたファイル）で Mp4HeaderError、それ以外は範囲の終端で打ち切る
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, pos)
+        header_size = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise Mp4HeaderError("64bitサイズのアトムが途中で切れています")
+            size, = struct.unpack_from('>Q', buf, pos + 8)
+            header_size = 16
+        elif size == 0:
+            # サイズ0はファイル末尾まで
+            size = end - pos
+        if size < header_size:
+            raise Mp4HeaderError(f"不正なアトムサイズ: {box_type!r} ({size})")
+        if strict and pos + size > end:
+            raise Mp4HeaderError(f"アトムが途中で切れています: {box_type!r}")
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def _find_child(buf, start: int, end: int, box_type: bytes) -> Optional[Tuple[int, int]]:
+    for child_type, child_start, child_end in _iter_boxes(buf, start, end):
+        if child_type == box_type:
+            return child_start, child_end
+    return None
+
+
+def _fixed_16_16(value: int) -> float:
+    """符号付き16.16固定小数点を変換"""
+    if value & 0x80000000:
+        value -= 1 << 32
+    return value / 65536.0
+
+
+def _parse_mvhd(buf, start: int) -> Tuple[int, int]:
+    version = buf[start]
+    if version == 1:
+        timescale, duration = struct.unpack_from('>IQ', buf, start + 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', buf, start + 12)
+    return timescale, duration
+
+
+def _parse_tkhd(buf, start: int) -> Tuple[float, float, int]:
+    """tkhdから表示サイズと回転角（時計回り、度）を取得"""
+    version = buf[start]
+    # version/flags(4) + 時刻・トラックID・duration
+    offset = start + (4 + 32 if version == 1 else 4 + 20)
+    # reserved(8) layer(2) alternate_group(2) volume(2) reserved(2)
+    offset += 16
+    matrix = struct.unpack_from('>9I', buf, offset)
+    raw_width, raw_height = struct.unpack_from('>II', buf, offset + 36)
+
+    a = _fixed_16_16(matrix[0])
+    b = _fixed_16_16(matrix[1])
+    rotation = int(round(math.degrees(math.atan2(b, a)))) % 360
+
+    return raw_width / 65536.0, raw_height / 65536.0, rotation
+
+
+def _parse_mdhd(buf, start: int) -> Tuple[int, int]:
+    version = buf[start]
+    if version == 1:
+        timescale, duration = struct.unpack_from('>IQ', buf, start + 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', buf, start + 12)
+    return timescale, duration
+
+
+def _parse_hdlr(buf, start: int) -> bytes:
+    return bytes(buf[start + 8:start + 12])
+
+
+def _parse_stsd_codec(buf, start: int, end: int) -> Optional[str]:
+    """stsdの最初のサンプルエントリのコーデック識別子（avc1, hvc1, mp4a 等）"""
+    if start + 16 > end:
+        return None
+    codec = bytes(buf[start + 12:start + 16])
+    return codec.decode('latin-1').strip()
+
+
+def _parse_stts_sample_count(buf, start: int, end: int) -> int:
+    entry_count, = struct.unpack_from('>I', buf, start + 4)
+    total = 0
+    offset = start + 8
+    for _ in range(entry_count):
+        if offset + 8 > end:
+            break
+        sample_count, _delta = struct.unpack_from('>II', buf, offset)
+        total += sample_count
+        offset += 8
+    return total
+
+
+def _parse_trak(buf, start: int, end: int) -> Dict:
+    track = {}
+    tkhd = _find_child(buf, start, end, b'tkhd')
+    if tkhd:
+        track['width'], track['height'], track['rotation'] = _parse_tkhd(buf, tkhd[0])
+
+    mdia = _find_child(buf, start, end, b'mdia')
+    if not mdia:
+        return track
+
+    for box_type, box_start, box_end in _iter_boxes(buf, mdia[0], mdia[1]):
+        if box_type == b'mdhd':
+            track['timescale'], track['duration'] = _parse_mdhd(buf, box_start)
+        elif box_type == b'hdlr':
+            track['handler'] = _parse_hdlr(buf, box_start)
+        elif box_type == b'minf':
+            stbl = _find_child(buf, box_start, box_end, b'stbl')
+            if not stbl:
+                continue
+            for stbl_type, stbl_start, stbl_end in _iter_boxes(buf, stbl[0], stbl[1]):
+                if stbl_type == b'stsd':
+                    track['codec'] = _parse_stsd_codec(buf, stbl_start, stbl_end)
+                elif stbl_type == b'stts':
+                    track['sample_count'] = _parse_stts_sample_count(buf, stbl_start, stbl_end)
+    return track
+
+
+def parse_moov(buf, start: int, end: int) -> Optional[Dict]:
+    """moovアトムの中身から動画情報を組み立てる。動画トラックがなければNone"""
+    movie_timescale = movie_duration = 0
+    video_track = None
+    audio_track = None
+    fragmented = False
+
+    for box_type, box_start, box_end in _iter_boxes(buf, start, end):
+        if box_type == b'mvhd':
+            movie_timescale, movie_duration = _parse_mvhd(buf, box_start)
+        elif box_type == b'mvex':
+            fragmented = True
+        elif box_type == b'trak':
+            track = _parse_trak(buf, box_start, box_end)
+            if track.get('handler') == b'vide' and video_track is None:
+                video_track = track
+            elif track.get('handler') == b'soun' and audio_track is None:
+                audio_track = track
+
+    if not video_track or not video_track.get('width') or not video_track.get('height'):
+        return None
+
+    if movie_timescale and movie_duration:
+        duration = movie_duration / movie_timescale
+    elif video_track.get('timescale') and video_track.get('duration'):
+        duration = video_track['duration'] / video_track['timescale']
+    else:
+        duration = 0.0
+
+    # フラグメント化MP4はmoovに長さが入っていないことがある
+    if duration <= 0 or (fragmented and not movie_duration):
+        return None
+
+    fps = None
+    media_seconds = (video_track.get('duration', 0) / video_track['timescale']
+                     if video_track.get('timescale') else 0)
+    if video_track.get('sample_count') and media_seconds > 0:
+        fps = video_track['sample_count'] / media_seconds
+
+    return {
+        'width': int(round(video_track['width'])),
+        'height': int(round(video_track['height'])),
+        'duration': duration,
+        'rotation': video_track.get('rotation', 0),
+        'fps': fps,
+        'video_codec': video_track.get('codec'),
+        'audio_codec': audio_track.get('codec') if audio_track else None,
+    }
+
+
+def parse_mp4_header(buf) -> Optional[Dict]:
+    """
+    バッファ全体（mmap可）からトップレベルのmoovを探して解析
+
+    Returns:
+        {'width', 'height', 'duration', 'rotation', 'fps', 'video_codec', 'audio_codec'}
+        解析できない形式の場合はNone
+
+    Raises:
+        Mp4HeaderError: 不正なアトム、moovまでのアトムが途中で切れている場合
+    """
+    length = len(buf)
+    if length < 8 or bytes(buf[4:8]) not in (b'ftyp', b'moov', b'wide', b'free', b'mdat', b'skip', b'pnot'):
+        return None
+
+    for box_type, box_start, box_end in _iter_boxes(buf, 0, length, strict=True):
+        if box_type == b'moov':
+            return parse_moov(buf, box_start, box_end)
+    return None
+
+
+def scan_mp4_prefix(buf) -> Tuple[str, Optional[Dict]]:
+    """
+    ファイル先頭の一部（ダウンロード途中のデータ）から、先頭から順に読むだけで扱えるかを判定
+
+    Returns:
+        ('moov', 動画情報): moovがmdatより前にあり解析できた（パイプ入力で合成できる）
+        ('mdat', None): moovより前にmdatがある（moovを読むためにシークが必要）
+        ('incomplete', None): 判定にはさらにデータが必要
+        ('unsupported', None): MP4/MOVとして解析できない
+    """
+    length = len(buf)
+    if length < 8:
+        return 'incomplete', None
+    if bytes(buf[4:8]) not in (b'ftyp', b'moov', b'wide', b'free', b'mdat', b'skip', b'pnot'):
+        return 'unsupported', None
+
+    pos = 0
+    try:
+        while pos + 8 <= length:
+            size, box_type = struct.unpack_from('>I4s', buf, pos)
+            header_size = 8
+            if size == 1:
+                if pos + 16 > length:
+                    return 'incomplete', None
+                size, = struct.unpack_from('>Q', buf, pos + 8)
+                header_size = 16
+            elif size == 0:
+                # ファイル末尾までのアトム（moovが後ろにあることはない）
+                return ('mdat', None) if box_type == b'mdat' else ('unsupported', None)
+            if size < header_size:
+                return 'unsupported', None
+            if box_type == b'mdat':
+                return 'mdat', None
+            if box_type == b'moov':
+                if pos + size > length:
+                    return 'incomplete', None
+                info = parse_moov(buf, pos + header_size, pos + size)
+                return ('moov', info) if info else ('unsupported', None)
+            pos += size
+    except (ValueError, struct.error):
+        return 'unsupported', None
+    return 'incomplete', None
+
+
+def read_mp4_header(path: str) -> Optional[Dict]:
+    """
+    ファイルをメモリマップしてヘッダーを読み取る
+
+    Returns:
+        動画情報の辞書。MP4/MOV以外や解析できない場合はNone
+    """
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return parse_mp4_header(buf)
+    except (OSError, ValueError, struct.error):
+        # 空ファイル・不正なアトム・途中で切れたファイルなど
+        return None
+
+
+# ベンチマーク: ffprobeとの比較
+if __name__ == "__main__":
+    import argparse
+    import time
+    from video_merger_auto_bg import VideoMergerWithAutoBG
+
+    parser = argparse.ArgumentParser(description='MP4ヘッダーリーダーとffprobeの速度比較')
+    parser.add_argument('videos', nargs='+', help='計測する動画ファイル')
+    parser.add_argument('-n', '--iterations', type=int, default=20, help='1ファイルあたりの試行回数')
+    args = parser.parse_args()
+
+    merger = VideoMergerWithAutoBG()
+
+    for video in args.videos:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            header = read_mp4_header(video)
+        reader_time = (time.perf_counter() - start) / args.iterations
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            probed = merger._probe_with_ffprobe(video)
+        ffprobe_time = (time.perf_counter() - start) / args.iterations
+
+        print(f"\n{video}")
+        print(f"  ヘッダーリーダー: {reader_time * 1e6:10.1f} µs  {header}")
+        print(f"  ffprobe:          {ffprobe_time * 1e6:10.1f} µs  {probed}")
+        if reader_time > 0:
+            print(f"  速度比: {ffprobe_time / reader_time:.0f}倍")
@@ -28,94 +28,127 @@ if 'GOOGLE_APPLICATION_CREDENTIALS' not in os.environ:
 from automation.approval_status_reader import ApprovalStatusReader
 from automation.google_drive_finder import GoogleDriveFinder
 from automation.simple_queue_manager import SimpleQueueManager
+from automation.drive_stream import STREAMING_SUPPORTED
+from config import Config
+from progressive_upload import ProgressiveUploadError, upload_while_encoding
+from render_cache import RenderCache, file_sha256
+from streaming_merge import merge_while_downloading
 from video_merger_auto_bg import VideoMergerWithAutoBG
+from workspace import Workspace
 
-def process_single_ad(ad, index, total):
-    """単一の不承認広告を処理"""
-    print(f"\n{'='*40}")
-    print(f"📍 処理中: {index}/{total}")
-    print(f"   広告グループ: {ad['ad_group_name']}")
-    print(f"   アカウントID: {ad['account_id']}")
-    print(f"{'='*40}")
-    
-    # 広告グループ名から案件と動画情報を取得
-    ad_group_name = ad['ad_group_name']
-    
-    # 特定の広告グループをスキップ（デマンドジェネレーション以外）
-    if 'YT_NB_7stepパク応援特典8選_MCC02運用02_28_01' in ad_group_name:
-        print(f"   ⚠️ スキップ: この広告グループはデマンドジェネレーション広告ではありません")
-        return False
-    
-    # 2. Google Driveから動画を検索
-    print("\n2️⃣ Google Driveから動画を検索...")
-    finder = GoogleDriveFinder()
-    
-    video_path = finder.find_video_by_ad_group(ad_group_name)
-    
-    if not video_path:
-        parsed = finder.parse_ad_group_name(ad_group_name)
-        print(f"❌ 対象動画が見つかりません")
-        print(f"   案件: {parsed['project']}")
-        print(f"   動画名: {parsed['video_name']}")
-        if not parsed.get('has_mcc', True):
-            print(f"   ⚠️ 注意: MCC記載が欠けている可能性があります")
-        print(f"   Google Driveの案件フォルダに該当する動画をアップロードしてください")
-        return False
-    
-    print(f"   ✅ ダウンロード完了: {video_path}")
-    print(f"   サイズ: {os.path.getsize(video_path) / 1024 / 1024:.1f} MB")
-    
-    # 3. 背景合成処理
-    print("\n3️⃣ 背景合成処理...")
-    merger = VideoMergerWithAutoBG()
-    
-    output_dir = project_root / 'ad-videos'
-    output_dir.mkdir(exist_ok=True)
+MAIN_SCALE = 0.8
+DISCLAIMER_TEXT = "※結果には個人差があり成果を保証するものではありません"
+# デマンドジェネレーション広告ではないため処理しない広告グループ
+SKIPPED_AD_GROUP = 'YT_NB_7stepパク応援特典8選_MCC02運用02_28_01'
+
+def new_output_path(project_name, job):
+    """合成結果の出力先（ジョブの作業フォルダ内）"""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    
-    # 解析情報を取得
-    parsed = finder.parse_ad_group_name(ad_group_name)
-    project_name = parsed['project']
-    search_name = parsed['video_name']
-    
-    output_path = output_dir / f"{project_name}_再審査_{timestamp}.mp4"
-    
+    return job.stage_dir('render') / f"{project_name}_再審査_{timestamp}.mp4"
+
+def run_merge(video_path, output_path, job, stream=None, **merge_kwargs):
+    """背景生成＋合成（streamを指定した場合はダウンロードと並行して合成）"""
+    merger = VideoMergerWithAutoBG(work_dir=job.stage_dir('background'), scratch_dir=job.stage_dir('scratch'))
     print("   背景生成中... (1-2分かかります)")
-    result = merger.process_with_auto_background(
+    if stream:
+        print("   （ダウンロードと並行して処理）")
+        return merge_while_downloading(
+            merger,
+            stream,
+            str(output_path),
+            main_scale=MAIN_SCALE,
+            disclaimer_text=DISCLAIMER_TEXT,
+            **merge_kwargs
+        )
+    return merger.process_with_auto_background(
         str(video_path),
         str(output_path),
-        main_scale=0.8,
-        disclaimer_text="※結果には個人差があり成果を保証するものではありません"
+        main_scale=MAIN_SCALE,
+        disclaimer_text=DISCLAIMER_TEXT,
+        **merge_kwargs
     )
+
+def merge_with_background(video_path, project_name, job, stream=None):
+    """
+    背景合成を実行（streamを指定した場合はダウンロードと並行して合成）
+    
+    Returns:
+        (アップロードするファイル, 合成結果の出力先)。合成に失敗した場合は元動画をアップロードする
+    """
+    print("\n3️⃣ 背景合成処理...")
+    output_path = new_output_path(project_name, job)
+    result = run_merge(video_path, output_path, job, stream)
     
     if result and isinstance(result, dict):
         output_path = Path(result['output_path'])
         print(f"   ✅ 背景合成完了: {output_path}")
         print(f"   サイズ: {os.path.getsize(output_path) / 1024 / 1024:.1f} MB")
-        upload_path = output_path
-    else:
-        print("   ⚠️ 背景合成失敗、元動画を使用")
-        upload_path = video_path
+        return output_path, output_path
     
-    # 4. YouTubeアップロード
-    print("\n4️⃣ YouTubeアップロード...")
+    print("   ⚠️ 背景合成失敗、元動画を使用")
+    return video_path, output_path
+
+def merge_and_upload(video_path, project_name, job, youtube, title, stream=None):
+    """
+    背景合成と並行して、合成中の動画をYouTubeにアップロード（UPLOAD_WHILE_ENCODING）
+    断片化MP4で書き出し、書き込み済みの範囲からチャンクを送ってffmpegの終了後に確定する
+    
+    Returns:
+        (アップロードするファイル, 合成結果の出力先, YouTube URL)。
+        合成しながらのアップロードに失敗した場合、URLはNone（ファイルから通常のアップロードを行う）
+    """
+    print("\n3️⃣ 背景合成処理...（合成しながらYouTubeにアップロード）")
+    output_path = new_output_path(project_name, job)
+    
+    def encode():
+        # 出力を先頭から順に読むため、セグメント並列（最後に一括で結合）は使わない
+        kwargs = {'retry_from_file': False} if stream else {}
+        return run_merge(video_path, output_path, job, stream, fragmented=True, parallel=False, **kwargs)
     
+    try:
+        result, response = upload_while_encoding(
+            lambda media: create_upload_request(youtube, title, media),
+            str(output_path),
+            encode
+        )
+    except ProgressiveUploadError as e:
+        if e.encode_result is None:
+            if not stream:
+                raise e.cause
+            # パイプ入力での合成に失敗した場合は、ダウンロード完了後にファイルから合成し直す
+            print(f"   ⚠️ {e}")
+            upload_path, output_path = merge_with_background(stream.wait(), project_name, job)
+            return upload_path, output_path, None
+        print(f"   ⚠️ {e}")
+        print("   合成済みのファイルからアップロードし直します")
+        return output_path, output_path, None
+    
+    print(f"   ✅ 背景合成完了: {output_path}")
+    print(f"   サイズ: {os.path.getsize(output_path) / 1024 / 1024:.1f} MB")
+    youtube_url = f"https://www.youtube.com/watch?v={response['id']}"
+    print(f"   ✅ アップロード成功!")
+    print(f"   URL: {youtube_url}")
+    return output_path, output_path, youtube_url
+
+def get_youtube_service(project_name):
+    """案件のチャンネルのYouTubeサービスを取得（失敗した場合はNone）"""
     print(f"   使用チャンネル: {project_name}")
     
     # 新しい認証マネージャーを使用（自動リフレッシュ機能付き）
     auth_manager = YouTubeAuthManager(project_name)
     
     try:
-        youtube = auth_manager.get_authenticated_service()
+        return auth_manager.get_authenticated_service()
     except FileNotFoundError as e:
         print(f"❌ {project_name}チャンネルの認証ファイルが見つかりません")
         print(f"   python youtube_auth_manager.py --channel {project_name} を実行してください")
-        return False
+        return None
     except Exception as e:
         print(f"❌ 認証エラー: {e}")
-        return False
-    
-    title = search_name
+        return None
+
+def create_upload_request(youtube, title, media):
+    """限定公開でのアップロードリクエストを作成"""
     description = ""
     
     body = {
@@ -131,6 +164,14 @@ def process_single_ad(ad, index, total):
         }
     }
     
+    return youtube.videos().insert(
+        part=','.join(body.keys()),
+        body=body,
+        media_body=media
+    )
+
+def upload_video(youtube, upload_path, title):
+    """ファイルをアップロードしてYouTube URLを返す（失敗した場合はNone）"""
     media = MediaFileUpload(
         str(upload_path),
         mimetype='video/mp4',
@@ -143,11 +184,7 @@ def process_single_ad(ad, index, total):
     print(f"   プライバシー: 限定公開")
     
     try:
-        request = youtube.videos().insert(
-            part=','.join(body.keys()),
-            body=body,
-            media_body=media
-        )
+        request = create_upload_request(youtube, title, media)
         
         response = None
         while response is None:
@@ -161,11 +198,141 @@ def process_single_ad(ad, index, total):
         
         print(f"   ✅ アップロード成功!")
         print(f"   URL: {youtube_url}")
+        return youtube_url
         
     except Exception as e:
         print(f"❌ アップロードエラー: {e}")
+        return None
+
+def store_render(render_cache, cache_key, upload_path, output_path, ad_group_name, source):
+    """
+    合成できた場合だけレンダーキャッシュに登録
+    アップロード・キュー追加が成功した時点で削除する（次に不承認になった場合は新しい背景で作り直す）
+    """
+    if upload_path != output_path:
+        return
+    render_cache.store(cache_key, str(output_path), {
+        'ad_group_name': ad_group_name,
+        'drive_file_id': source['id'],
+        'drive_file_name': source['name'],
+        'created_at': datetime.now().isoformat(),
+    })
+
+def process_single_ad(ad, index, total, workspace=None, finder=None):
+    """
+    単一の不承認広告を処理（ジョブごとの作業フォルダで実行）
+    
+    Args:
+        finder: 広告間で共有するGoogleDriveFinder（案件フォルダの一覧を実行中に1回だけ取得する）
+    """
+    print(f"\n{'='*40}")
+    print(f"📍 処理中: {index}/{total}")
+    print(f"   広告グループ: {ad['ad_group_name']}")
+    print(f"   アカウントID: {ad['account_id']}")
+    print(f"{'='*40}")
+    
+    # 広告グループ名から案件と動画情報を取得
+    ad_group_name = ad['ad_group_name']
+    
+    # 特定の広告グループをスキップ（デマンドジェネレーション以外）
+    if SKIPPED_AD_GROUP in ad_group_name:
+        print(f"   ⚠️ スキップ: この広告グループはデマンドジェネレーション広告ではありません")
         return False
     
+    with (workspace or Workspace()).allocate(ad_group_name) as job:
+        return process_ad_in_workspace(ad, job, finder)
+
+def process_ad_in_workspace(ad, job, finder=None):
+    """Drive検索から合成・アップロード・キュー追加まで（元動画・背景・合成結果はjobの作業フォルダに置く）"""
+    ad_group_name = ad['ad_group_name']
+    
+    # 2. Google Driveから動画を検索
+    print("\n2️⃣ Google Driveから動画を検索...")
+    finder = finder or GoogleDriveFinder()
+    
+    source = finder.resolve_video_by_ad_group(ad_group_name)
+    
+    if not source:
+        parsed = finder.parse_ad_group_name(ad_group_name)
+        print(f"❌ 対象動画が見つかりません")
+        print(f"   案件: {parsed['project']}")
+        print(f"   動画名: {parsed['video_name']}")
+        if not parsed.get('has_mcc', True):
+            print(f"   ⚠️ 注意: MCC記載が欠けている可能性があります")
+        print(f"   Google Driveの案件フォルダに該当する動画をアップロードしてください")
+        return False
+    
+    # 解析情報を取得
+    parsed = finder.parse_ad_group_name(ad_group_name)
+    project_name = parsed['project']
+    search_name = parsed['video_name']
+    
+    title = search_name
+    
+    # 前回の実行で合成済み（アップロード・キュー追加で失敗）なら合成をやり直さない
+    render_cache = RenderCache()
+    cache_key, cached_path = None, None
+    if source.get('md5Checksum'):
+        cache_key, cached_path = render_cache.lookup(f"md5:{source['md5Checksum']}", MAIN_SCALE, DISCLAIMER_TEXT)
+    
+    # 合成しながらアップロードする場合は、合成を始める前に認証しておく
+    youtube, youtube_url = None, None
+    if Config.UPLOAD_WHILE_ENCODING and not cached_path:
+        youtube = get_youtube_service(project_name)
+        if not youtube:
+            return False
+    
+    if cached_path:
+        print(f"   ♻️ 合成済みの動画を再利用: {cached_path}")
+        print(f"   サイズ: {os.path.getsize(cached_path) / 1024 / 1024:.1f} MB")
+        upload_path = output_path = cached_path
+    elif cache_key and Config.STREAM_DRIVE_DOWNLOAD and STREAMING_SUPPORTED and not finder.has_cached_source(source):
+        # md5でキャッシュを引けたため、ダウンロード完了を待たずに背景生成・合成を始める
+        stream = finder.open_stream(source, search_name, job.stage_dir('source'))
+        if youtube:
+            upload_path, output_path, youtube_url = merge_and_upload(
+                stream.output_path, project_name, job, youtube, title, stream
+            )
+        else:
+            upload_path, output_path = merge_with_background(stream.output_path, project_name, job, stream)
+        stream.wait()
+        print(f"   ✅ ダウンロード完了: {stream.output_path}")
+        finder.store_source(source, stream.output_path)
+        store_render(render_cache, cache_key, upload_path, output_path, ad_group_name, source)
+    else:
+        video_path = finder.download(source, search_name, job.stage_dir('source'))
+        if not video_path:
+            print(f"❌ 動画のダウンロードに失敗しました: {source['name']}")
+            return False
+        
+        print(f"   ✅ ダウンロード完了: {video_path}")
+        print(f"   サイズ: {os.path.getsize(video_path) / 1024 / 1024:.1f} MB")
+        
+        # Driveのmd5がない場合はダウンロードした内容のハッシュで検索
+        if not cache_key:
+            cache_key, cached_path = render_cache.lookup(f"sha256:{file_sha256(video_path)}",
+                                                         MAIN_SCALE, DISCLAIMER_TEXT)
+        
+        if cached_path:
+            print(f"   ♻️ 合成済みの動画を再利用: {cached_path}")
+            upload_path = output_path = cached_path
+        elif youtube:
+            upload_path, output_path, youtube_url = merge_and_upload(video_path, project_name, job, youtube, title)
+            store_render(render_cache, cache_key, upload_path, output_path, ad_group_name, source)
+        else:
+            upload_path, output_path = merge_with_background(video_path, project_name, job)
+            store_render(render_cache, cache_key, upload_path, output_path, ad_group_name, source)
+    
+    # 4. YouTubeアップロード（合成しながらアップロードできなかった場合はファイルから）
+    if not youtube_url:
+        print("\n4️⃣ YouTubeアップロード...")
+        youtube = youtube or get_youtube_service(project_name)
+        if not youtube:
+            return False
+        youtube_url = upload_video(youtube, upload_path, title)
+        if not youtube_url:
+            return False
+    
     # 5. 広告キューに追加
     print("\n5️⃣ 広告キューに追加...")
     queue_manager = SimpleQueueManager()
@@ -186,6 +353,9 @@ def process_single_ad(ad, index, total):
     )
     
     print(f"   ✅ キュー追加完了: {process_id}")
+    # 再試行用に残していた合成結果は不要になる
+    if cache_key:
+        render_cache.remove(cache_key)
     print(f"   - 広告グループ名: {ad_group_name}")
     print(f"   - アカウントID: {ad['account_id']}")
     print(f"   - YouTube URL: {youtube_url}")
@@ -214,6 +384,14 @@ def process_disapproved_ads():
     
     print(f"📊 不承認広告が{len(disapproved_ads)}件見つかりました")
     
+    # 広告ごとの作業フォルダ（古いものは容量上限・保持期間に従って削除）
+    workspace = Workspace()
+    # Driveの検索は全広告で共有（案件フォルダごとに1回だけ一覧を取得）
+    finder = GoogleDriveFinder()
+    # 全広告の元動画をバッチリクエストでまとめて特定しておく
+    sources = finder.resolve_many(ad['ad_group_name'] for ad in disapproved_ads)
+    print(f"📁 元動画: {sum(1 for source in sources.values() if source)}/{len(sources)}件 特定")
+    
     # すべての不承認広告を順番に処理
     processed_count = 0
     failed_count = 0
@@ -221,7 +399,7 @@ def process_disapproved_ads():
     
     for index, ad in enumerate(disapproved_ads, 1):
         try:
-            success = process_single_ad(ad, index, len(disapproved_ads))
+            success = process_single_ad(ad, index, len(disapproved_ads), workspace, finder)
             
             if success:
                 processed_count += 1
@@ -232,7 +410,7 @@ def process_disapproved_ads():
                 print(f"✅ {index}/{len(disapproved_ads)} 処理成功")
             else:
                 # スキップの場合は失敗にカウントしない
-                if 'YT_NB_7stepパク応援特典8選_MCC02運用02_28_01' in ad['ad_group_name']:
+                if SKIPPED_AD_GROUP in ad['ad_group_name']:
                     results.append({
                         'ad_group_name': ad['ad_group_name'],
                         'status': 'スキップ（非デマンドジェネレーション）'
@@ -277,6 +455,75 @@ def process_disapproved_ads():
     
     return processed_count > 0
 
+def render_draft_proxies(draft_seconds=None):
+    """不承認広告すべての確認用ドラフトを作成（アップロード・キュー追加はしない）"""
+    print("=" * 80)
+    print("🔍 不承認広告のドラフト作成")
+    print("=" * 80)
+    
+    reader = ApprovalStatusReader()
+    disapproved_ads = [ad for ad in reader.get_disapproved_ads() if SKIPPED_AD_GROUP not in ad['ad_group_name']]
+    if not disapproved_ads:
+        print("✅ 不承認広告はありません")
+        return True
+    
+    output_dir = project_root / 'ad-videos' / 'drafts'
+    output_dir.mkdir(parents=True, exist_ok=True)
+    finder = GoogleDriveFinder()
+    finder.resolve_many(ad['ad_group_name'] for ad in disapproved_ads)
+    merger = VideoMergerWithAutoBG()
+    workspace = Workspace()
+    
+    drafts = []
+    for index, ad in enumerate(disapproved_ads, 1):
+        ad_group_name = ad['ad_group_name']
+        print(f"\n📍 {index}/{len(disapproved_ads)}: {ad_group_name}")
+        try:
+            source = finder.resolve_video_by_ad_group(ad_group_name)
+            if not source:
+                print("   ❌ 対象動画が見つかりません")
+                continue
+            
+            parsed = finder.parse_ad_group_name(ad_group_name)
+            # 元動画は本番と同じく作業フォルダに置き、元動画キャッシュを通して取得する
+            with workspace.allocate(ad_group_name) as job:
+                video_path = finder.download(source, parsed['video_name'], job.stage_dir('source'))
+                if not video_path:
+                    print(f"   ❌ 動画のダウンロードに失敗しました: {source['name']}")
+                    continue
+                
+                output_path = output_dir / f"{parsed['project']}_{parsed['video_name']}_draft.mp4"
+                result = merger.process_with_auto_background(
+                    str(video_path),
+                    str(output_path),
+                    main_scale=MAIN_SCALE,
+                    disclaimer_text=DISCLAIMER_TEXT,
+                    draft=True,
+                    draft_seconds=draft_seconds
+                )
+            drafts.append(result['output_path'])
+            print(f"   ✅ ドラフト: {result['output_path']} ({result['output_size']}, {result['duration']:.1f}秒)")
+        except Exception as e:
+            print(f"   ❌ エラー発生: {e}")
+    
+    print(f"\n📋 ドラフト {len(drafts)}/{len(disapproved_ads)}件:")
+    for path in drafts:
+        print(f"   - {path}")
+    print("確認後、オプションなしで実行すると本番の合成・アップロードを行います")
+    return len(drafts) == len(disapproved_ads)
+
 if __name__ == "__main__":
-    success = process_disapproved_ads()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='不承認広告の再合成・アップロード')
+    parser.add_argument('--draft', action='store_true',
+                        help='全不承認広告の確認用ドラフトだけを作成（アップロードしない）')
+    parser.add_argument('--draft-seconds', type=float, default=Config.DRAFT_SECONDS,
+                        help='ドラフトの長さの上限（秒、0で全体）')
+    args = parser.parse_args()
+    
+    if args.draft:
+        success = render_draft_proxies(args.draft_seconds or None)
+    else:
+        success = process_disapproved_ads()
     exit(0 if success else 1)
\ No newline at end of file
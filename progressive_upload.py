@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+合成中の動画のアップロード
+ffmpegが断片化MP4で書き込んでいるファイルを、書き込み済みの範囲からレジューマブルアップロードの
+チャンクとして送り、ffmpegの終了後に最後のチャンクで確定する（合計時間が 合成+アップロード から
+ほぼ max(合成, アップロード) になる）
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from googleapiclient.http import HttpRequest, MediaUpload
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# レジューマブルアップロードの途中のチャンクは256KBの倍数にする必要がある
+CHUNK_ALIGNMENT = 256 * 1024
+
+
+class ProgressiveUploadError(Exception):
+    """合成またはアップロードの失敗"""
+
+    def __init__(self, message: str, encode_result: Any = None, cause: Optional[BaseException] = None):
+        super().__init__(message)
+        # 合成に成功していれば合成結果（アップロードだけ失敗した場合はファイルからやり直せる）
+        self.encode_result = encode_result
+        self.cause = cause
+
+
+class GrowingFileUpload(MediaUpload):
+    """書き込み中のファイルを、書き込み済みの範囲から送るMediaUpload"""
+
+    def __init__(self, path: str, mimetype: str = 'video/mp4', chunksize: Optional[int] = None,
+                 poll_interval: float = 0.5):
+        """
+        Args:
+            path: 書き込み中（これから作成される場合も可）のファイル
+            chunksize: チャンクサイズ（256KBの倍数に切り上げる）
+            poll_interval: ファイルの伸びを確認する間隔（秒）
+        """
+        chunksize = chunksize or Config.PROGRESSIVE_UPLOAD_CHUNK_MB * 1024 * 1024
+        self._path = path
+        self._mimetype = mimetype
+        self._chunksize = -(-chunksize // CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT
+        self._poll_interval = poll_interval
+        self._finished = threading.Event()
+        self._final_size: Optional[int] = None
+        self._error: Optional[BaseException] = None
+        self._last_chunk = False
+
+    def finish(self):
+        """書き込み完了（以降はファイルの末尾までで確定する）"""
+        self._final_size = self._current_size()
+        self._finished.set()
+
+    def fail(self, error: BaseException):
+        """書き込み失敗（送信中のアップロードを中止させる）"""
+        self._error = error
+        self._finished.set()
+
+    def _current_size(self) -> int:
+        try:
+            return os.path.getsize(self._path)
+        except FileNotFoundError:
+            return 0
+
+    def chunksize(self):
+        # 最後のチャンクがちょうどchunksizeだった場合も、短いチャンクとして総サイズ付きで送らせる
+        return self._chunksize + 1 if self._last_chunk else self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        # 書き込み完了までは総サイズ不明（'*'）として送る
+        return self._final_size
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def getbytes(self, begin, length):
+        """
+        begin から length バイトを返す
+        その先にまだデータが続くと分かるまで待つ（途中のチャンクで送った範囲がファイルの末尾だと、
+        総サイズを後から確定できないため）。書き込み完了後は末尾までを返す
+        """
+        while True:
+            if self._error is not None:
+                raise ProgressiveUploadError(f"書き込みに失敗したためアップロードを中止します: {self._error}",
+                                             cause=self._error)
+            finished = self._finished.is_set()
+            if finished or self._current_size() > begin + length:
+                break
+            self._finished.wait(self._poll_interval)
+
+        with open(self._path, 'rb') as f:
+            f.seek(begin)
+            data = f.read(length)
+        if finished and begin + len(data) >= self._final_size:
+            self._last_chunk = True
+        return data
+
+    def to_json(self):
+        raise NotImplementedError("書き込み中のファイルのアップロードは保存・再開できません")
+
+
+def upload_while_encoding(create_request: Callable[[MediaUpload], HttpRequest], output_path: str,
+                          encode: Callable[[], Any], chunksize: Optional[int] = None,
+                          num_retries: int = 3) -> Tuple[Any, Dict]:
+    """
+    encode() を別スレッドで実行しながら、書き込まれていく output_path をアップロード
+
+    Args:
+        create_request: MediaUploadを受け取ってアップロードのリクエストを作る関数
+            （例: lambda media: youtube.videos().insert(..., media_body=media)）
+        output_path: encode() が書き込むファイル（断片化MP4など、追記のみで書き戻さない形式）
+        encode: 合成処理。戻り値はそのまま返す
+
+    Returns:
+        (encode() の戻り値, アップロードのレスポンス)
+
+    Raises:
+        ProgressiveUploadError: 合成またはアップロードに失敗した場合
+            （合成に成功していれば encode_result に合成結果が入る）
+    """
+    # 前回の出力が残っていると、ffmpegが書き直す前の内容を送ってしまう
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    media = GrowingFileUpload(output_path, chunksize=chunksize)
+    state = {}
+
+    def run_encode():
+        try:
+            state['result'] = encode()
+            media.finish()
+        except BaseException as e:
+            state['error'] = e
+            media.fail(e)
+
+    encoder = threading.Thread(target=run_encode, daemon=True)
+    encoder.start()
+
+    response = None
+    upload_error = None
+    try:
+        request = create_request(media)
+        last_logged = -1
+        while response is None:
+            status, response = request.next_chunk(num_retries=num_retries)
+            if status:
+                uploaded_mb = status.resumable_progress / 1024 / 1024
+                if int(uploaded_mb) // 10 != last_logged // 10:
+                    last_logged = int(uploaded_mb)
+                    logger.info(f"アップロード済み: {uploaded_mb:.0f}MB（合成中）")
+    except Exception as e:
+        upload_error = e
+        media.fail(e)
+    finally:
+        # アップロードが失敗しても合成は最後まで待つ（ファイルからアップロードし直せるように）
+        encoder.join()
+
+    if 'error' in state:
+        raise ProgressiveUploadError(f"合成に失敗しました: {state['error']}", cause=state['error'])
+    if upload_error is not None:
+        raise ProgressiveUploadError(f"アップロードに失敗しました: {upload_error}",
+                                     encode_result=state['result'], cause=upload_error)
+    return state['result'], response
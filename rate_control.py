@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+出力サイズ・ビットレートを目標にしたレート制御
+サンプル区間の試しエンコードで複雑さを測り、動画ごとにCRFとmaxrateを決める
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+# x264はCRFが6上がるとビットレートがおよそ半分になる
+CRF_HALVING_STEP = 6.0
+# 予測誤差を見込んだ余裕（目標の何割を狙うか）
+TARGET_MARGIN = 0.9
+
+
+def parse_kbps(bitrate: str) -> float:
+    """'192k' / '2M' / '128000' をkbpsに変換"""
+    value = str(bitrate).strip().lower()
+    if value.endswith('k'):
+        return float(value[:-1])
+    if value.endswith('m'):
+        return float(value[:-1]) * 1000
+    return float(value) / 1000
+
+
+def resolve_targets(rate_control: Optional[Dict]) -> Optional[Dict]:
+    """
+    レート制御の指定を正規化（省略時は Config の既定値、どちらも0なら無効）
+
+    Returns:
+        {'max_size_mb': float | None, 'max_kbps': float | None} または None
+    """
+    rate_control = rate_control if rate_control is not None else {
+        'max_size_mb': Config.RATE_CONTROL_MAX_SIZE_MB,
+        'max_kbps': Config.RATE_CONTROL_MAX_KBPS,
+    }
+    max_size_mb = rate_control.get('max_size_mb') or None
+    max_kbps = rate_control.get('max_kbps') or None
+    if not max_size_mb and not max_kbps:
+        return None
+    return {'max_size_mb': max_size_mb, 'max_kbps': max_kbps}
+
+
+def video_bitrate_budget(duration: float, targets: Dict, audio_kbps: float) -> float:
+    """映像に使えるビットレート（kbps）。サイズ上限と長さ当たりの上限の小さい方"""
+    budgets = []
+    if targets.get('max_size_mb'):
+        total_kbps = targets['max_size_mb'] * 1024 * 1024 * 8 / 1000 / duration
+        budgets.append(total_kbps - audio_kbps)
+    if targets.get('max_kbps'):
+        budgets.append(targets['max_kbps'] - audio_kbps)
+    return max(min(budgets), Config.RATE_CONTROL_MIN_VIDEO_KBPS)
+
+
+def sample_windows(duration: float, count: int = None, length: float = None) -> List[Tuple[float, float]]:
+    """複雑さ計測用のサンプル区間 [(開始, 長さ), ...] を動画全体から均等に選ぶ"""
+    count = count or Config.RATE_CONTROL_SAMPLES
+    length = min(length or Config.RATE_CONTROL_SAMPLE_SECONDS, duration)
+    if duration <= length * count:
+        return [(0.0, duration)]
+    step = (duration - length) / (count - 1) if count > 1 else 0
+    return [(round(i * step, 3), length) for i in range(count)]
+
+
+def choose_crf(probe_kbps: float, probe_crf: float, target_kbps: float) -> float:
+    """試しエンコードのビットレートから、目標ビットレートに収まるCRFを推定"""
+    aim_kbps = target_kbps * TARGET_MARGIN
+    if probe_kbps <= aim_kbps:
+        # 目標より十分小さい場合もCRFは試しエンコードの値より下げない（画質は十分）
+        return probe_crf
+    crf = probe_crf + CRF_HALVING_STEP * math.log2(probe_kbps / aim_kbps)
+    return round(min(crf, Config.RATE_CONTROL_MAX_CRF), 1)
+
+
+def predict_video_kbps(probe_kbps: float, probe_crf: float, crf: float, target_kbps: float) -> float:
+    """選んだCRFでの映像ビットレート予測（maxrateで頭打ち）"""
+    predicted = probe_kbps * 2 ** (-(crf - probe_crf) / CRF_HALVING_STEP)
+    return min(predicted, target_kbps)
+
+
+def plan_rate_control(duration: float, probe_kbps: float, targets: Dict, audio_kbps: float) -> Dict:
+    """
+    試しエンコードの結果からエンコード設定と予測サイズを決める
+
+    Returns:
+        {'crf', 'maxrate_kbps', 'target_kbps', 'probe_kbps', 'predicted_bytes'}
+    """
+    target_kbps = video_bitrate_budget(duration, targets, audio_kbps)
+    probe_crf = Config.RATE_CONTROL_PROBE_CRF
+    crf = choose_crf(probe_kbps, probe_crf, target_kbps)
+    video_kbps = predict_video_kbps(probe_kbps, probe_crf, crf, target_kbps)
+    return {
+        'crf': crf,
+        'maxrate_kbps': int(target_kbps),
+        'target_kbps': target_kbps,
+        'probe_kbps': probe_kbps,
+        'predicted_bytes': int((video_kbps + audio_kbps) * 1000 / 8 * duration),
+    }
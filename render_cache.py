@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+合成済み動画のキャッシュ
+入力（元動画の内容ハッシュ・背景・スケール・免責事項・フォント・エンコード設定）から作ったキーで
+合成結果を保存し、アップロードやキュー追加に失敗した広告を次回の実行で再エンコードせずに済ませる。
+成功した広告の合成結果は残さない（同じ元動画が再び不承認になった場合は新しい背景で作り直す）
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from config import Config
+from encode_profiles import DEFAULT_PROFILE
+from file_cache import FileCache
+
+logger = logging.getLogger(__name__)
+
+# 自動生成の背景（ランダムな動物・自然）はどれを使っても同じ扱いにする
+# （キャッシュは失敗した広告の再試行用で、アップロード・キュー追加が成功したら削除する）
+AUTO_BACKGROUND = 'replicate:auto'
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_fingerprint(path: Optional[str]) -> Optional[str]:
+    """設定ファイル・フォントの識別子（パス・サイズ・更新時刻）"""
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def encode_settings_fingerprint() -> Dict:
+    """出力に影響するエンコード設定（プロファイル・キャンバス・フレームレート・レート制御）"""
+    profiles = None
+    if os.path.exists(Config.ENCODE_PROFILE_PATH):
+        with open(Config.ENCODE_PROFILE_PATH, 'rb') as f:
+            profiles = hashlib.sha256(f.read()).hexdigest()
+    return {
+        'default_profile': DEFAULT_PROFILE,
+        'profiles': profiles,
+        'canvas_ladder': Config.OUTPUT_CANVAS_LADDER,
+        'max_fps': Config.MAX_OUTPUT_FPS,
+        'rate_control': [Config.RATE_CONTROL_MAX_SIZE_MB, Config.RATE_CONTROL_MAX_KBPS],
+    }
+
+
+def render_cache_key(source_hash: str, background_id: str, main_scale: float,
+                     disclaimer_text: Optional[str]) -> str:
+    """
+    合成結果のキャッシュキー
+
+    Args:
+        source_hash: 元動画の内容ハッシュ（'md5:<Driveのmd5Checksum>' または 'sha256:<...>'）
+        background_id: 背景の識別子（自動生成の場合は AUTO_BACKGROUND）
+    """
+    components = {
+        'source': source_hash,
+        'background': background_id,
+        'main_scale': round(float(main_scale), 4),
+        'disclaimer_text': disclaimer_text,
+        'font': _file_fingerprint(Config.get_font_path()),
+        'encode': encode_settings_fingerprint(),
+    }
+    encoded = json.dumps(components, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class RenderCache(FileCache):
+    """合成済み動画のキャッシュ（容量上限付き）"""
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        super().__init__(
+            root or Config.RENDER_CACHE_DIR,
+            Config.RENDER_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes,
+            suffix='.mp4',
+            name='レンダーキャッシュ'
+        )
+
+    def lookup(self, source_hash: str, main_scale: float, disclaimer_text: Optional[str],
+               background_id: str = AUTO_BACKGROUND) -> Tuple[str, Optional[Path]]:
+        """
+        キャッシュを検索
+
+        Returns:
+            (キー, キャッシュ済みのパス または None)
+        """
+        key = render_cache_key(source_hash, background_id, main_scale, disclaimer_text)
+        return key, self.get(key)
+
+    def store(self, key: str, output_path: str, metadata: Optional[Dict] = None) -> Optional[Path]:
+        """合成結果を登録（失敗しても処理は続けられるため警告のみ）"""
+        try:
+            return self.put(key, output_path, metadata)
+        except OSError as e:
+            logger.warning(f"レンダーキャッシュへの登録に失敗しました: {e}")
+            return None
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+同時実行するffmpegジョブの資源管理
+検出したコア数からジョブごとのスレッド数を割り当て、推定メモリと作業ディレクトリの空き容量が
+足りる場合だけジョブを開始させる。推定に使う係数は実機で計測（キャリブレーション）できる
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from config import Config
+from encode_profiles import DEFAULT_PROFILE, video_encoder_args
+from ffmpeg_runner import FFmpegError, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# キャリブレーション前の推定係数（1080x1920 / libx264 faster での実測の目安）
+DEFAULT_CALIBRATION = {
+    'base_memory_mb': 80.0,  # 入力デコード等を含む固定分
+    'memory_mb_per_megapixel': 150.0,  # 1スレッド時の解像度当たり
+    'memory_mb_per_megapixel_thread': 40.0,  # スレッド1つ増える毎の解像度当たり
+    'output_mb_per_megapixel_second': 0.35,  # 出力1秒・解像度当たりのサイズ
+    'encode_fps_per_thread': None,
+}
+
+# 作業ファイルの倍率（一時出力＋セグメント並列時のセグメント）
+DISK_WORK_FACTOR = 2.0
+
+
+def available_cores() -> int:
+    """このプロセスが使えるコア数（CPUアフィニティを考慮）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory_mb() -> Optional[float]:
+    """利用可能なメモリ（/proc/meminfo の MemAvailable）。取得できない環境ではNone"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_disk_mb(path: str) -> float:
+    """pathを含むファイルシステムの空き容量"""
+    return shutil.disk_usage(path).free / 1024 / 1024
+
+
+def load_calibration(path: Optional[str] = None) -> Dict:
+    """キャリブレーション結果を読み込む（未計測の項目は既定値）"""
+    path = path or Config.RESOURCE_CALIBRATION_PATH
+    calibration = dict(DEFAULT_CALIBRATION)
+    try:
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        calibration.update({k: v for k, v in saved.items() if k in DEFAULT_CALIBRATION})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"キャリブレーション結果を読み込めません: {path}: {e}")
+    return calibration
+
+
+def thread_budget(jobs: int, cores: Optional[int] = None) -> int:
+    """同時に実行するjobs件でコアを分け合う場合の1件当たりのスレッド数"""
+    cores = cores or available_cores()
+    return max(1, cores // max(1, jobs))
+
+
+def thread_args(threads: Optional[int]) -> List[str]:
+    """フィルターグラフのスレッド数を制限するグローバルオプション（ffmpegの直後に置く）"""
+    return ['-filter_complex_threads', str(threads)] if threads else []
+
+
+def estimate_job(width: int, height: int, duration: float, threads: int,
+                 calibration: Optional[Dict] = None) -> Dict:
+    """
+    合成1件の資源使用量を推定
+
+    Returns:
+        {'memory_mb', 'disk_mb', 'threads'}
+    """
+    calibration = calibration or DEFAULT_CALIBRATION
+    megapixels = width * height / 1_000_000
+    memory_mb = calibration['base_memory_mb'] + megapixels * (
+        calibration['memory_mb_per_megapixel'] + calibration['memory_mb_per_megapixel_thread'] * (threads - 1)
+    )
+    disk_mb = calibration['output_mb_per_megapixel_second'] * megapixels * duration * DISK_WORK_FACTOR
+    return {'memory_mb': memory_mb, 'disk_mb': disk_mb, 'threads': threads}
+
+
+class ResourceScheduler:
+    """推定メモリ・空き容量の範囲でジョブの開始を許可する（スレッド間で共有）"""
+
+    def __init__(self, work_dir: str, max_jobs: Optional[int] = None,
+                 calibration: Optional[Dict] = None):
+        """
+        Args:
+            work_dir: 出力・一時ファイルを書くディレクトリ（空き容量の確認先）
+            max_jobs: 同時実行数の上限（省略時はコア数）
+            calibration: 推定係数（省略時は保存済みのキャリブレーション結果）
+        """
+        self.work_dir = work_dir
+        self.cores = available_cores()
+        self.max_jobs = max(1, min(max_jobs or self.cores, self.cores))
+        self.calibration = calibration or load_calibration()
+        self._condition = threading.Condition()
+        self._running: Dict[int, Dict] = {}
+        self._next_token = 0
+
+    def thread_budget(self) -> int:
+        return thread_budget(self.max_jobs, self.cores)
+
+    def estimate(self, info: Dict, width: int, height: int) -> Dict:
+        """動画情報と出力サイズから、このスケジューラのスレッド割り当てでの使用量を推定"""
+        return estimate_job(width, height, info['duration'], self.thread_budget(), self.calibration)
+
+    def _blocked_by(self, estimate: Dict) -> Optional[str]:
+        """開始できない理由（開始できる場合はNone）"""
+        if len(self._running) >= self.max_jobs:
+            return f"同時実行数 {self.max_jobs}"
+
+        reserved_memory = sum(job['memory_mb'] for job in self._running.values())
+        memory = available_memory_mb()
+        if memory is not None:
+            # 実行中のジョブはまだ最大使用量に達していない可能性があるため予約分を差し引く
+            headroom = memory - Config.RESOURCE_MEMORY_RESERVE_MB - reserved_memory
+            if estimate['memory_mb'] > headroom:
+                return f"メモリ不足（必要 {estimate['memory_mb']:.0f}MB / 空き {headroom:.0f}MB）"
+
+        reserved_disk = sum(job['disk_mb'] for job in self._running.values())
+        headroom = free_disk_mb(self.work_dir) - Config.RESOURCE_DISK_RESERVE_MB - reserved_disk
+        if estimate['disk_mb'] > headroom:
+            return f"空き容量不足（必要 {estimate['disk_mb']:.0f}MB / 空き {headroom:.0f}MB）"
+        return None
+
+    def acquire(self, estimate: Dict, timeout: Optional[float] = None) -> int:
+        """
+        資源が空くまで待ってジョブの開始を許可し、解放用のトークンを返す
+        実行中のジョブがない場合は推定が空きを超えても開始する（待ち続けないため）
+
+        Raises:
+            TimeoutError: timeout秒以内に開始できなかった場合
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._condition:
+            logged = None
+            while True:
+                reason = self._blocked_by(estimate)
+                if reason is None:
+                    break
+                if not self._running:
+                    logger.warning(f"推定使用量が空きを超えていますが、実行中のジョブがないため開始します: {reason}")
+                    break
+                if reason != logged:
+                    logger.info(f"ジョブの開始を待機中: {reason}")
+                    logged = reason
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"ジョブを開始できませんでした: {reason}")
+                # 他のプロセスによる空きの変化も拾えるよう定期的に再確認する
+                self._condition.wait(min(remaining, 5.0) if remaining is not None else 5.0)
+
+            token = self._next_token
+            self._next_token += 1
+            self._running[token] = estimate
+            return token
+
+    def release(self, token: int):
+        with self._condition:
+            self._running.pop(token, None)
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, estimate: Dict, timeout: Optional[float] = None):
+        token = self.acquire(estimate, timeout)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+
+def _measure_encode(width: int, height: int, threads: int, seconds: float, work_dir: str) -> Dict:
+    """テスト映像をエンコードし、ffmpegプロセスの最大RSS・所要時間・出力サイズを計測"""
+    output = os.path.join(work_dir, f"calibration_{width}x{height}_{threads}.mp4")
+    cmd = [
+        'ffmpeg', '-v', 'error', *thread_args(threads),
+        '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate=30:duration={seconds}",
+        *video_encoder_args(DEFAULT_PROFILE, threads=threads), '-y', output
+    ]
+    try:
+        result = run_ffmpeg(cmd, duration=seconds, label='キャリブレーション')
+    except FFmpegError as e:
+        raise RuntimeError(f"キャリブレーション用のエンコードに失敗しました: {e}") from e
+    if result['max_rss_mb'] is None:
+        raise RuntimeError("この環境ではffmpegプロセスのメモリ使用量を計測できません")
+    elapsed = result['elapsed']
+    return {
+        'memory_mb': result['max_rss_mb'],
+        'elapsed': elapsed,
+        'bytes': os.path.getsize(output),
+        'fps': seconds * 30 / elapsed if elapsed > 0 else None,
+    }
+
+
+def calibrate(width: int = 1080, height: int = 1920, seconds: float = 5.0) -> Dict:
+    """
+    このマシンでのジョブ当たりのコストを計測して推定係数を求める
+    小さい映像で固定分、1スレッドと全コアで解像度・スレッド当たりのメモリを測る
+    """
+    cores = available_cores()
+    megapixels = width * height / 1_000_000
+    work_dir = tempfile.mkdtemp(prefix='resource_calibration_')
+    try:
+        base = _measure_encode(64, 64, 1, seconds, work_dir)
+        single = _measure_encode(width, height, 1, seconds, work_dir)
+        multi = _measure_encode(width, height, cores, seconds, work_dir) if cores > 1 else single
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    per_thread = (multi['memory_mb'] - single['memory_mb']) / (cores - 1) / megapixels if cores > 1 else 0.0
+    return {
+        'base_memory_mb': round(base['memory_mb'], 1),
+        'memory_mb_per_megapixel': round(max(single['memory_mb'] - base['memory_mb'], 0) / megapixels, 1),
+        'memory_mb_per_megapixel_thread': round(max(per_thread, 0), 1),
+        'output_mb_per_megapixel_second': round(single['bytes'] / 1024 / 1024 / megapixels / seconds, 3),
+        'encode_fps_per_thread': round(single['fps'], 1) if single['fps'] else None,
+        'measured': {
+            'cores': cores,
+            'canvas': f"{width}x{height}",
+            'single_thread': single,
+            'all_cores': multi,
+        },
+    }
+
+
+def save_calibration(calibration: Dict, path: Optional[str] = None):
+    path = path or Config.RESOURCE_CALIBRATION_PATH
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(calibration, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"キャリブレーション結果を保存: {path}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='ffmpegジョブの資源確認とキャリブレーション')
+    parser.add_argument('--calibrate', action='store_true', help='ジョブ当たりのコストを計測して保存')
+    parser.add_argument('--work-dir', default=Config.OUTPUT_FOLDER, help='空き容量を確認するディレクトリ')
+    parser.add_argument('--output', default=Config.RESOURCE_CALIBRATION_PATH, help='キャリブレーション結果の保存先')
+    args = parser.parse_args()
+
+    if args.calibrate:
+        result = calibrate()
+        save_calibration(result, args.output)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    work_dir = args.work_dir if os.path.isdir(args.work_dir) else '.'
+    memory = available_memory_mb()
+    print(f"コア数: {available_cores()}")
+    print(f"利用可能メモリ: {f'{memory:.0f}MB' if memory is not None else '不明'}")
+    print(f"空き容量 ({work_dir}): {free_disk_mb(work_dir):.0f}MB")
+    estimate = estimate_job(1080, 1920, 60, thread_budget(Config.BATCH_WORKERS), load_calibration(args.output))
+    print(f"1080x1920・60秒・{estimate['threads']}スレッドの推定: "
+          f"メモリ {estimate['memory_mb']:.0f}MB / ディスク {estimate['disk_mb']:.0f}MB")
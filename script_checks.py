@@ -0,0 +1,29 @@
+"""
+テストスクリプト（python test_xxx.py で実行）の結果表示
+確認項目ごとの ✅/❌ と、スクリプト全体の結果を表示する
+"""
+from typing import Dict, Iterable
+
+
+def report(checks: Dict[str, bool]) -> bool:
+    """
+    確認項目の結果を1行ずつ表示
+
+    Returns:
+        すべて成功した場合True
+    """
+    for label, ok in checks.items():
+        print(f"  {label}: {'✅' if ok else '❌'}")
+    return all(checks.values())
+
+
+def finish(results: Iterable[bool]) -> bool:
+    """
+    スクリプト全体の結果を表示
+
+    Returns:
+        すべて成功した場合True（終了コードに使う）
+    """
+    ok = all(results)
+    print(f"\n=== {'すべて成功' if ok else '失敗あり'} ===")
+    return ok
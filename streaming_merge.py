@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+ダウンロード中の動画の合成
+moovがファイル先頭にあるMP4は、ダウンロードを待たずに名前付きパイプ経由でffmpegに渡して
+転送と合成を重ねる。シークが必要な形式や失敗時はダウンロード完了後にファイルから合成する
+"""
+
+import logging
+from typing import Dict, Optional
+
+from automation.drive_stream import STREAMING_SUPPORTED, DriveStreamingDownload
+from config import Config
+from mp4_header_reader import scan_mp4_prefix
+from video_merger_auto_bg import VideoMergerWithAutoBG
+
+logger = logging.getLogger(__name__)
+
+# moovを探すために最初に読む量（見つからなければ倍にしていく）
+INITIAL_PREFIX_BYTES = 256 * 1024
+
+
+def wait_for_header(stream: DriveStreamingDownload) -> Optional[Dict]:
+    """
+    ダウンロード中のデータの先頭からmoovを解析
+
+    Returns:
+        動画情報（read_mp4_headerと同じ形式）。先頭から読むだけでは合成できない場合はNone
+    """
+    size = INITIAL_PREFIX_BYTES
+    limit = Config.STREAM_HEADER_MAX_MB * 1024 * 1024
+    while True:
+        prefix = stream.wait_for_bytes(size, timeout=Config.STREAM_STALL_TIMEOUT)
+        status, info = scan_mp4_prefix(prefix)
+        if status == 'moov':
+            return info
+        if status != 'incomplete' or len(prefix) < size or size >= limit:
+            logger.info(f"先頭から読めない形式のためファイルから合成します（{status}）")
+            return None
+        size *= 2
+
+
+def merge_while_downloading(merger: VideoMergerWithAutoBG, stream: DriveStreamingDownload,
+                            output_video: str, retry_from_file: bool = True, **merge_kwargs) -> Dict:
+    """
+    ダウンロードと並行して背景生成・合成を行う
+
+    Args:
+        stream: 開始済みのダウンロード
+        retry_from_file: パイプ入力での合成に失敗した場合、ダウンロード完了後にファイルから合成し直す
+            （出力を読みながらアップロードしている場合は書き直せないためFalseにして例外を受け取る。
+            合成を始める前の先頭の解析で失敗した場合は、Falseでもファイルから合成する）
+        merge_kwargs: process_with_auto_background に渡す引数（main_scale, disclaimer_text 等）
+
+    Returns:
+        process_with_auto_background の結果
+    """
+    fifo_path = None
+    try:
+        header = wait_for_header(stream) if STREAMING_SUPPORTED else None
+        if header is not None:
+            main_info = merger.normalize_video_info(header)
+            fifo_path = stream.open_fifo()
+            logger.info(f"ダウンロード中の動画をパイプで合成します"
+                        f"（{stream.bytes_written / 1024 / 1024:.1f}MB 受信済み）")
+            # パイプは先頭から1回しか読めないため、セグメント並列とレート制御の試しエンコードは使わない。
+            # ダウンロードが止まっている間はffmpegの進捗も止まるため、ストールの判定はダウンロードの待ち時間に合わせる
+            result = merger.process_with_auto_background(
+                fifo_path, output_video, main_info=main_info, parallel=False, rate_control={},
+                stall_timeout=Config.STREAM_STALL_TIMEOUT, **merge_kwargs
+            )
+            stream.close()
+            # ダウンロードが途中で失敗していた場合、出力も途中で切れているため使わない
+            stream.wait()
+            return result
+    except Exception as e:
+        stream.close()
+        # 先頭の解析中（合成を始める前）の失敗は、まだ何も出力していないため常にファイルからの合成に切り替える
+        if fifo_path is not None and not retry_from_file:
+            raise
+        logger.warning(f"パイプ入力での合成に失敗したため、ダウンロード完了後にファイルから合成します: {e}")
+    return merger.process_with_auto_background(str(stream.wait()), output_video, **merge_kwargs)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+不承認広告のクエリ取得のテストスクリプト
+gvizエンドポイントの代わりにローカルの疑似サーバーを立て、クエリで不承認の行だけを取得できること、
+クエリが失敗した場合は列を絞った全行の読み取りに切り替わり、同じ結果になることを確認
+"""
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from automation.approval_status_reader import DISAPPROVED_QUERY, ApprovalStatusReader
+
+# 日別(YT)の6行目以降（A, Z, AA, AB列）。None は空のセル
+SHEET_ROWS = [
+    ['YT_NB_老後は考えるな_撮影01_MCC02運用46_01_01', '123-456-7890', 'enabled', '不承認'],
+    ['YT_OM_売れっ子イラストレーター_撮影06_MCC02運用46_03_01', 1234567890, 'Removed', '不承認'],
+    ['YT_SBC_比較_撮影02_MCC01_01_01', 2345678901, 'enabled', '承認'],
+    None,
+    ['YT_SBC_体験談_撮影03_MCC01_02_01', 3456789012, None, ' 不承認 '],
+    ['YT_NB_副業_撮影04_MCC01_01_01', 4567890123, 'PAUSED', '不承認'],
+    [None, 5678901234, 'enabled', '不承認'],
+]
+FIRST_DATA_ROW = 6
+
+
+class FakeSheet:
+    """gspreadのWorksheetの代わり（batch_get と row_count のみ）"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.row_count = FIRST_DATA_ROW + len(rows) - 1
+        self.batch_get_calls = 0
+
+    def batch_get(self, ranges, value_render_option=None):
+        self.batch_get_calls += 1
+        results = []
+        for cell_range in ranges:
+            first_col, start, _, end = re.match(r'([A-Z]+)(\d+):([A-Z]+)(\d+)', cell_range).groups()
+            columns = slice(0, 1) if first_col == 'A' else slice(1, 4)
+            values = []
+            for row_number in range(int(start), int(end) + 1):
+                row = self.rows[row_number - FIRST_DATA_ROW] if row_number - FIRST_DATA_ROW < len(self.rows) else None
+                cells = ['' if v is None else v for v in (row or [None] * 4)[columns]]
+                # Sheets APIと同じく末尾の空セル・空行は返さない
+                while cells and cells[-1] == '':
+                    cells.pop()
+                values.append(cells)
+            while values and not values[-1]:
+                values.pop()
+            results.append(values)
+        return results
+
+
+class FakeGvizServer(BaseHTTPRequestHandler):
+    """gvizクエリの最小限の疑似サーバー（DISAPPROVED_QUERY の条件で絞り込んで返す）"""
+
+    # テストごとに切り替える応答
+    mode = 'ok'
+    queries = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        FakeGvizServer.queries.append(params)
+        if self.mode == 'http_error':
+            self.send_error(500)
+            return
+        if self.mode == 'query_error':
+            payload = {'status': 'error', 'errors': [{'reason': 'invalid_query', 'message': 'Invalid query',
+                                                      'detailed_message': 'Query parse error'}]}
+        else:
+            payload = {'status': 'ok', 'table': {'cols': [], 'rows': [self._row(row) for row in self._matching()]}}
+        body = f"/*O_o*/\ngoogle.visualization.Query.setResponse({json.dumps(payload)});".encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/javascript; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _matching():
+        for row in SHEET_ROWS:
+            if not row or not row[0] or not re.fullmatch(r'\s*不承認\s*', row[3] or ''):
+                continue
+            if row[2] is not None and re.fullmatch(r'\s*(removed|paused)\s*', row[2].lower()):
+                continue
+            yield row
+
+    def _row(self, row):
+        cells = []
+        for index, value in enumerate(row):
+            if value is None or (self.mode == 'mixed_types' and index == 1 and isinstance(value, str)):
+                # 列の型が数値と推定されると、文字列のセルは空になる
+                cells.append(None)
+            elif isinstance(value, int):
+                cells.append({'v': float(value), 'f': str(value)})
+            else:
+                cells.append({'v': value})
+        return {'c': cells}
+
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGvizServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_reader(server):
+    """認証・スプレッドシートへの接続を省いたリーダー"""
+    reader = ApprovalStatusReader.__new__(ApprovalStatusReader)
+    reader.sheet = FakeSheet(SHEET_ROWS)
+    reader.session = requests.Session()
+    reader.QUERY_PUSHDOWN = True
+    reader.GVIZ_ENDPOINT = f"http://127.0.0.1:{server.server_address[1]}/spreadsheets/d/{{spreadsheet_id}}/gviz/tq"
+    return reader
+
+
+def summarize(ads):
+    return [(ad['ad_group_name'], ad['project_name'], ad['video_name'], ad['account_id'], ad['status']) for ad in ads]
+
+
+def run_case(server, name, mode, expected, expect_fallback):
+    print(f"\n【{name}】")
+    FakeGvizServer.mode = mode
+    FakeGvizServer.queries = []
+    reader = make_reader(server)
+    ads = reader.get_disapproved_ads()
+
+    query = FakeGvizServer.queries[0] if FakeGvizServer.queries else {}
+    fell_back = reader.sheet.batch_get_calls > 0
+    checks = {
+        'クエリ送信': query.get('tq') == [DISAPPROVED_QUERY] and query.get('sheet') == [reader.APPROVAL_SHEET_NAME],
+        '全行読み取り' if expect_fallback else 'クエリのみ': fell_back == expect_fallback,
+        '結果一致': summarize(ads) == expected,
+    }
+    print(f"  不承認: {[ad['ad_group_name'] for ad in ads]}")
+    for label, ok in checks.items():
+        print(f"  {label}: {'✅' if ok else '❌'}")
+    return all(checks.values())
+
+
+def main():
+    # 基準: 列を絞った全行の読み取り
+    baseline_reader = ApprovalStatusReader.__new__(ApprovalStatusReader)
+    baseline_reader.sheet = FakeSheet(SHEET_ROWS)
+    baseline_reader.QUERY_PUSHDOWN = False
+    expected = summarize(baseline_reader.get_disapproved_ads())
+    print(f"全行の読み取り: {len(expected)}件")
+
+    server = start_server()
+    try:
+        results = [
+            len(expected) == 2,
+            run_case(server, 'クエリで取得', 'ok', expected, expect_fallback=False),
+            run_case(server, 'クエリの構文エラー', 'query_error', expected, expect_fallback=True),
+            run_case(server, 'HTTPエラー', 'http_error', expected, expect_fallback=True),
+            # アカウントIDの列に文字列と数値が混在し、gvizが文字列のセルを空にした場合
+            run_case(server, '列の型の推定で値が欠ける', 'mixed_types', expected, expect_fallback=True),
+        ]
+    finally:
+        server.shutdown()
+
+    print(f"\n=== {'すべて成功' if all(results) else '失敗あり'} ===")
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
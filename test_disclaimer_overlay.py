@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+免責事項オーバーレイのテストスクリプト
+テキストを背景ボックス付きの透過PNGとして描画できること、同じ条件では作り直さずに再利用すること、
+テキスト・サイズ・向きが変われば別の画像になること、Pillowがない場合はNone（drawtextに切り替え）になることを確認
+"""
+
+import os
+import tempfile
+
+import disclaimer_overlay
+from config import Config
+from disclaimer_overlay import (BOX_COLOR, TEXT_TOP, overlay_cache_key, overlay_position,
+                                render_disclaimer_overlay)
+from script_checks import finish, report
+
+TEXT = Config.DEFAULT_DISCLAIMER_TEXT
+
+
+def check_render(font_path):
+    from PIL import Image
+
+    print("\n【描画】")
+    padding = 15
+    path = render_disclaimer_overlay(TEXT, font_path, 28, 'vertical', padding)
+    with Image.open(path) as image:
+        image.load()
+    pixels = image.getdata()
+    return report({
+        'PNGを作成': path is not None and os.path.exists(path),
+        '透過画像': image.mode == 'RGBA',
+        '余白を含む大きさ': image.width > padding * 2 and image.height > padding * 2,
+        '角は背景ボックスの色': image.getpixel((0, 0)) == BOX_COLOR,
+        '文字が描画されている': any(pixel[:3] == (255, 255, 255) for pixel in pixels),
+    })
+
+
+def check_cache(font_path):
+    print("\n【キャッシュ】")
+    first = render_disclaimer_overlay(TEXT, font_path, 28, 'vertical')
+    mtime = os.stat(first).st_mtime_ns
+    # プロセス内のキャッシュがなくても（別の実行）、保存済みのPNGを使う
+    disclaimer_overlay._overlay_cache.clear()
+    second = render_disclaimer_overlay(TEXT, font_path, 28, 'vertical')
+    others = {
+        render_disclaimer_overlay('別の注意書き', font_path, 28, 'vertical'),
+        render_disclaimer_overlay(TEXT, font_path, 32, 'vertical'),
+        render_disclaimer_overlay(TEXT, font_path, 28, 'horizontal'),
+        render_disclaimer_overlay(TEXT, font_path, 28, 'vertical', padding=5),
+    }
+    return report({
+        '同じ条件は同じPNG': second == first,
+        '作り直さない': os.stat(second).st_mtime_ns == mtime,
+        '条件が違えば別のPNG': first not in others and len(others) == 4,
+        'キーは条件から決まる': overlay_cache_key(TEXT, font_path, 28, 'vertical')
+                                 == overlay_cache_key(TEXT, font_path, 28, 'vertical', Config.TEXT_BOX_PADDING),
+    })
+
+
+def check_position():
+    print("\n【配置】")
+    return report({
+        'drawtextと同じ位置': overlay_position(padding=15) == f"x=(W-w)/2:y={TEXT_TOP - 15}",
+    })
+
+
+def check_without_pillow(font_path):
+    print("\n【Pillowがない場合】")
+    available = disclaimer_overlay.PIL_AVAILABLE
+    disclaimer_overlay.PIL_AVAILABLE = False
+    try:
+        path = render_disclaimer_overlay(TEXT, font_path, 28, 'vertical')
+    finally:
+        disclaimer_overlay.PIL_AVAILABLE = available
+    return report({'Noneを返す': path is None})
+
+
+def main():
+    Config.DISCLAIMER_CACHE_DIR = tempfile.mkdtemp(prefix='disclaimer_overlay_test_')
+    font_path = Config.get_font_path()
+    results = [check_position(), check_without_pillow(font_path or 'font.ttf')]
+    if not disclaimer_overlay.PIL_AVAILABLE or not font_path:
+        print("\n⚠️ Pillowまたはフォントがないため描画のテストは省略します")
+    else:
+        print(f"\nフォント: {font_path}")
+        results += [check_render(font_path), check_cache(font_path)]
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Driveメタデータミラーのテストスクリプト
+疑似的なDrive API（files.list と Changes API）で、初回の全件同期、次の実行での差分同期（追加・名前変更・
+フォルダ間の移動・対象外への移動・ゴミ箱・完全削除）、共有ドライブ自体の変更を読み飛ばすこと、
+トークンが無効な場合と対象フォルダが変わった場合の全件の取り直し、同期済みのミラーにない動画は
+フォルダの一覧を取得せずに見つからないものとすることを確認
+"""
+
+import os
+import re
+import tempfile
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from automation.drive_mirror import DriveMirror
+from automation.drive_name_index import DriveNameIndex
+from automation.google_drive_finder import GoogleDriveFinder
+from script_checks import finish, report
+
+FOLDERS = ['NB', 'OM']
+
+
+class FakeRequest:
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def execute(self):
+        return self.func(*self.args)
+
+
+class FakeDrive:
+    """ファイルの状態と変更履歴を持つ疑似Drive API（変更トークンは履歴の位置）"""
+
+    def __init__(self, page_size=2):
+        self.page_size = page_size
+        self.files_by_id = {}
+        self.log = []
+        self.expired_tokens = set()
+        self.reset_calls()
+
+    def reset_calls(self):
+        self.calls = {'files.list': 0, 'changes.list': 0, 'getStartPageToken': 0}
+
+    # 操作（変更履歴に記録する）
+
+    def put(self, file_id, name, parent, trashed=False):
+        self.files_by_id[file_id] = {
+            'id': file_id, 'name': name, 'mimeType': 'video/mp4', 'parents': [parent],
+            'md5Checksum': f"md5_{file_id}_{len(self.log)}", 'size': '1024', 'trashed': trashed,
+        }
+        self.log.append(('file', file_id))
+
+    def delete(self, file_id):
+        del self.files_by_id[file_id]
+        self.log.append(('file', file_id))
+
+    def change_drive(self, drive_id):
+        """共有ドライブ自体の変更（名前・設定など）。fileId のない changeType: drive の変更になる"""
+        self.log.append(('drive', drive_id))
+
+    # Drive API
+
+    def files(self):
+        return self
+
+    def changes(self):
+        return self
+
+    def list(self, q=None, pageToken=None, **kwargs):
+        if q is not None:
+            return FakeRequest(self._list_files, re.match(r"'([^']+)' in parents", q).group(1), pageToken)
+        return FakeRequest(self._list_changes, pageToken)
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest(self._start_page_token)
+
+    def _start_page_token(self):
+        self.calls['getStartPageToken'] += 1
+        return {'startPageToken': str(len(self.log))}
+
+    def _list_files(self, folder_id, page_token):
+        self.calls['files.list'] += 1
+        files = [f for f in self.files_by_id.values() if folder_id in f['parents'] and not f['trashed']]
+        start = int(page_token or 0)
+        page = {'files': [dict(f) for f in files[start:start + self.page_size]]}
+        if start + self.page_size < len(files):
+            page['nextPageToken'] = str(start + self.page_size)
+        return page
+
+    def _list_changes(self, page_token):
+        self.calls['changes.list'] += 1
+        if page_token in self.expired_tokens:
+            raise HttpError(httplib2.Response({'status': 410}), b'{"error": {"message": "expired"}}')
+        start = int(page_token)
+        changes = []
+        for change_type, item_id in self.log[start:start + self.page_size]:
+            if change_type == 'drive':
+                changes.append({'changeType': 'drive', 'driveId': item_id, 'removed': False})
+                continue
+            file_info = self.files_by_id.get(item_id)
+            change = {'changeType': 'file', 'fileId': item_id, 'removed': file_info is None}
+            if file_info:
+                change['file'] = dict(file_info)
+            changes.append(change)
+        page = {'changes': changes}
+        if start + self.page_size < len(self.log):
+            page['nextPageToken'] = str(start + self.page_size)
+        else:
+            page['newStartPageToken'] = str(len(self.log))
+        return page
+
+
+def found(mirror, folder_id, video_name):
+    file_info = mirror.lookup(folder_id, video_name)
+    return file_info['id'] if file_info else None
+
+
+def initial_drive():
+    drive = FakeDrive()
+    drive.put('a', '老後は考えるな_撮影01.mp4', 'NB')
+    drive.put('b', '副業_撮影04.mp4', 'NB')
+    drive.put('c', '比較_撮影02.mp4', 'NB')
+    drive.put('d', 'イラスト_撮影06.mp4', 'OM')
+    drive.put('e', '体験談_撮影03.mp4', 'OM')
+    drive.put('x', '対象外_撮影09.mp4', 'OTHER')
+    return drive
+
+
+def check_full_sync(db_path):
+    print("\n【初回の全件同期】")
+    drive = initial_drive()
+    mirror = DriveMirror(drive, db_path, FOLDERS)
+    checks = {
+        '検索できる': found(mirror, 'NB', '老後は考えるな_撮影01') == 'a' and found(mirror, 'OM', '体験談_撮影03') == 'e',
+        '対象外のフォルダは含めない': found(mirror, 'OTHER', '対象外_撮影09') is None,
+        'フォルダごとに一覧を取得': drive.calls['files.list'] == 2 + 1 and drive.calls['changes.list'] == 0,
+        '件数': mirror.status()['files'] == {'NB': 3, 'OM': 2},
+    }
+    mirror.close()
+    return drive, report(checks)
+
+
+def check_incremental(db_path, drive):
+    print("\n【次の実行での差分同期】")
+    drive.put('f', '新作_撮影10.mp4', 'NB')                 # 追加
+    drive.put('a', '老後は考えるな_撮影01_修正版.mp4', 'NB')  # 名前変更
+    drive.put('b', '副業_撮影04.mp4', 'OM')                 # NB → OM に移動
+    drive.put('d', 'イラスト_撮影06.mp4', 'OTHER')          # 対象外のフォルダへ移動
+    drive.put('c', '比較_撮影02.mp4', 'NB', trashed=True)   # ゴミ箱
+    drive.delete('e')                                       # 完全削除
+    drive.put('x', '対象外_撮影09_v2.mp4', 'OTHER')         # 対象外のファイルの変更
+    drive.put('g', '二度目_撮影11.mp4', 'OM')
+    drive.put('g', '二度目_撮影11.mp4', 'NB')               # 同じ同期の中で2回変更
+
+    drive.reset_calls()
+    mirror = DriveMirror(drive, db_path, FOLDERS)
+    checks = {
+        '追加': found(mirror, 'NB', '新作_撮影10') == 'f',
+        '名前変更': found(mirror, 'NB', '老後は考えるな_撮影01_修正版') == 'a'
+                   and found(mirror, 'NB', '老後は考えるな_撮影01') is None,
+        'フォルダ間の移動': found(mirror, 'OM', '副業_撮影04') == 'b' and found(mirror, 'NB', '副業_撮影04') is None,
+        '対象外への移動': found(mirror, 'OM', 'イラスト_撮影06') is None,
+        'ゴミ箱': found(mirror, 'NB', '比較_撮影02') is None,
+        '完全削除': found(mirror, 'OM', '体験談_撮影03') is None,
+        '最後の変更を反映': found(mirror, 'NB', '二度目_撮影11') == 'g' and found(mirror, 'OM', '二度目_撮影11') is None,
+        '内容の変更を反映': mirror.lookup('NB', '新作_撮影10')['md5Checksum'] == drive.files_by_id['f']['md5Checksum'],
+        '一覧は取り直さない': drive.calls['files.list'] == 0 and drive.calls['changes.list'] == 5,
+        '件数': mirror.status()['files'] == {'NB': 3, 'OM': 1},
+    }
+    mirror.close()
+
+    drive.reset_calls()
+    mirror = DriveMirror(drive, db_path, FOLDERS)
+    mirror.ensure_synced()
+    checks['変更がなければ1回だけ'] = drive.calls == {'files.list': 0, 'changes.list': 1, 'getStartPageToken': 0}
+    mirror.close()
+    return report(checks)
+
+
+def check_shared_drive_change(db_path, drive):
+    print("\n【共有ドライブ自体の変更】")
+    drive.change_drive('shared_drive_1')
+    drive.put('i', '共有ドライブ後_撮影13.mp4', 'NB')
+    drive.reset_calls()
+    mirror = DriveMirror(drive, db_path, FOLDERS)
+    checks = {
+        '後続の変更も反映': found(mirror, 'NB', '共有ドライブ後_撮影13') == 'i',
+        '全件を取り直さない': mirror.synced and drive.calls['files.list'] == 0,
+    }
+    mirror.close()
+
+    # トークンが進んでいれば、次の実行では同じ変更を読まない
+    drive.reset_calls()
+    mirror = DriveMirror(drive, db_path, FOLDERS)
+    mirror.ensure_synced()
+    checks['トークンが進む'] = drive.calls == {'files.list': 0, 'changes.list': 1, 'getStartPageToken': 0}
+    mirror.close()
+    return report(checks)
+
+
+def check_expired_token(db_path, drive):
+    print("\n【変更トークンが無効】")
+    drive.put('h', '期限切れ後_撮影12.mp4', 'OM')
+    drive.expired_tokens.add(str(len(drive.log) - 1))
+    drive.reset_calls()
+    mirror = DriveMirror(drive, db_path, FOLDERS)
+    checks = {
+        '全件を取り直す': found(mirror, 'OM', '期限切れ後_撮影12') == 'h'
+                         and drive.calls['getStartPageToken'] == 1 and drive.calls['files.list'] > 0,
+        '既存のファイルも残る': found(mirror, 'NB', '新作_撮影10') == 'f',
+    }
+    mirror.close()
+    return report(checks)
+
+
+def check_folder_change(db_path, drive):
+    print("\n【対象フォルダの変更】")
+    drive.reset_calls()
+    mirror = DriveMirror(drive, db_path, FOLDERS + ['OTHER'])
+    checks = {
+        '追加したフォルダを検索できる': found(mirror, 'OTHER', '対象外_撮影09_v2') == 'x',
+        '差分ではなく全件を取り直す': drive.calls['changes.list'] == 0 and drive.calls['getStartPageToken'] == 1
+                                     and drive.calls['files.list'] >= 3,
+    }
+    mirror.close()
+    return report(checks)
+
+
+def make_finder(drive, mirror):
+    """認証・Driveへの接続を省いた検索（案件フォルダIDは疑似Driveのフォルダ名）"""
+    finder = GoogleDriveFinder.__new__(GoogleDriveFinder)
+    finder.PROJECT_FOLDERS = {project: project for project in FOLDERS}
+    finder.name_index = DriveNameIndex(drive, "id, name, mimeType")
+    finder.mirror = mirror
+    finder._mirror_near_miss = {}
+    finder.resolved = {}
+    return finder
+
+
+def check_finder_miss(db_path, drive):
+    print("\n【ミラーにない動画の検索】")
+    mirror = DriveMirror(drive, db_path, FOLDERS)
+    mirror.ensure_synced()
+    finder = make_finder(drive, mirror)
+    drive.reset_calls()
+    hit = finder.resolve_in_project_folder('NB', 'NB', '新作_撮影10')
+    typo = finder.resolve_in_project_folder('NB', 'NB', '新昨_撮影10')
+    many = finder.resolve_many(['YT_NB_新作_撮影10_MCC01_01_01', 'YT_OM_副業_撮影40_MCC01_01_01'])
+    checks = {
+        'ミラーで発見': (hit or {}).get('id') == 'f',
+        '見つからなければNone': typo is None,
+        'まとめて検索': [(info or {}).get('id') for info in many.values()] == ['f', None],
+        '一覧を取得しない': drive.calls['files.list'] == 0,
+        '近い名前はミラーから': 'NB' in finder._mirror_near_miss,
+    }
+
+    # ミラーが無効・サブフォルダも検索する場合は一覧から探す
+    drive.reset_calls()
+    finder = make_finder(drive, None)
+    checks['ミラーがなければ一覧から'] = (finder.resolve_in_project_folder('NB', 'NB', '新作_撮影10') or {}).get('id') \
+        == 'f' and drive.calls['files.list'] > 0
+    drive.reset_calls()
+    finder = make_finder(drive, mirror)
+    finder.name_index.recursive = True
+    finder.resolve_in_project_folder('NB', 'NB', '新昨_撮影10')
+    checks['サブフォルダの検索では一覧も引く'] = drive.calls['files.list'] > 0
+    mirror.close()
+    return report(checks)
+
+
+def main():
+    db_path = os.path.join(tempfile.mkdtemp(prefix='drive_mirror_test_'), 'mirror', 'drive_mirror.sqlite3')
+    drive, full_ok = check_full_sync(db_path)
+    results = [
+        full_ok,
+        check_incremental(db_path, drive),
+        check_shared_drive_change(db_path, drive),
+        check_expired_token(db_path, drive),
+        check_folder_change(db_path, drive),
+        check_finder_miss(db_path, drive),
+    ]
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Driveフォルダのファイル名インデックスのテストスクリプト
+疑似的なDrive APIで、ファイル名の正規化（NFD・スペース・拡張子）と検索、ページングとAPI呼び出し回数、
+バッチでの事前取得と失敗したフォルダの取り直し、サブフォルダの幅優先探索、広告グループ名の解析を確認
+"""
+
+import re
+import threading
+import unicodedata
+
+from automation.drive_name_index import FOLDER_MIME_TYPE, DriveNameIndex, name_key, normalize_name
+from automation.google_drive_finder import GoogleDriveFinder
+from script_checks import finish, report
+
+FIELDS = "id, name, mimeType"
+
+
+def video(file_id, name, mime_type='video/mp4'):
+    return {'id': file_id, 'name': name, 'mimeType': mime_type}
+
+
+def folder(file_id):
+    return {'id': file_id, 'name': file_id, 'mimeType': FOLDER_MIME_TYPE}
+
+
+class FakeRequest:
+    def __init__(self, drive, folder_id, page_token):
+        self.drive = drive
+        self.folder_id = folder_id
+        self.page_token = page_token
+
+    def execute(self):
+        return self.drive.list_page(self.folder_id, self.page_token)
+
+
+class FakeBatch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.drive.batches += 1
+        for request_id, request in self.requests:
+            if request.folder_id in self.drive.failing:
+                self.callback(request_id, None, RuntimeError(f"疑似的な失敗: {request.folder_id}"))
+            else:
+                self.callback(request_id, request.execute(), None)
+
+
+class FakeDrive:
+    """files().list（フォルダ指定・ページング）とバッチリクエストだけの疑似Drive API"""
+
+    def __init__(self, folders, page_size=2):
+        self.folders = folders
+        self.page_size = page_size
+        self.failing = set()
+        self.pages = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def files(self):
+        return self
+
+    def list(self, q, pageToken=None, **kwargs):
+        folder_id = re.match(r"'([^']+)' in parents", q).group(1)
+        return FakeRequest(self, folder_id, pageToken)
+
+    def list_page(self, folder_id, page_token):
+        with self._lock:
+            self.pages += 1
+        files = self.folders.get(folder_id, [])
+        start = int(page_token or 0)
+        page = {'files': files[start:start + self.page_size]}
+        if start + self.page_size < len(files):
+            page['nextPageToken'] = str(start + self.page_size)
+        return page
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+def check_normalize():
+    print("\n【ファイル名の正規化】")
+    nfd = unicodedata.normalize('NFD', 'ガイド_撮影01')
+    return report({
+        'NFDはNFCにそろえる': normalize_name(nfd) == 'ガイド_撮影01',
+        'スペースはアンダースコア': normalize_name(' 老後は考えるな 撮影01 ') == '老後は考えるな_撮影01',
+        '動画の拡張子は除く': name_key('老後は考えるな_撮影01.MP4') == '老後は考えるな_撮影01',
+        'それ以外の拡張子は残す': name_key('台本.txt') == '台本.txt',
+    })
+
+
+def check_lookup():
+    print("\n【検索とページング】")
+    drive = FakeDrive({'NB': [
+        video('mov', unicodedata.normalize('NFD', '老後は考えるな 撮影01.mov'), 'video/quicktime'),
+        video('pdf', '老後は考えるな_撮影01.pdf', 'application/pdf'),
+        video('mp4', '老後は考えるな_撮影01.mp4'),
+        video('octet', '副業_撮影04.MKV', 'application/octet-stream'),
+        video('other', '比較_撮影02.mp4'),
+    ]})
+    index = DriveNameIndex(drive, FIELDS)
+    found = index.lookup('NB', '老後は考えるな_撮影01')
+    pages = drive.pages
+    checks = {
+        '同名なら .mp4 を優先': found is not None and found['id'] == 'mp4',
+        '拡張子で動画と判定': (index.lookup('NB', '副業_撮影04') or {}).get('id') == 'octet',
+        '見つからなければNone': index.lookup('NB', '存在しない_撮影99') is None,
+        '全ページを取得': pages == 3 and index.api_calls == 3,
+        '2回目以降はAPIを呼ばない': drive.pages == pages,
+        '動画以外は含めない': '老後は考えるな_撮影01.pdf' not in index.video_names('NB'),
+    }
+    index.invalidate('NB')
+    index.lookup('NB', '比較_撮影02')
+    checks['破棄したら取り直す'] = drive.pages == pages + 3
+    return report(checks)
+
+
+def check_prefetch():
+    print("\n【バッチでの事前取得】")
+    drive = FakeDrive({
+        'NB': [video(f"nb{i}", f"NB動画_{i:02d}.mp4") for i in range(5)],
+        'OM': [video(f"om{i}", f"OM動画_{i:02d}.mp4") for i in range(3)],
+        'SBC': [video('sbc0', 'SBC動画_00.mp4')],
+    })
+    drive.failing.add('SBC')
+    index = DriveNameIndex(drive, FIELDS)
+    index.prefetch(['NB', 'OM', 'SBC'])
+    batches = drive.batches
+    pages = drive.pages
+    checks = {
+        '同じページ目を1バッチで取得': batches == 3,
+        '成功したフォルダはAPIを呼ばずに検索': (index.lookup('NB', 'NB動画_04') or {}).get('id') == 'nb4'
+                                                 and index.lookup('OM', 'OM動画_02') is not None
+                                                 and drive.pages == pages,
+    }
+    drive.failing.clear()
+    checks['失敗したフォルダは個別に取り直す'] = (index.lookup('SBC', 'SBC動画_00') or {}).get('id') == 'sbc0' \
+        and drive.pages == pages + 1
+    return report(checks)
+
+
+def check_recursive():
+    print("\n【サブフォルダの探索】")
+    drive = FakeDrive({
+        'NB': [folder('2024'), video('top', '共通_撮影01.mp4'), folder('archive')],
+        '2024': [folder('01'), video('mid', '中間_撮影02.mp4')],
+        '01': [video('deep', '深い_撮影03.mp4'), video('dup', '共通_撮影01.mp4'), folder('NB')],
+        'archive': [],
+    })
+    index = DriveNameIndex(drive, FIELDS, recursive=True, workers=4, service_factory=lambda: drive)
+    return report({
+        '深い階層の動画': (index.lookup('NB', '深い_撮影03') or {}).get('id') == 'deep',
+        '同名なら浅い階層を優先': (index.lookup('NB', '共通_撮影01') or {}).get('id') == 'top',
+        # 各フォルダを1回ずつ（3件のNB・01は2ページ、2024・archiveは1ページ）
+        '循環しても1回ずつ': drive.pages == 6,
+        'フォルダ構成': index.tree.get('NB') == ['2024', 'archive'] and index.tree.get('2024') == ['01'],
+    })
+
+
+def check_parse_ad_group_name():
+    print("\n【広告グループ名の解析】")
+    finder = GoogleDriveFinder.__new__(GoogleDriveFinder)
+    cases = {
+        'YT_OM_売れっ子イラストレーター_撮影06_お家で趣味のイラストをお仕事にする_MCC02運用46_03_01':
+            ('OM', '売れっ子イラストレーター_撮影06_お家で趣味のイラストをお仕事にする', True),
+        'YT_NB_老後は考えるな_撮影01_老後のことひとりで考えていませんか？_AIツール素材をフリー素材に_01_01':
+            ('NB', '老後は考えるな_撮影01_老後のことひとりで考えていませんか？_AIツール素材をフリー素材に', False),
+        'YT_SBC_比較_撮影02_MCC01_01_01': ('SBC', '比較_撮影02', True),
+    }
+    checks = {}
+    for ad_group_name, expected in cases.items():
+        parsed = finder.parse_ad_group_name(ad_group_name)
+        checks[expected[1][:16]] = (parsed['project'], parsed['video_name'], parsed['has_mcc']) == expected
+    return report(checks)
+
+
+def main():
+    results = [
+        check_normalize(),
+        check_lookup(),
+        check_prefetch(),
+        check_recursive(),
+        check_parse_ad_group_name(),
+    ]
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+ffmpeg実行管理のテストスクリプト
+-progress を出力する疑似的なffmpeg（Pythonスクリプト）を監視付きで実行し、進捗の解析、異常終了・ストール・
+タイムアウト時の終了とstderr末尾の取得、大量のstderrで止まらないこと、最大RSSの取得を確認
+"""
+
+import os
+import stat
+import sys
+import tempfile
+import time
+
+from ffmpeg_runner import FFmpegError, parse_progress_block, run_ffmpeg, run_probe
+from script_checks import finish, report
+
+# 最後の引数で動作を切り替える疑似ffmpeg
+FAKE_FFMPEG = '''#!{python}
+import sys, time
+mode = sys.argv[-1]
+
+def progress(frame, state='continue'):
+    print(f"frame={{frame}}\\nfps=30.0\\nout_time_us={{frame * 33333}}\\nspeed=1.5x\\nprogress={{state}}", flush=True)
+
+if mode == 'ok':
+    buffer = bytearray(64 * 1024 * 1024)
+    for page in range(0, len(buffer), 4096):
+        buffer[page] = 1
+    for frame in range(0, 90, 30):
+        progress(frame)
+        time.sleep(0.1)
+    progress(90, 'end')
+elif mode == 'noisy':
+    # パイプの容量を大きく超えるstderr
+    for line in range(20000):
+        sys.stderr.write(f"warning line {{line}}\\n")
+    progress(30, 'end')
+elif mode == 'fail':
+    sys.stderr.write("Invalid data found when processing input\\n")
+    sys.exit(1)
+elif mode == 'stall':
+    progress(10)
+    time.sleep(60)
+elif mode == 'slow':
+    for frame in range(600):
+        progress(frame)
+        time.sleep(0.1)
+elif mode == 'hang':
+    time.sleep(60)
+'''
+
+
+def make_fake_ffmpeg(work_dir):
+    path = os.path.join(work_dir, 'ffmpeg')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(FAKE_FFMPEG.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def run_case(name, func):
+    print(f"\n【{name}】")
+    start = time.monotonic()
+    ok = report(func())
+    print(f"  （{time.monotonic() - start:.1f}秒）")
+    return ok
+
+
+def expect_error(func):
+    try:
+        func()
+    except FFmpegError as e:
+        return e
+    return None
+
+
+def main():
+    ffmpeg = make_fake_ffmpeg(tempfile.mkdtemp(prefix='ffmpeg_runner_test_'))
+
+    def progress_case():
+        events = []
+        result = run_ffmpeg([ffmpeg, 'ok'], duration=3.0, on_progress=events.append)
+        return {
+            '進捗イベント': [event['frame'] for event in events] == [0, 30, 60, 90],
+            '最後の状態': (result['frame'], result['fps'], result['speed']) == (90, 30.0, 1.5),
+            '出力時刻（秒）': abs(result['out_time'] - 90 * 0.033333) < 1e-6,
+            '最大RSS': result['max_rss_mb'] is None or result['max_rss_mb'] >= 64,
+        }
+
+    def noisy_case():
+        result = run_ffmpeg([ffmpeg, 'noisy'], timeout=20)
+        return {
+            '止まらずに終了': result['returncode'] == 0,
+            'stderrは末尾だけ保持': result['stderr_tail'].splitlines()[-1] == 'warning line 19999',
+        }
+
+    def fail_case():
+        error = expect_error(lambda: run_ffmpeg([ffmpeg, 'fail']))
+        return {
+            '例外': error is not None,
+            '終了コード': error is not None and error.returncode == 1,
+            'stderr末尾を含む': error is not None and 'Invalid data' in str(error),
+        }
+
+    def stall_case():
+        start = time.monotonic()
+        error = expect_error(lambda: run_ffmpeg([ffmpeg, 'stall'], stall_timeout=1.5))
+        return {
+            'ストールで終了': error is not None and 'ストール' in str(error),
+            'すぐに終了': time.monotonic() - start < 10,
+        }
+
+    def timeout_case():
+        start = time.monotonic()
+        # 進捗は続いていても全体の制限時間で終了させる
+        error = expect_error(lambda: run_ffmpeg([ffmpeg, 'slow'], timeout=2, stall_timeout=30))
+        return {
+            '制限時間で終了': error is not None and '制限時間' in str(error),
+            'すぐに終了': time.monotonic() - start < 10,
+        }
+
+    def probe_case():
+        error = expect_error(lambda: run_probe([ffmpeg, 'hang'], timeout=1))
+        return {'制限時間で終了': error is not None and '制限時間' in str(error)}
+
+    def parse_case():
+        return {
+            'out_time_ms もマイクロ秒': parse_progress_block({'out_time_ms': '2500000'})['out_time'] == 2.5,
+            'HH:MM:SS': parse_progress_block({'out_time': '00:01:02.500000'})['out_time'] == 62.5,
+            '負の値は0': parse_progress_block({'out_time_us': '-1000'})['out_time'] == 0.0,
+            'N/A': parse_progress_block({'out_time': 'N/A', 'speed': 'N/A', 'frame': ''}) ==
+                   {'frame': None, 'fps': None, 'speed': None, 'out_time': None, 'progress': None},
+        }
+
+    results = [
+        run_case('進捗ブロックの解析', parse_case),
+        run_case('正常終了と進捗', progress_case),
+        run_case('大量のstderr', noisy_case),
+        run_case('異常終了', fail_case),
+        run_case('ストール', stall_case),
+        run_case('タイムアウト', timeout_case),
+        run_case('ffprobeのタイムアウト', probe_case),
+    ]
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
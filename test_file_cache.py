@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+ファイルキャッシュのテストスクリプト
+容量上限を超えたら最終利用時刻が古いものから削除されること、登録した直後のものは削除されないこと、
+上限より大きいファイルは登録せず、元動画キャッシュではダウンロードしたファイルをそのまま使うことを確認
+"""
+
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from automation.source_cache import SourceCache
+from file_cache import FileCache
+from script_checks import finish, report
+
+KB = 1024
+
+
+def write_file(directory, name, size):
+    path = Path(directory) / name
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def check_lru_eviction(work_dir):
+    print("\n【容量上限での削除（古く使われたものから）】")
+    cache = FileCache(os.path.join(work_dir, 'lru'), max_bytes=3 * KB, suffix='.bin')
+    for index, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, write_file(work_dir, f"{key}.src", KB))
+        # 更新時刻の分解能に左右されないよう、利用時刻をずらしておく
+        past = time.time() - 100 + index
+        os.utime(cache.path_for(key), (past, past))
+
+    cache.get('a')  # a を最近使ったものにする
+    cache.put('d', write_file(work_dir, 'd.src', KB))
+    return report({
+        '最も古い b を削除': cache.get('b') is None,
+        '最近使った a は残る': cache.get('a') is not None,
+        'c・d は残る': cache.get('c') is not None and cache.get('d') is not None,
+        '付随情報も削除': not (Path(cache.root) / 'b.meta.json').exists(),
+        '合計が上限以下': cache.total_bytes() <= 3 * KB,
+    })
+
+
+def check_keep_just_put(work_dir):
+    print("\n【登録で上限を超えた場合】")
+    cache = FileCache(os.path.join(work_dir, 'keep'), max_bytes=3 * KB, suffix='.bin')
+    cache.put('old', write_file(work_dir, 'old.src', 2 * KB))
+    path = cache.put('new', write_file(work_dir, 'new.src', 2 * KB))
+    return report({
+        '返したパスが存在': path is not None and path.is_file(),
+        '古いものを削除': cache.get('old') is None,
+    })
+
+
+def check_oversize(work_dir):
+    print("\n【上限より大きいファイル】")
+    cache = FileCache(os.path.join(work_dir, 'oversize'), max_bytes=2 * KB, suffix='.bin')
+    cache.put('small', write_file(work_dir, 'small.src', KB))
+    source = write_file(work_dir, 'large.src', 4 * KB)
+    path = cache.put('large', source, move=True)
+    return report({
+        '登録しない': path is None and cache.get('large') is None,
+        '元ファイルは残る': os.path.exists(source),
+        '既存のものは消さない': cache.get('small') is not None,
+    })
+
+
+def check_source_cache_fallback(work_dir):
+    print("\n【元動画キャッシュ: 上限より大きい元動画】")
+    cache = SourceCache(root=os.path.join(work_dir, 'source_cache'), max_bytes=2 * KB)
+    file_info = {'id': 'drive_file_1', 'name': 'large.mp4', 'md5Checksum': 'd41d8cd98f00b204e9800998ecf8427e'}
+    downloads = []
+
+    def download(info, output_path):
+        downloads.append(output_path)
+        Path(output_path).write_bytes(b'v' * 4 * KB)
+        return output_path
+
+    output_path = Path(work_dir) / 'job' / 'large.mp4'
+    output_path.parent.mkdir()
+    try:
+        result = cache.fetch(file_info, output_path, download)
+    except OSError as e:
+        print(f"  （{e}）")
+        result = None
+    return report({
+        'ダウンロードしたファイルを使う': result == output_path and output_path.stat().st_size == 4 * KB,
+        'キャッシュには残らない': not cache.contains(file_info),
+        '途中ファイルも残らない': not list(cache.root.glob(f"{SourceCache.PARTIAL_PREFIX}*")),
+        'ダウンロードは1回': len(downloads) == 1,
+    })
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='file_cache_test_')
+    results = [
+        check_lru_eviction(work_dir),
+        check_keep_just_put(work_dir),
+        check_oversize(work_dir),
+        check_source_cache_fallback(work_dir),
+    ]
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
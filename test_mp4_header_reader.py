@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+MP4ヘッダーリーダーのテストスクリプト
+アトムを組み立てた疑似的なMP4（tkhd等のversion 0/1・回転行列・moovの位置違い）を解析し、
+解像度・長さ・回転・フレームレート・コーデックが正しく読めること、解析できない形式はNoneになることを確認
+"""
+
+import os
+import struct
+import tempfile
+
+from mp4_header_reader import parse_mp4_header, read_mp4_header, scan_mp4_prefix
+from script_checks import finish, report
+
+FIXED_ONE = 0x00010000
+# 回転角（時計回り） → tkhdの行列の a, b, c, d（16.16固定小数点）
+ROTATION_MATRICES = {
+    0: (FIXED_ONE, 0, 0, FIXED_ONE),
+    90: (0, FIXED_ONE, -FIXED_ONE, 0),
+    180: (-FIXED_ONE, 0, 0, -FIXED_ONE),
+    270: (0, -FIXED_ONE, FIXED_ONE, 0),
+}
+
+
+def box(box_type: bytes, *payloads: bytes) -> bytes:
+    payload = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def large_box(box_type: bytes, payload: bytes) -> bytes:
+    """64bitサイズ表記のアトム"""
+    return struct.pack('>I4sQ', 1, box_type, 16 + len(payload)) + payload
+
+
+def full_header(version: int) -> bytes:
+    return struct.pack('>B3s', version, b'\0\0\0')
+
+
+def mvhd(timescale: int, duration: int, version: int = 0) -> bytes:
+    if version == 1:
+        times = struct.pack('>QQIQ', 0, 0, timescale, duration)
+    else:
+        times = struct.pack('>IIII', 0, 0, timescale, duration)
+    return box(b'mvhd', full_header(version), times, b'\0' * 80)
+
+
+def tkhd(width: int, height: int, rotation: int = 0, version: int = 0) -> bytes:
+    if version == 1:
+        times = struct.pack('>QQIIQ', 0, 0, 1, 0, 0)
+    else:
+        times = struct.pack('>IIIII', 0, 0, 1, 0, 0)
+    a, b, c, d = ROTATION_MATRICES[rotation]
+    matrix = struct.pack('>9i', a, b, 0, c, d, 0, 0, 0, 0x40000000)
+    return box(b'tkhd', full_header(version), times, b'\0' * 16, matrix,
+               struct.pack('>II', width << 16, height << 16))
+
+
+def mdhd(timescale: int, duration: int, version: int = 0) -> bytes:
+    if version == 1:
+        times = struct.pack('>QQIQ', 0, 0, timescale, duration)
+    else:
+        times = struct.pack('>IIII', 0, 0, timescale, duration)
+    return box(b'mdhd', full_header(version), times, b'\0' * 4)
+
+
+def trak(handler: bytes, codec: bytes, timescale: int, duration: int, samples: int,
+         width: int = 0, height: int = 0, rotation: int = 0, version: int = 0) -> bytes:
+    stsd = box(b'stsd', full_header(0), struct.pack('>I', 1), box(codec, b'\0' * 8))
+    stts = box(b'stts', full_header(0), struct.pack('>I', 1), struct.pack('>II', samples, duration // samples))
+    return box(
+        b'trak',
+        tkhd(width, height, rotation, version),
+        box(b'mdia',
+            mdhd(timescale, duration, version),
+            box(b'hdlr', full_header(0), b'\0' * 4, handler, b'\0' * 12),
+            box(b'minf', box(b'stbl', stsd, stts)))
+    )
+
+
+def movie(width=1920, height=1080, rotation=0, version=0, seconds=10, fps=30,
+          moov_first=True, fragmented=False, with_audio=True) -> bytes:
+    tracks = [trak(b'vide', b'avc1', fps * 1000, seconds * fps * 1000, seconds * fps,
+                   width, height, rotation, version)]
+    if with_audio:
+        tracks.append(trak(b'soun', b'mp4a', 48000, seconds * 48000, seconds * 48000 // 1024, version=version))
+    children = [mvhd(1000, 0 if fragmented else seconds * 1000, version), *tracks]
+    if fragmented:
+        children.append(box(b'mvex', box(b'trex', b'\0' * 24)))
+    moov = box(b'moov', *children)
+    ftyp = box(b'ftyp', b'isom', b'\0\0\x02\0', b'isomiso2avc1mp41')
+    mdat = large_box(b'mdat', b'\0' * 4096) if version == 1 else box(b'mdat', b'\0' * 4096)
+    return ftyp + (moov + mdat if moov_first else mdat + moov)
+
+
+def run_case(name, data, expected):
+    print(f"\n【{name}】")
+    info = parse_mp4_header(data)
+    if expected is None:
+        ok = info is None
+        print(f"  解析できない形式: {'✅' if ok else '❌'} ({info})")
+        return ok
+    checks = {}
+    for key, value in expected.items():
+        actual = info.get(key) if info else None
+        checks[f"{key}={value}"] = (abs(actual - value) < 1e-6 if isinstance(value, float) and actual is not None
+                                    else actual == value)
+    return report(checks)
+
+
+def main():
+    results = [
+        run_case('tkhd version 0（横長・回転なし）', movie(),
+                 {'width': 1920, 'height': 1080, 'duration': 10.0, 'rotation': 0, 'fps': 30.0,
+                  'video_codec': 'avc1', 'audio_codec': 'mp4a'}),
+        run_case('tkhd version 1（縦長・64bit時刻・moovが後ろ）',
+                 movie(1080, 1920, version=1, seconds=15, fps=60, moov_first=False),
+                 {'width': 1080, 'height': 1920, 'duration': 15.0, 'rotation': 0, 'fps': 60.0}),
+        run_case('回転 90度', movie(rotation=90), {'width': 1920, 'height': 1080, 'rotation': 90}),
+        run_case('回転 180度（version 1）', movie(rotation=180, version=1), {'rotation': 180}),
+        run_case('回転 270度', movie(rotation=270), {'rotation': 270}),
+        run_case('音声なし', movie(with_audio=False), {'duration': 10.0, 'audio_codec': None}),
+        run_case('フラグメント化MP4（moovに長さなし）', movie(fragmented=True), None),
+        run_case('MP4以外', b'RIFF\0\0\0\0AVI LIST' + b'\0' * 64, None),
+    ]
+
+    print("\n【先頭からの判定（ダウンロード途中）】")
+    data = movie()
+    moov_end = data.index(b'mdat') - 4
+    checks = {
+        'moovが先頭': scan_mp4_prefix(data[:moov_end])[0] == 'moov',
+        'moovの途中まで': scan_mp4_prefix(data[:moov_end - 10]) == ('incomplete', None),
+        'mdatが先頭': scan_mp4_prefix(movie(moov_first=False)) == ('mdat', None),
+        'MP4以外': scan_mp4_prefix(b'\0' * 4 + b'JUNK' + b'\0' * 32) == ('unsupported', None),
+    }
+    results.append(report(checks))
+
+    print("\n【ファイルから読み取り】")
+    work_dir = tempfile.mkdtemp(prefix='mp4_header_test_')
+    paths = {name: os.path.join(work_dir, f"{name}.mp4") for name in ('valid', 'truncated', 'empty')}
+    with open(paths['valid'], 'wb') as f:
+        f.write(movie(1080, 1920, rotation=90))
+    with open(paths['truncated'], 'wb') as f:
+        f.write(movie(moov_first=False)[:-40])
+    open(paths['empty'], 'wb').close()
+    info = read_mp4_header(paths['valid'])
+    checks = {
+        '解像度と回転': bool(info) and (info['width'], info['height'], info['rotation']) == (1080, 1920, 90),
+        '途中で切れたファイルはNone': read_mp4_header(paths['truncated']) is None,
+        '空ファイルはNone': read_mp4_header(paths['empty']) is None,
+    }
+    results.append(report(checks))
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+合成中アップロードのテストスクリプト
+ローカルのレジューマブルアップロード疑似サーバーに対して、書き込み中のファイルを送り、
+合成の終了前からチャンクが届くこと・届いた内容がファイルと一致することを確認
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from googleapiclient.http import HttpRequest, build_http
+
+from progressive_upload import CHUNK_ALIGNMENT, ProgressiveUploadError, upload_while_encoding
+
+CHUNK_SIZE = CHUNK_ALIGNMENT
+
+
+class FakeResumableServer(BaseHTTPRequestHandler):
+    """YouTubeのレジューマブルアップロードの最小限の疑似サーバー"""
+
+    # テストごとにリセットする受信状態
+    received = bytearray()
+    total_size = None
+    chunk_times = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        # アップロードセッションの開始
+        length = int(self.headers.get('content-length', 0))
+        self.rfile.read(length)
+        self.send_response(200)
+        self.send_header('Location', f"http://{self.headers['host']}/upload/session1")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        length = int(self.headers.get('content-length', 0))
+        data = self.rfile.read(length)
+        content_range = self.headers.get('content-range', '')
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+        if not match:
+            self.send_error(400, f"不正なContent-Range: {content_range}")
+            return
+        start, end, total = match.groups()
+        cls = FakeResumableServer
+        if int(start) != len(cls.received) or int(end) - int(start) + 1 != len(data):
+            self.send_error(400, f"範囲が連続していません: {content_range}")
+            return
+        cls.received += data
+        cls.chunk_times.append(time.time())
+
+        if total != '*' and int(end) + 1 == int(total):
+            cls.total_size = int(total)
+            body = json.dumps({'id': 'fake_video_id'}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        # 途中のチャンク: 受信済みの範囲を返す
+        self.send_response(308)
+        self.send_header('Range', f"bytes=0-{len(cls.received) - 1}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeResumableServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset_server():
+    FakeResumableServer.received = bytearray()
+    FakeResumableServer.total_size = None
+    FakeResumableServer.chunk_times = []
+
+
+def make_request_factory(server):
+    """youtube.videos().insert(...) の代わりに疑似サーバーへのリクエストを作る"""
+    uri = f"http://127.0.0.1:{server.server_address[1]}/upload/youtube/v3/videos?uploadType=resumable"
+
+    def create_request(media):
+        # build_http は308をリダイレクトとして扱わない（レジューマブルアップロードの途中応答）
+        return HttpRequest(
+            build_http(),
+            lambda resp, content: json.loads(content),
+            uri,
+            method='POST',
+            body='{}',
+            headers={'content-type': 'application/json'},
+            resumable=media
+        )
+    return create_request
+
+
+def fake_encoder(path, total_bytes, step=64 * 1024, interval=0.05, fail_at=None):
+    """ffmpegの代わりに、少しずつ追記していく書き込み処理"""
+    def encode():
+        written = 0
+        with open(path, 'wb') as f:
+            while written < total_bytes:
+                if fail_at is not None and written >= fail_at:
+                    raise RuntimeError("疑似エンコードの失敗")
+                size = min(step, total_bytes - written)
+                f.write(os.urandom(size))
+                f.flush()
+                written += size
+                time.sleep(interval)
+        return {'output_path': path, 'finished_at': time.time()}
+    return encode
+
+
+def run_case(server, name, total_bytes, fail_at=None):
+    print(f"\n【{name}】 {total_bytes}バイト")
+    reset_server()
+    work_dir = tempfile.mkdtemp(prefix='progressive_upload_test_')
+    output_path = os.path.join(work_dir, 'output.mp4')
+
+    try:
+        result, response = upload_while_encoding(
+            make_request_factory(server),
+            output_path,
+            fake_encoder(output_path, total_bytes, fail_at=fail_at),
+            chunksize=CHUNK_SIZE
+        )
+    except ProgressiveUploadError as e:
+        if fail_at is None:
+            print(f"  ❌ 予期しないエラー: {e}")
+            return False
+        aborted = FakeResumableServer.total_size is None
+        print(f"  合成失敗でアップロード中止: {'✅' if aborted else '❌ 確定されている'} ({e})")
+        return aborted
+
+    with open(output_path, 'rb') as f:
+        expected = f.read()
+    received = bytes(FakeResumableServer.received)
+    chunks = len(FakeResumableServer.chunk_times)
+    before_finish = sum(1 for t in FakeResumableServer.chunk_times if t < result['finished_at'])
+
+    checks = {
+        'レスポンス': response.get('id') == 'fake_video_id',
+        '総サイズ': FakeResumableServer.total_size == len(expected),
+        '内容一致': received == expected,
+        '合成中に送信': before_finish > 0,
+    }
+    print(f"  チャンク数: {chunks}（合成終了前 {before_finish}）")
+    for label, ok in checks.items():
+        print(f"  {label}: {'✅' if ok else '❌'}")
+    return all(checks.values())
+
+
+def main():
+    server = start_server()
+    try:
+        results = [
+            run_case(server, '端数のあるサイズ', CHUNK_SIZE * 6 + 12345),
+            # 最後のチャンクがちょうどチャンクサイズになる場合も総サイズ付きで確定できること
+            run_case(server, 'チャンクサイズの倍数', CHUNK_SIZE * 6),
+            run_case(server, '合成失敗', CHUNK_SIZE * 6, fail_at=CHUNK_SIZE * 2),
+        ]
+    finally:
+        server.shutdown()
+
+    print(f"\n=== {'すべて成功' if all(results) else '失敗あり'} ===")
+    return all(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
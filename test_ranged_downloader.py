@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+並列レンジダウンロードのテストスクリプト
+Rangeリクエストに応答するローカルのHTTPサーバーから取得し、途中で失敗したダウンロードがサイドカーに
+記録した区間を飛ばして残りだけを取得すること、別のファイルのサイドカーは使わないこと、区間の途中で
+切れた場合は受信済みの位置から取り直すこと、MD5が一致しない場合はファイルと進捗を削除することを確認
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+from automation import ranged_downloader
+from automation.ranged_downloader import RangedDownloader
+from automation.source_cache import ChecksumMismatchError
+from script_checks import finish, report
+
+PART_SIZE = 64 * 1024
+DATA = os.urandom(PART_SIZE * 6 - 1000)  # 最後の区間は短い
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Rangeの範囲だけを返す（server.failing の開始位置は500、server.cut_once の開始位置は半分で切る）"""
+
+    def do_GET(self):
+        server = self.server
+        start, end = (int(value) for value in re.match(r"bytes=(\d+)-(\d+)", self.headers['Range']).groups())
+        with server.lock:
+            server.ranges.append((start, end))
+            failing = start in server.failing
+            cut = start in server.cut_once
+            server.cut_once.discard(start)
+        if failing:
+            self.send_error(500)
+            return
+        if cut:
+            end = start + (end - start) // 2
+        body = DATA[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Range', f"bytes {start}-{end}/{len(DATA)}")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.lock = threading.Lock()
+    server.ranges = []
+    server.failing = set()
+    server.cut_once = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ranged_downloader.DRIVE_MEDIA_URL = f"http://127.0.0.1:{server.server_address[1]}/{{file_id}}"
+    return server
+
+
+def make_downloader(retries=0):
+    downloader = RangedDownloader(None, workers=3, part_size=PART_SIZE, retries=retries)
+    # 認証なしのセッションでローカルのサーバーに接続する
+    downloader._session = requests.Session
+    return downloader
+
+
+def file_info(file_id='video', md5=None):
+    return {'id': file_id, 'size': str(len(DATA)), 'md5Checksum': md5 or hashlib.md5(DATA).hexdigest()}
+
+
+def check_resume(server, work_dir):
+    print("\n【中断したダウンロードの再開】")
+    output_path = Path(work_dir, 'resume.mp4')
+    sidecar = RangedDownloader.sidecar_path(output_path)
+    failing_start = PART_SIZE * 2
+    server.failing.add(failing_start)
+    try:
+        make_downloader().download(file_info(), output_path)
+        interrupted = False
+    except Exception as e:
+        print(f"  （{e}）")
+        interrupted = True
+    server.failing.clear()
+    with open(sidecar, encoding='utf-8') as f:
+        saved = json.load(f)
+
+    server.ranges.clear()
+    downloader = make_downloader()
+    downloader.download(file_info(), output_path)
+    return report({
+        '1回目は失敗': interrupted,
+        '完了した区間をサイドカーに記録': saved['completed'] == [0, 1, 3, 4, 5],
+        '残りの区間だけを取得': server.ranges == [(failing_start, failing_start + PART_SIZE - 1)],
+        '内容が一致': output_path.read_bytes() == DATA,
+        '再開したバイト数': downloader.last_stats['resumed_bytes'] == len(DATA) - PART_SIZE,
+        '完了後はサイドカーを削除': not sidecar.exists(),
+    })
+
+
+def check_other_sidecar(server, work_dir):
+    print("\n【別のファイルのサイドカー】")
+    output_path = Path(work_dir, 'other.mp4')
+    output_path.write_bytes(b'\0' * len(DATA))
+    # 同じ出力先に以前あった別のファイル（md5Checksumが違う）の進捗
+    make_downloader()._save_progress(file_info(md5='0' * 32), output_path, len(DATA), {0, 1, 2})
+    server.ranges.clear()
+    make_downloader().download(file_info(), output_path)
+    return report({
+        '最初から取得': len(server.ranges) == 6,
+        '内容が一致': output_path.read_bytes() == DATA,
+    })
+
+
+def check_cut(server, work_dir):
+    print("\n【区間の途中で切断】")
+    output_path = Path(work_dir, 'cut.mp4')
+    server.cut_once.add(PART_SIZE)
+    server.ranges.clear()
+    downloader = make_downloader(retries=1)
+    downloader.download(file_info(), output_path)
+    half = PART_SIZE + (PART_SIZE - 1) // 2 + 1
+    return report({
+        '受信済みの位置から再試行': (half, PART_SIZE * 2 - 1) in server.ranges,
+        '再試行の回数': downloader.last_stats['retries'] == 1,
+        '内容が一致': output_path.read_bytes() == DATA,
+    })
+
+
+def check_mismatch(server, work_dir):
+    print("\n【MD5の不一致】")
+    output_path = Path(work_dir, 'mismatch.mp4')
+    try:
+        make_downloader().download(file_info(md5='0' * 32), output_path)
+        error = None
+    except ChecksumMismatchError as e:
+        print(f"  （{e}）")
+        error = e
+    return report({
+        '例外': error is not None,
+        'ファイルを削除': not output_path.exists(),
+        'サイドカーも削除（次回は最初から）': not RangedDownloader.sidecar_path(output_path).exists(),
+    })
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='ranged_downloader_test_')
+    server = start_server()
+    try:
+        results = [
+            check_resume(server, work_dir),
+            check_other_sidecar(server, work_dir),
+            check_cut(server, work_dir),
+            check_mismatch(server, work_dir),
+        ]
+    finally:
+        server.shutdown()
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+レンダーキャッシュの再試行のテストスクリプト
+Drive・合成・アップロード・キューを疑似的なものに置き換えて process_ad_in_workspace を実行し、
+キュー追加に失敗した広告は次回の実行で合成済みの動画を再利用すること、
+成功した広告の合成結果は残らず、同じ元動画が再び不承認になった場合は合成し直すことを確認
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+import production_disapproval_handler as handler
+from config import Config
+from render_cache import RenderCache
+from script_checks import finish, report
+from workspace import Workspace
+
+SOURCE = {'id': 'drive_file_1', 'name': '老後は考えるな_撮影01.mp4', 'md5Checksum': 'd41d8cd98f00b204e9800998ecf8427e'}
+AD = {'ad_group_name': 'YT_NB_老後は考えるな_撮影01_MCC02運用46_01_01', 'account_id': '1234567890'}
+
+
+class FakeFinder:
+    """GoogleDriveFinderの代わり（ダウンロードは小さなファイルを書くだけ）"""
+
+    def resolve_video_by_ad_group(self, ad_group_name):
+        return SOURCE
+
+    def parse_ad_group_name(self, ad_group_name):
+        return {'project': 'NB', 'video_name': '老後は考えるな_撮影01', 'has_mcc': True}
+
+    def has_cached_source(self, source):
+        return False
+
+    def download(self, source, name, dest_dir):
+        path = Path(dest_dir) / f"{name}.mp4"
+        path.write_bytes(b'source video')
+        return path
+
+
+class Recorder:
+    """合成・アップロード・キュー追加の呼び出しを記録し、キュー追加の失敗を指定できる"""
+
+    def __init__(self):
+        self.merges = 0
+        self.uploads = []
+        self.queue_fail = False
+
+    def merge_with_background(self, video_path, project_name, job, stream=None):
+        self.merges += 1
+        output_path = handler.new_output_path(project_name, job)
+        # 背景は毎回ランダムに生成されるため、合成ごとに内容が変わる
+        Path(output_path).write_bytes(f"merged {self.merges}".encode())
+        return output_path, output_path
+
+    def upload_video(self, youtube, upload_path, title):
+        self.uploads.append(Path(upload_path).read_bytes())
+        return f"https://www.youtube.com/watch?v=fake{len(self.uploads)}"
+
+    def queue_manager(self):
+        recorder = self
+
+        class FakeQueueManager:
+            def add_to_queue(self, **kwargs):
+                if recorder.queue_fail:
+                    raise RuntimeError("疑似的なキュー追加の失敗")
+                return 'process_1'
+        return FakeQueueManager()
+
+
+def run_ad(workspace, finder):
+    """1件の処理（例外は失敗として扱う）"""
+    with workspace.allocate(AD['ad_group_name']) as job:
+        try:
+            return handler.process_ad_in_workspace(AD, job, finder)
+        except RuntimeError as e:
+            print(f"  （{e}）")
+            return False
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='render_cache_retry_test_')
+    Config.RENDER_CACHE_DIR = os.path.join(work_dir, 'render_cache')
+    Config.UPLOAD_WHILE_ENCODING = False
+    Config.STREAM_DRIVE_DOWNLOAD = False
+    workspace = Workspace(root=os.path.join(work_dir, 'workspace'), retention_hours=0)
+
+    recorder = Recorder()
+    handler.merge_with_background = recorder.merge_with_background
+    handler.upload_video = recorder.upload_video
+    handler.get_youtube_service = lambda project_name: object()
+    handler.SimpleQueueManager = recorder.queue_manager
+    finder = FakeFinder()
+
+    def cached_entries():
+        return len(RenderCache()._entries())
+
+    results = []
+
+    print("\n【キュー追加の失敗 → 再試行】")
+    recorder.queue_fail = True
+    first = run_ad(workspace, finder)
+    kept = cached_entries()
+    recorder.queue_fail = False
+    retried = run_ad(workspace, finder)
+    checks = {
+        '1回目は失敗': first is False,
+        '失敗後はキャッシュに残る': kept == 1,
+        '再試行は成功': retried is True,
+        '再試行では合成しない': recorder.merges == 1,
+        '同じ動画をアップロード': recorder.uploads == [b'merged 1', b'merged 1'],
+        '成功後はキャッシュから削除': cached_entries() == 0,
+    }
+    results.append(report(checks))
+
+    print("\n【成功後に同じ元動画が再び不承認】")
+    again = run_ad(workspace, finder)
+    checks = {
+        '成功': again is True,
+        '合成し直す': recorder.merges == 2,
+        '新しい動画をアップロード': recorder.uploads[-1] == b'merged 2',
+        'キャッシュに残らない': cached_entries() == 0,
+    }
+    results.append(report(checks))
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
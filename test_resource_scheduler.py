@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+同時実行ジョブの資源管理のテストスクリプト
+推定式とスレッド割り当て、キャリブレーション結果の読み込み、同時実行数・メモリ・空き容量が足りない間は
+開始を待たせ、解放されたら開始すること、実行中のジョブがなければ推定が空きを超えても開始することを確認
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from resource_scheduler import (DEFAULT_CALIBRATION, ResourceScheduler, estimate_job, free_disk_mb,
+                                load_calibration, thread_budget)
+from script_checks import finish, report
+
+SMALL_JOB = {'memory_mb': 1.0, 'disk_mb': 1.0, 'threads': 1}
+
+
+def check_estimate():
+    print("\n【推定とスレッド割り当て】")
+    calibration = dict(DEFAULT_CALIBRATION, base_memory_mb=100.0, memory_mb_per_megapixel=200.0,
+                       memory_mb_per_megapixel_thread=50.0, output_mb_per_megapixel_second=0.5)
+    single = estimate_job(1000, 1000, 10, 1, calibration)
+    quad = estimate_job(1000, 1000, 10, 4, calibration)
+    return report({
+        'メモリ（1スレッド）': single['memory_mb'] == 300.0,
+        'メモリ（4スレッド）': quad['memory_mb'] == 450.0,
+        '作業容量': single['disk_mb'] == 0.5 * 10 * 2.0,
+        'コアを分け合う': thread_budget(3, cores=8) == 2,
+        '最低1スレッド': thread_budget(16, cores=4) == 1,
+    })
+
+
+def check_load_calibration(work_dir):
+    print("\n【キャリブレーション結果の読み込み】")
+    saved = os.path.join(work_dir, 'calibration.json')
+    with open(saved, 'w', encoding='utf-8') as f:
+        json.dump({'base_memory_mb': 42.0, 'unknown': 1, 'measured': {}}, f)
+    broken = os.path.join(work_dir, 'broken.json')
+    with open(broken, 'w', encoding='utf-8') as f:
+        f.write('{')
+    loaded = load_calibration(saved)
+    return report({
+        '保存した項目を使う': loaded['base_memory_mb'] == 42.0,
+        '未計測の項目は既定値': loaded['memory_mb_per_megapixel'] == DEFAULT_CALIBRATION['memory_mb_per_megapixel'],
+        '不明な項目は無視': 'unknown' not in loaded,
+        'ファイルがなければ既定値': load_calibration(os.path.join(work_dir, 'missing.json')) == DEFAULT_CALIBRATION,
+        '壊れていれば既定値': load_calibration(broken) == DEFAULT_CALIBRATION,
+    })
+
+
+def check_max_jobs(work_dir):
+    print("\n【同時実行数】")
+    scheduler = ResourceScheduler(work_dir, max_jobs=1, calibration=DEFAULT_CALIBRATION)
+    first = scheduler.acquire(SMALL_JOB)
+    started = threading.Event()
+
+    def second_job():
+        with scheduler.admit(SMALL_JOB):
+            started.set()
+
+    thread = threading.Thread(target=second_job, daemon=True)
+    thread.start()
+    waited = not started.wait(0.5)
+    scheduler.release(first)
+    thread.join(10)
+    return report({
+        'コア数以内': ResourceScheduler(work_dir, max_jobs=10_000).max_jobs == scheduler.cores,
+        '上限に達したら待つ': waited,
+        '解放されたら開始': started.is_set(),
+        '終了後は空く': not scheduler._running,
+    })
+
+
+def headroom_scheduler(work_dir):
+    """同時実行数では止まらないスケジューラ（コア数が少ない環境でも資源の判定だけを確かめる）"""
+    scheduler = ResourceScheduler(work_dir, calibration=DEFAULT_CALIBRATION)
+    scheduler.max_jobs = 4
+    return scheduler
+
+
+def check_disk_headroom(work_dir):
+    print("\n【空き容量】")
+    scheduler = headroom_scheduler(work_dir)
+    huge = {'memory_mb': 1.0, 'disk_mb': free_disk_mb(work_dir) * 2, 'threads': 1}
+    small = scheduler.acquire(SMALL_JOB, timeout=1)
+
+    start = time.monotonic()
+    try:
+        scheduler.acquire(huge, timeout=1)
+        timed_out = False
+    except TimeoutError as e:
+        print(f"  （{e}）")
+        timed_out = True
+    scheduler.release(small)
+    # 実行中のジョブがなければ、空きを超える推定でも待ち続けずに開始する
+    alone = scheduler.acquire(huge, timeout=1)
+    scheduler.release(alone)
+    return report({
+        '他のジョブがあれば待つ': timed_out and time.monotonic() - start >= 1,
+        '単独なら開始': alone is not None,
+    })
+
+
+def check_memory_headroom(work_dir):
+    print("\n【メモリ】")
+    scheduler = headroom_scheduler(work_dir)
+    running = scheduler.acquire(SMALL_JOB)
+    huge = {'memory_mb': 1e12, 'disk_mb': 1.0, 'threads': 1}
+    reason = scheduler._blocked_by(huge)
+    scheduler.release(running)
+    # /proc/meminfo がない環境ではメモリでは止めない
+    return report({'メモリ不足で待つ': reason is None or 'メモリ不足' in reason})
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='resource_scheduler_test_')
+    results = [
+        check_estimate(),
+        check_load_calibration(work_dir),
+        check_max_jobs(work_dir),
+        check_disk_headroom(work_dir),
+        check_memory_headroom(work_dir),
+    ]
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+作業フォルダのテストスクリプト
+終了したジョブが保持期間を過ぎたら削除されること、容量上限を超えたら最後に使ったのが古いものから削除されること、
+実行中のジョブと、整理中に他のプロセスが削除したジョブで失敗しないことを確認
+"""
+
+import os
+import tempfile
+import time
+
+from script_checks import finish, report
+from workspace import Workspace
+
+KB = 1024
+
+
+def unlimited(root):
+    """準備用（ジョブの作成・終了時の整理で削除しない）"""
+    return Workspace(root=root, max_bytes=0, scratch_root='', retention_hours=0)
+
+
+def finished_job(root, name, size, age_hours=0.0):
+    """終了済みのジョブを作成（age_hours 時間前に最後に使ったことにする）"""
+    job = unlimited(root).allocate(name)
+    (job.stage_dir('render') / 'output.mp4').write_bytes(b'x' * size)
+    job.release(keep=True)
+    past = time.time() - age_hours * 3600
+    os.utime(job.path, (past, past))
+    return job.path
+
+
+def check_retention(work_dir):
+    print("\n【保持期間】")
+    root = os.path.join(work_dir, 'retention')
+    old = finished_job(root, 'old', KB, age_hours=48)
+    recent = finished_job(root, 'recent', KB, age_hours=1)
+    workspace = Workspace(root=root, max_bytes=0, scratch_root='', retention_hours=24)
+    removed = workspace.enforce_quota()
+    return report({
+        '期限切れを削除': removed == [old] and not old.exists(),
+        '期限内は残る': recent.exists(),
+    })
+
+
+def check_quota(work_dir):
+    print("\n【容量上限（最後に使ったのが古いものから）】")
+    root = os.path.join(work_dir, 'quota')
+    oldest = finished_job(root, 'oldest', 2 * KB, age_hours=3)
+    middle = finished_job(root, 'middle', 2 * KB, age_hours=2)
+    running = unlimited(root).allocate('running')
+    (running.stage_dir('source') / 'source.mp4').write_bytes(b'x' * 2 * KB)
+    past = time.time() - 5 * 3600
+    os.utime(running.path, (past, past))
+
+    workspace = Workspace(root=root, max_bytes=5 * KB, scratch_root='', retention_hours=0)
+    removed = workspace.enforce_quota()
+    checks = {
+        '最も古いものを削除': removed == [oldest],
+        '上限内に収まれば残す': middle.exists(),
+        '実行中のジョブは残す': running.path.exists(),
+    }
+    return report(checks)
+
+
+class VanishingWorkspace(Workspace):
+    """一覧を取った後に他のプロセスが削除したジョブを含める"""
+
+    def _jobs(self):
+        return super()._jobs() + [self.root / 'removed_by_other_process']
+
+
+def check_vanished_job(work_dir):
+    print("\n【整理中に削除されたジョブ】")
+    root = os.path.join(work_dir, 'vanished')
+    old = finished_job(root, 'old', 2 * KB, age_hours=48)
+    workspace = VanishingWorkspace(root=root, max_bytes=KB, scratch_root='', retention_hours=24)
+    try:
+        removed = workspace.enforce_quota()
+    except FileNotFoundError as e:
+        print(f"  （{e}）")
+        removed = None
+    return report({
+        '失敗しない': removed is not None,
+        '残りのジョブは整理する': removed == [old],
+    })
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='workspace_test_')
+    results = [
+        check_retention(work_dir),
+        check_quota(work_dir),
+        check_vanished_job(work_dir),
+    ]
+    return finish(results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
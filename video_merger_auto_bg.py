@@ -1,67 +1,181 @@
 #!/usr/bin/env python3
-import subprocess
-import sys
 import os
 import json
+import shutil
+import tempfile
 import time
 import requests
 import logging
-from typing import Dict, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional, Union
 from background_prompts import BackgroundPromptGenerator
 from config import Config
+from mp4_header_reader import read_mp4_header
+from encode_profiles import load_profile, video_encoder_args
+from ffmpeg_runner import run_ffmpeg, run_probe
+from merge_planner import MergePlanner
+from resource_scheduler import available_cores, thread_args, thread_budget
+from rate_control import parse_kbps, plan_rate_control, resolve_targets, sample_windows
+from disclaimer_overlay import TEXT_TOP, render_disclaimer_overlay, overlay_position
 
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 断片化MP4（moovを先頭に置き、キーフレームごとのフラグメントを追記するだけで後から書き戻さない）
+FRAGMENTED_MP4_ARGS = ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+
 class VideoMergerWithAutoBG:
     """動画サイズ自動検出＆背景自動生成機能付き動画合成ツール"""
     
-    def __init__(self, replicate_api_token=None):
+    def __init__(self, replicate_api_token=None, work_dir=None, scratch_dir=None):
+        """
+        Args:
+            work_dir: 生成した背景動画の保存先（Noneの場合はカレントディレクトリ）
+            scratch_dir: 中間ファイル（セグメント・試しエンコード）の作業場所（Noneの場合は一時フォルダ）
+        """
         self.replicate_api_token = replicate_api_token or os.environ.get('REPLICATE_API_TOKEN')
+        self.work_dir = work_dir
+        self.scratch_dir = scratch_dir
+        # 免責事項をPNG化して合成する（Falseでdrawtext）
+        self.use_rasterized_disclaimer = True
         
     def get_video_info(self, video_path: str) -> Dict:
-        """動画の情報（解像度、長さ、アスペクト比）を取得"""
+        """動画の情報（解像度、長さ、アスペクト比、回転）を取得"""
+        # MP4/MOVはヘッダーを直接読む（ffprobe起動を省略）
+        info = read_mp4_header(video_path)
+        if info is None:
+            logger.info(f"ヘッダー解析不可のためffprobeを使用: {video_path}")
+            info = self._probe_with_ffprobe(video_path)
+        return self.normalize_video_info(info)
+    
+    def normalize_video_info(self, info: Dict) -> Dict:
+        """ヘッダーリーダー / ffprobeの結果に表示上のサイズ・向きを加える"""
+        width, height = info['width'], info['height']
+        # ffmpegは入力を自動回転するため、表示上のサイズで判定する
+        if info.get('rotation', 0) in (90, 270):
+            width, height = height, width
+        
+        # 縦横判定
+        orientation = 'vertical' if height > width else 'horizontal'
+        aspect_ratio = f"{width}:{height}"
+        
+        return {
+            'width': width,
+            'height': height,
+            'duration': info['duration'],
+            'rotation': info.get('rotation', 0),
+            'fps': info.get('fps'),
+            'video_codec': info.get('video_codec'),
+            'audio_codec': info.get('audio_codec'),
+            'orientation': orientation,
+            'aspect_ratio': aspect_ratio
+        }
+    
+    def _probe_with_ffprobe(self, video_path: str) -> Dict:
+        """ffprobeで動画情報を取得（ヘッダーリーダーのフォールバック）"""
         cmd = [
             'ffprobe',
             '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height:format=duration',
+            '-show_entries',
+            'stream=codec_type,codec_name,width,height,r_frame_rate:stream_tags=rotate:'
+            'stream_side_data=rotation:format=duration',
             '-of', 'json',
             video_path
         ]
         
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            data = json.loads(result.stdout)
+            data = json.loads(run_probe(cmd))
+            stream = next(s for s in data['streams'] if s.get('codec_type') == 'video')
+            audio_stream = next((s for s in data['streams'] if s.get('codec_type') == 'audio'), None)
             
-            width = data['streams'][0]['width']
-            height = data['streams'][0]['height']
-            duration = float(data['format']['duration'])
+            # 回転: 旧形式のrotateタグ（時計回り）またはディスプレイマトリクス（反時計回り）
+            rotation = int(stream.get('tags', {}).get('rotate', 0))
+            for side_data in stream.get('side_data_list', []):
+                if 'rotation' in side_data:
+                    rotation = -int(side_data['rotation'])
             
-            # 縦横判定
-            orientation = 'vertical' if height > width else 'horizontal'
-            aspect_ratio = f"{width}:{height}"
+            fps = None
+            num, _, den = stream.get('r_frame_rate', '').partition('/')
+            if num and den and float(den) > 0:
+                fps = float(num) / float(den)
             
             return {
-                'width': width,
-                'height': height,
-                'duration': duration,
-                'orientation': orientation,
-                'aspect_ratio': aspect_ratio
+                'width': stream['width'],
+                'height': stream['height'],
+                'duration': float(data['format']['duration']),
+                'rotation': rotation % 360,
+                'fps': fps,
+                'video_codec': stream.get('codec_name'),
+                'audio_codec': audio_stream.get('codec_name') if audio_stream else None
             }
         except Exception as e:
-            print(f"Error getting video info: {e}")
-            sys.exit(1)
+            raise RuntimeError(f"動画情報の取得に失敗しました: {video_path}: {e}") from e
     
-    def determine_output_size(self, main_video_info: Dict) -> Tuple[int, int, str]:
-        """メイン動画の向きから出力サイズを決定"""
-        if main_video_info['orientation'] == 'vertical':
-            # 縦動画 → 1080x1920
-            return 1080, 1920, 'vertical'
+    def determine_output_size(self, main_video_info: Dict,
+                              canvas: Optional[str] = None) -> Tuple[int, int, str]:
+        """
+        メイン動画の向きと解像度から出力サイズを決定
+        
+        短辺は Config.OUTPUT_CANVAS_LADDER から元動画の短辺以上で最小のものを選ぶ
+        （720pの素材を1080pに拡大してエンコード・アップロードしない）
+        
+        Args:
+            canvas: 'vertical' / 'horizontal' / 'square' で出力の向きを指定（省略時は動画の向き）
+        """
+        orientation = canvas or main_video_info['orientation']
+        
+        ladder = sorted(Config.OUTPUT_CANVAS_LADDER)
+        width, height = main_video_info.get('width'), main_video_info.get('height')
+        source_short_side = min(width, height) if width and height else ladder[-1]
+        short_side = next((size for size in ladder if size >= source_short_side), ladder[-1])
+        # 16:9の長辺（偶数に丸める）
+        long_side = int(round(short_side * 16 / 9 / 2)) * 2
+        
+        if orientation == 'square':
+            # 正方形 → 1080x1080等（デマンドジェネ用）
+            return short_side, short_side, 'square'
+        if orientation == 'vertical':
+            # 縦動画 → 1080x1920等
+            return short_side, long_side, 'vertical'
         else:
-            # 横動画 → 1920x1080
-            return 1920, 1080, 'horizontal'
+            # 横動画 → 1920x1080等
+            return long_side, short_side, 'horizontal'
+    
+    def create_placeholder_background(self, orientation: str) -> str:
+        """
+        ドラフト用の仮の背景（単色の短い動画）を作成
+        生成背景と同じ480pサイズにし、背景のスケール処理も本番と同じ経路を通す
+        """
+        width, height = (480, 852) if orientation == 'vertical' else (852, 480)
+        output_path = os.path.join(tempfile.gettempdir(), f"draft_background_{width}x{height}.mp4")
+        if os.path.exists(output_path):
+            return output_path
+        
+        tmp_path = f"{output_path}.{os.getpid()}.tmp.mp4"
+        run_ffmpeg([
+            'ffmpeg', '-v', 'error',
+            '-f', 'lavfi', '-i', f"color=c={Config.DRAFT_BACKGROUND_COLOR}:s={width}x{height}:r=24:d=5",
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            '-y', tmp_path
+        ], duration=5, label='仮背景')
+        os.replace(tmp_path, output_path)
+        return output_path
+    
+    def determine_draft_size(self, width: int, height: int) -> Tuple[int, int]:
+        """ドラフト用に、出力サイズを短辺 Config.DRAFT_SHORT_SIDE まで縮小（縦横比は維持、偶数に丸める）"""
+        ratio = Config.DRAFT_SHORT_SIDE / min(width, height)
+        if ratio >= 1:
+            return width, height
+        return int(round(width * ratio / 2)) * 2, int(round(height * ratio / 2)) * 2
+    
+    def determine_output_fps(self, main_video_info: Dict) -> Optional[float]:
+        """出力フレームレートの上限を適用する場合はその値、元のままならNone"""
+        cap = Config.MAX_OUTPUT_FPS
+        source_fps = main_video_info.get('fps')
+        if cap and source_fps and source_fps > cap + 0.01:
+            return cap
+        return None
     
     def generate_background_with_replicate(self, 
                                          orientation: str, 
@@ -147,7 +261,7 @@ class VideoMergerWithAutoBG:
                             
                         # ダウンロード
                         video_response = requests.get(video_url)
-                        bg_path = f"temp_bg_{prediction_id}.mp4"
+                        bg_path = os.path.join(self.work_dir or '', f"temp_bg_{prediction_id}.mp4")
                         with open(bg_path, 'wb') as f:
                             f.write(video_response.content)
                         return bg_path
@@ -171,159 +285,574 @@ class VideoMergerWithAutoBG:
             return None
     
     
-    def merge_videos(self, main_video: str, background_video: str, 
-                    output_video: str, main_scale: float = 0.8,
-                    disclaimer_text: Optional[str] = None):
-        """動画を合成"""
+    def _build_filter_complex(self, output_width: int, output_height: int, orientation: str,
+                              main_scale: float, disclaimer_text: Optional[str],
+                              first_overlay_input: int, bg_input: str = "[0:v]",
+                              main_input: str = "[1:v]",
+                              label_suffix: str = "",
+                              planner: Optional[MergePlanner] = None,
+                              output_fps: Optional[float] = None) -> Tuple[List[str], str, List[str]]:
+        """
+        合成用のfilter_complexを構築
         
-        # メイン動画の情報取得
-        main_info = self.get_video_info(main_video)
-        output_width, output_height, orientation = self.determine_output_size(main_info)
+        Args:
+            bg_input / main_input: 背景・メイン映像の入力ラベル（split後のラベルも指定可）
+            label_suffix: 複数出力時に中間ラベルを区別するための接尾辞
+            planner: 不要なスケール/クロップを省略する判定（省略時は常に全段を通す）
+            output_fps: 出力フレームレートの上限（Noneなら元のまま）
         
-        print(f"検出された動画タイプ: {orientation}")
-        print(f"出力サイズ: {output_width}x{output_height}")
-        
-        # フォントパス（環境に応じて調整）
-        font_path = os.environ.get('FONT_PATH', '/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc')
-        # macOSで日本語フォントが見つからない場合の代替
-        if not os.path.exists(font_path):
-            # 代替フォントを試す
-            alternative_fonts = [
-                '/System/Library/Fonts/Hiragino Sans GB.ttc',
-                '/System/Library/Fonts/PingFang.ttc',
-                '/System/Library/Fonts/Helvetica.ttc',
-                '/Library/Fonts/Arial Unicode.ttf'
-            ]
-            for alt_font in alternative_fonts:
-                if os.path.exists(alt_font):
-                    font_path = alt_font
-                    logger.info(f"Using alternative font: {alt_font}")
-                    break
-        
-        # フィルター構築
+        Returns:
+            (フィルター部品のリスト, 最終出力ラベル, 追加入力ファイル（オーバーレイ画像）のリスト)
+        """
         filter_parts = []
+        overlay_inputs = []
         
         # 背景動画を出力サイズにスケール
         # Replicateは既に正しいアスペクト比で生成するので回転は不要
-        filter_parts.append(
-            f"[0:v]scale={output_width}:{output_height}:"
-            f"force_original_aspect_ratio=increase,"
-            f"crop={output_width}:{output_height}[bg]"
-        )
+        if planner:
+            bg_filter = planner.background_filter(output_width, output_height)
+        else:
+            bg_filter = (f"scale={output_width}:{output_height}:force_original_aspect_ratio=increase,"
+                         f"crop={output_width}:{output_height}")
+        bg_label = bg_input
+        if bg_filter:
+            bg_label = f"[bg{label_suffix}]"
+            filter_parts.append(f"{bg_input}{bg_filter}{bg_label}")
         
         # メイン動画をスケール（出力サイズに対する割合）
-        # 横動画の場合は1920、縦動画の場合は1080を基準に
-        if orientation == 'horizontal':
-            # 横動画: 1920x1080に対する割合
-            target_width = int(1920 * main_scale)
-            target_height = int(1080 * main_scale)
-        else:
-            # 縦動画: 1080x1920に対する割合
-            target_width = int(1080 * main_scale)
-            target_height = int(1920 * main_scale)
+        target_width = int(output_width * main_scale)
+        target_height = int(output_height * main_scale)
         
         logger.info(f"Main video scale: {main_scale} ({main_scale*100}%)")
         logger.info(f"Target size: {target_width}x{target_height}")
         
-        filter_parts.append(
-            f"[1:v]scale={target_width}:{target_height}:"
-            f"force_original_aspect_ratio=decrease[scaled]"
-        )
+        if planner:
+            main_filter = planner.main_filter(target_width, target_height)
+        else:
+            main_filter = f"scale={target_width}:{target_height}:force_original_aspect_ratio=decrease"
+        main_label = main_input
+        if main_filter:
+            main_label = f"[scaled{label_suffix}]"
+            filter_parts.append(f"{main_input}{main_filter}{main_label}")
         
         # 合成
-        filter_parts.append("[bg][scaled]overlay=(W-w)/2:(H-h)/2[composite]")
+        filter_parts.append(
+            f"{bg_label}{main_label}overlay=(W-w)/2:(H-h)/2[composite{label_suffix}]"
+        )
         
         # 注意書き追加（オプション）
-        if disclaimer_text:
-            font_size = 32 if orientation == 'horizontal' else 28
-            
-            # 日本語フォントを確実に見つける
-            font_file = Config.get_font_path()
-            
-            if not font_file:
-                logger.error("No Japanese font found!")
-                logger.info("Please install fonts-noto-cjk package on Linux")
-                logger.info("Using fallback English text instead")
-            
-            if font_file:
-                # フォントファイルを使用（エスケープ処理を追加）
-                escaped_text = disclaimer_text.replace("'", "'\\''")
-                escaped_font = font_file.replace("'", "'\\''")
-                filter_parts.append(
-                    f"[composite]drawtext="
-                    f"fontfile='{escaped_font}':"
-                    f"text='{escaped_text}':"
-                    f"fontsize={font_size}:"
-                    f"fontcolor=white:"
-                    f"x=(w-text_w)/2:"
-                    f"y=20:"
-                    f"box=1:"
-                    f"boxcolor=gray@0.7:"
-                    f"boxborderw=15[v]"
-                )
-            else:
-                # フォントファイルがない場合はエラー
-                error_msg = "CRITICAL: Japanese font not found! Cannot add disclaimer text."
-                logger.error(error_msg)
-                logger.error("Please install fonts-noto-cjk package: sudo apt-get install fonts-noto-cjk")
-                raise RuntimeError(error_msg)
-            
-            final_output = "[v]"
+        if not disclaimer_text:
+            final_output = self._cap_frame_rate(filter_parts, f"[composite{label_suffix}]",
+                                                output_fps, label_suffix)
+            return filter_parts, final_output, overlay_inputs
+        
+        font_size = Config.HORIZONTAL_FONT_SIZE if orientation == 'horizontal' else Config.VERTICAL_FONT_SIZE
+        # 文字サイズ・余白・位置は1080pキャンバス基準なので、キャンバスの短辺に合わせて拡縮
+        layout_scale = min(output_width, output_height) / 1080
+        font_size = int(round(font_size * layout_scale))
+        padding = int(round(Config.TEXT_BOX_PADDING * layout_scale))
+        text_top = int(round(TEXT_TOP * layout_scale))
+        
+        # 日本語フォントを確実に見つける（プロセス内でキャッシュ済み）
+        font_file = Config.get_font_path()
+        
+        if not font_file:
+            # フォントファイルがない場合はエラー
+            error_msg = "CRITICAL: Japanese font not found! Cannot add disclaimer text."
+            logger.error(error_msg)
+            logger.error("Please install fonts-noto-cjk package: sudo apt-get install fonts-noto-cjk")
+            raise RuntimeError(error_msg)
+        
+        # 文字と位置は動画内で変わらないため、一度だけ画像化して静止オーバーレイで合成
+        overlay_path = None
+        if self.use_rasterized_disclaimer:
+            overlay_path = render_disclaimer_overlay(disclaimer_text, font_file, font_size, orientation,
+                                                     padding)
+        
+        if overlay_path:
+            overlay_inputs.append(overlay_path)
+            filter_parts.append(
+                f"[composite{label_suffix}][{first_overlay_input}:v]"
+                f"overlay={overlay_position(padding, text_top)}[v{label_suffix}]"
+            )
         else:
-            final_output = "[composite]"
+            # Pillowが使えない場合はdrawtextで描画（エスケープ処理を追加）
+            escaped_text = disclaimer_text.replace("'", "'\\''")
+            escaped_font = font_file.replace("'", "'\\''")
+            filter_parts.append(
+                f"[composite{label_suffix}]drawtext="
+                f"fontfile='{escaped_font}':"
+                f"text='{escaped_text}':"
+                f"fontsize={font_size}:"
+                f"fontcolor=white:"
+                f"x=(w-text_w)/2:"
+                f"y={text_top}:"
+                f"box=1:"
+                f"boxcolor=gray@0.7:"
+                f"boxborderw={padding}[v{label_suffix}]"
+            )
+        
+        final_output = self._cap_frame_rate(filter_parts, f"[v{label_suffix}]", output_fps, label_suffix)
+        return filter_parts, final_output, overlay_inputs
+    
+    def _cap_frame_rate(self, filter_parts: List[str], final_output: str, output_fps: Optional[float],
+                        label_suffix: str) -> str:
+        """フレームレート上限があれば最終出力にfpsフィルターを追加し、最終出力ラベルを返す"""
+        if not output_fps:
+            return final_output
+        filter_parts.append(f"{final_output}fps={output_fps:g}[out{label_suffix}]")
+        return f"[out{label_suffix}]"
+    
+    def merge_videos(self, main_video: str, background_video: str, 
+                    output_video: Union[str, List[Dict]], main_scale: float = 0.8,
+                    disclaimer_text: Optional[str] = None,
+                    parallel: Optional[bool] = None,
+                    rate_control: Optional[Dict] = None,
+                    threads: Optional[int] = None,
+                    draft: bool = False,
+                    draft_seconds: Optional[float] = None,
+                    main_info: Optional[Dict] = None,
+                    fragmented: bool = False,
+                    stall_timeout: Optional[float] = None):
+        """
+        動画を合成
+        
+        Args:
+            output_video: 出力ファイル、または出力指定のリスト
+                [{'output_path': ..., 'canvas': 'square', 'main_scale': 0.7, 'disclaimer_text': None}, ...]
+                canvas / main_scale / disclaimer_text を省略した項目は引数の値を使う
+            parallel: セグメント並列エンコードを使うか（Noneの場合は動画の長さで自動判定）。単一出力のみ対応
+            rate_control: {'max_size_mb': 上限MB, 'max_kbps': 上限kbps}（Noneの場合はConfigの既定値、
+                どちらも0なら無効）。単一出力のみ対応
+            threads: この合成に割り当てるスレッド数（同時実行時の配分。Noneの場合は全コア）
+            draft: 確認用の低解像度・ultrafastのプロキシを作る（レイアウトと免責事項は本番と同じ比率）。単一出力のみ対応
+            draft_seconds: プロキシの長さの上限（秒）。Noneの場合は全体
+            main_info: メイン動画の情報（get_video_infoと同じ形式）。パイプ入力などファイルを
+                読めない場合に指定する。その場合はメイン動画を先頭から1回だけ読む構成にすること
+                （parallel=False, rate_control={}）
+            fragmented: 断片化MP4で出力する（moovを先頭に置き以降は追記のみになるため、
+                書き込み中のファイルを先頭から読める）。単一出力のみ対応
+            stall_timeout: ffmpegの進捗が止まってから終了させるまでの秒数（Noneの場合は Config.FFMPEG_STALL_TIMEOUT）。
+                ダウンロード中のパイプ入力では、ダウンロードが止まっている間も進捗が止まる
+        
+        Returns:
+            結果の辞書。output_videoがリストの場合は出力ごとの結果辞書のリスト
+        
+        Raises:
+            ValueError: 出力指定のリストに、単一出力のみ対応の指定（draft / fragmented / parallel / rate_control）を
+                組み合わせた場合（無視するとサイズ上限を超えたファイル等が黙って作られるため）
+        """
+        multi_output = isinstance(output_video, (list, tuple))
+        if multi_output:
+            self._check_multi_output_options(draft, fragmented, parallel, rate_control)
+        
+        # メイン動画の情報取得
+        main_info = main_info or self.get_video_info(main_video)
+        
+        # 省略できる変換を判定（背景のサイズが出力と一致すればスケール不要 等）
+        planner = MergePlanner(main_info, self.get_video_info(background_video))
+        
+        if multi_output:
+            return self._merge_multi_output(
+                main_video, background_video, output_video, main_info, main_scale, disclaimer_text,
+                planner, threads
+            )
+        
+        output_width, output_height, orientation = self.determine_output_size(main_info)
+        output_fps = self.determine_output_fps(main_info)
+        render_duration = main_info['duration']
+        if draft:
+            output_width, output_height = self.determine_draft_size(output_width, output_height)
+            if (main_info.get('fps') or 0) > Config.DRAFT_MAX_FPS + 0.01:
+                output_fps = min(output_fps or Config.DRAFT_MAX_FPS, Config.DRAFT_MAX_FPS)
+            if draft_seconds:
+                render_duration = min(render_duration, draft_seconds)
+        
+        print(f"検出された動画タイプ: {orientation}")
+        print(f"出力サイズ: {output_width}x{output_height}" + (" (ドラフト)" if draft else ""))
+        
+        # フィルター構築
+        filter_parts, final_output, overlay_inputs = self._build_filter_complex(
+            output_width, output_height, orientation, main_scale, disclaimer_text,
+            first_overlay_input=2, planner=planner,
+            output_fps=output_fps
+        )
         
         filter_complex = ";".join(filter_parts)
         
         # デバッグ用：フィルターをログ出力
         logger.info(f"Filter complex: {filter_complex}")
         
+        # エンコード設定（encode_tuner.pyで作成したプロファイル、未作成なら既定値）
+        profile = load_profile(orientation, main_info['duration'])
+        if draft:
+            profile = dict(profile, preset=Config.DRAFT_PRESET, crf=Config.DRAFT_CRF, tune=None,
+                           maxrate_kbps=None)
+        logger.info(f"Encode profile: {profile}")
+        audio_args = planner.audio_args(profile, output_video)
+        planner.log_summary()
+        
+        # 出力サイズ・ビットレートの目標があれば、試しエンコードでCRF/maxrateを決める（ドラフトでは不要）
+        rate_targets = None if draft else resolve_targets(rate_control)
+        rate_plan = None
+        if rate_targets:
+            rate_plan = self._plan_rate_control(
+                main_video, background_video, main_info, planner.background_info['duration'],
+                filter_complex, final_output, overlay_inputs, profile, rate_targets, threads
+            )
+            profile = dict(profile, crf=rate_plan['crf'], maxrate_kbps=rate_plan['maxrate_kbps'])
+        
+        result = {
+            'output_path': output_video,
+            'output_size': f"{output_width}x{output_height}",
+            'orientation': orientation,
+            'duration': render_duration,
+            'segments': 1,
+            'draft': draft,
+            'fragmented': fragmented
+        }
+        
+        if parallel is None:
+            parallel = main_info['duration'] >= Config.PARALLEL_MERGE_MIN_DURATION
+        
+        if parallel and not draft:
+            segments = self._plan_segments(main_video, main_info['duration'])
+            if len(segments) > 1:
+                self._merge_segments_parallel(
+                    main_video, background_video, output_video, main_info,
+                    filter_complex, final_output, overlay_inputs, segments, profile, audio_args,
+                    threads, fragmented
+                )
+                result['segments'] = len(segments)
+                return self._report_size(result, rate_plan)
+            logger.info("分割できるキーフレームがないため通常モードで合成します")
+        
         # FFmpegコマンド実行
         cmd = [
             'ffmpeg',
+            *thread_args(threads),
             '-stream_loop', '-1',
             '-i', background_video,
             '-i', main_video,
+        ]
+        for overlay_path in overlay_inputs:
+            cmd += ['-i', overlay_path]
+        cmd += [
             '-filter_complex', filter_complex,
             '-map', final_output,
             '-map', '1:a?',
-            '-t', str(main_info['duration']),
-            '-c:v', 'libx264',
-            '-preset', 'faster',  # 高速化のためfasterに変更
-            '-c:a', 'aac',
-            '-b:a', '192k',
+            '-t', str(render_duration),
+            *video_encoder_args(profile, threads=threads),
+            *audio_args,
+            *(FRAGMENTED_MP4_ARGS if fragmented else []),
             '-y',
             output_video
         ]
         
-        print("動画を合成中...")
-        subprocess.run(cmd, check=True)
+        print("動画を合成中..." if not draft else "ドラフトを作成中...")
+        run_ffmpeg(cmd, duration=render_duration, label='合成' if not draft else 'ドラフト',
+                   stall_timeout=stall_timeout)
         print(f"合成完了: {output_video}")
         
-        return {
-            'output_path': output_video,
-            'output_size': f"{output_width}x{output_height}",
-            'orientation': orientation,
-            'duration': main_info['duration']
-        }
+        return self._report_size(result, rate_plan)
+    
+    def _report_size(self, result: Dict, rate_plan: Optional[Dict]) -> Dict:
+        """レート制御を使った場合は予測サイズと実際のサイズを結果に追加して表示"""
+        if not rate_plan:
+            return result
+        actual_size = os.path.getsize(result['output_path'])
+        result['predicted_size'] = rate_plan['predicted_bytes']
+        result['actual_size'] = actual_size
+        print(f"出力サイズ: 予測 {rate_plan['predicted_bytes'] / 1024 / 1024:.1f}MB / "
+              f"実際 {actual_size / 1024 / 1024:.1f}MB")
+        return result
+    
+    @staticmethod
+    def _check_multi_output_options(draft: bool, fragmented: bool, parallel: Optional[bool],
+                                    rate_control: Optional[Dict]):
+        """複数出力で使えない指定を確認（明示した指定はエラー、Configの既定のレート制御は警告して無視）"""
+        unsupported = [name for name, requested in (
+            ('draft', draft),
+            ('fragmented', fragmented),
+            ('parallel', parallel is True),
+            ('rate_control', rate_control is not None and resolve_targets(rate_control) is not None),
+        ) if requested]
+        if unsupported:
+            raise ValueError(f"複数出力では使えない指定です: {', '.join(unsupported)}（単一出力で合成してください）")
+        if rate_control is None and resolve_targets(None) is not None:
+            logger.warning("複数出力ではレート制御（RATE_CONTROL_MAX_SIZE_MB / RATE_CONTROL_MAX_KBPS）を適用しません")
+    
+    def _merge_multi_output(self, main_video: str, background_video: str, output_specs: List[Dict],
+                            main_info: Dict, main_scale: float,
+                            disclaimer_text: Optional[str], planner: MergePlanner,
+                            threads: Optional[int] = None) -> List[Dict]:
+        """1回のデコードから複数の出力（向き・スケール・免責事項違い）を書き出す"""
+        if not output_specs:
+            raise ValueError("出力指定が空です")
+        
+        count = len(output_specs)
+        filter_parts = []
+        if count > 1:
+            # 背景とメイン映像を出力数だけ分岐
+            filter_parts.append(f"[0:v]split={count}" + "".join(f"[bgsrc{i}]" for i in range(count)))
+            filter_parts.append(f"[1:v]split={count}" + "".join(f"[mainsrc{i}]" for i in range(count)))
+        
+        overlay_inputs = []
+        output_args = []
+        results = []
+        for index, spec in enumerate(output_specs):
+            output_width, output_height, orientation = self.determine_output_size(
+                main_info, spec.get('canvas')
+            )
+            parts, final_output, spec_overlays = self._build_filter_complex(
+                output_width, output_height, orientation,
+                spec.get('main_scale', main_scale),
+                spec.get('disclaimer_text', disclaimer_text),
+                first_overlay_input=2 + len(overlay_inputs),
+                bg_input=f"[bgsrc{index}]" if count > 1 else "[0:v]",
+                main_input=f"[mainsrc{index}]" if count > 1 else "[1:v]",
+                label_suffix=str(index),
+                planner=planner,
+                output_fps=self.determine_output_fps(main_info)
+            )
+            filter_parts += parts
+            overlay_inputs += spec_overlays
+            profile = load_profile(orientation, main_info['duration'])
+            
+            output_args += [
+                '-map', final_output,
+                '-map', '1:a?',
+                '-t', str(main_info['duration']),
+                *video_encoder_args(profile, threads=threads),
+                *planner.audio_args(profile, spec['output_path']),
+                spec['output_path']
+            ]
+            results.append({
+                'output_path': spec['output_path'],
+                'output_size': f"{output_width}x{output_height}",
+                'orientation': orientation,
+                'duration': main_info['duration'],
+                'segments': 1
+            })
+            print(f"出力{index + 1}: {spec['output_path']} ({output_width}x{output_height}, {orientation})")
+        
+        filter_complex = ";".join(filter_parts)
+        logger.info(f"Filter complex: {filter_complex}")
+        planner.log_summary()
+        
+        cmd = [
+            'ffmpeg',
+            *thread_args(threads),
+            '-stream_loop', '-1',
+            '-i', background_video,
+            '-i', main_video,
+        ]
+        for overlay_path in overlay_inputs:
+            cmd += ['-i', overlay_path]
+        cmd += ['-filter_complex', filter_complex, '-y', *output_args]
+        
+        print(f"動画を合成中... ({count}出力)")
+        run_ffmpeg(cmd, duration=main_info['duration'], label='合成')
+        print(f"合成完了: {count}ファイル")
+        
+        return results
+    
+    def _keyframe_times(self, video_path: str) -> List[float]:
+        """映像のキーフレーム時刻（秒）を取得（デコードせずパケット情報のみ読む）"""
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0',
+            video_path
+        ]
+        output = run_probe(cmd)
+        
+        times = []
+        for line in output.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                times.append(float(pts_time))
+        return sorted(times)
+    
+    def _plan_segments(self, main_video: str, duration: float) -> List[Tuple[float, float]]:
+        """キーフレーム境界で動画を分割する区間 [(開始, 長さ), ...] を決める"""
+        workers = Config.PARALLEL_MERGE_WORKERS or available_cores()
+        target_length = max(duration / workers, Config.PARALLEL_SEGMENT_MIN_SECONDS)
+        
+        try:
+            keyframes = self._keyframe_times(main_video)
+        except Exception as e:
+            logger.warning(f"キーフレーム取得に失敗しました: {e}")
+            return [(0.0, duration)]
+        
+        # 目標の長さごとに、それ以降で最初のキーフレームを境界にする
+        boundaries = [0.0]
+        for keyframe in keyframes:
+            if keyframe - boundaries[-1] >= target_length and duration - keyframe >= Config.PARALLEL_SEGMENT_MIN_SECONDS / 2:
+                boundaries.append(keyframe)
+        boundaries.append(duration)
+        
+        return [(start, end - start) for start, end in zip(boundaries, boundaries[1:])]
+    
+    def _segment_cmd(self, main_video: str, background_video: str, bg_duration: float,
+                     start: float, length: float, filter_complex: str, final_output: str,
+                     overlay_inputs: List[str], encoder_args: List[str], output_path: str,
+                     threads: Optional[int] = None) -> List[str]:
+        """区間 [start, start+length) だけを合成する映像のみのffmpegコマンド（背景ループの位相は本編と同じ）"""
+        cmd = [
+            'ffmpeg',
+            '-v', 'error',
+            *thread_args(threads),
+            '-stream_loop', '-1',
+            '-ss', f"{start % bg_duration:.6f}",
+            '-i', background_video,
+            '-ss', f"{start:.6f}",
+            '-i', main_video,
+        ]
+        for overlay_path in overlay_inputs:
+            cmd += ['-i', overlay_path]
+        cmd += [
+            '-filter_complex', filter_complex,
+            '-map', final_output,
+            '-an',
+            '-t', f"{length:.6f}",
+            *encoder_args,
+            '-y',
+            output_path
+        ]
+        return cmd
+    
+    def _plan_rate_control(self, main_video: str, background_video: str, main_info: Dict,
+                           bg_duration: float, filter_complex: str, final_output: str,
+                           overlay_inputs: List[str], profile: Dict, targets: Dict,
+                           threads: Optional[int] = None) -> Dict:
+        """サンプル区間を試しエンコードして複雑さを測り、CRFとmaxrateを決める"""
+        probe_profile = dict(profile, crf=Config.RATE_CONTROL_PROBE_CRF, maxrate_kbps=None)
+        windows = sample_windows(main_info['duration'])
+        
+        work_dir = tempfile.mkdtemp(prefix='rate_probe_', dir=self.scratch_dir)
+        try:
+            total_bytes = 0
+            total_seconds = 0.0
+            for index, (start, length) in enumerate(windows):
+                sample_path = os.path.join(work_dir, f"sample_{index}.mp4")
+                cmd = self._segment_cmd(
+                    main_video, background_video, bg_duration, start, length,
+                    filter_complex, final_output, overlay_inputs,
+                    video_encoder_args(probe_profile, threads=threads), sample_path, threads
+                )
+                run_ffmpeg(cmd, duration=length, label='複雑さ計測')
+                total_bytes += os.path.getsize(sample_path)
+                total_seconds += length
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        probe_kbps = total_bytes * 8 / 1000 / total_seconds
+        audio_kbps = parse_kbps(profile['audio_bitrate'])
+        plan = plan_rate_control(main_info['duration'], probe_kbps, targets, audio_kbps)
+        logger.info(
+            f"レート制御: 試しエンコード {probe_kbps:.0f}kbps (CRF {Config.RATE_CONTROL_PROBE_CRF}) → "
+            f"CRF {plan['crf']}, maxrate {plan['maxrate_kbps']}kbps, "
+            f"予測サイズ {plan['predicted_bytes'] / 1024 / 1024:.1f}MB"
+        )
+        return plan
+    
+    def _merge_segments_parallel(self, main_video: str, background_video: str, output_video: str,
+                                 main_info: Dict, filter_complex: str, final_output: str,
+                                 overlay_inputs: List[str], segments: List[Tuple[float, float]],
+                                 profile: Dict, audio_args: List[str], threads: Optional[int] = None,
+                                 fragmented: bool = False):
+        """セグメントごとに並列エンコードし、concatデマルチプレクサで無劣化結合"""
+        # 割り当てられたスレッド数（なければ使えるコア数）をセグメント間で分け合う
+        cores = threads or available_cores()
+        workers = min(len(segments), Config.PARALLEL_MERGE_WORKERS or cores)
+        threads = thread_budget(workers, cores)
+        
+        # 背景ループの位相をセグメント間でそろえる
+        bg_duration = self.get_video_info(background_video)['duration']
+        
+        output_dir = os.path.dirname(os.path.abspath(output_video))
+        work_dir = tempfile.mkdtemp(prefix='merge_segments_', dir=self.scratch_dir or output_dir)
+        
+        def encode_segment(index: int, start: float, length: float) -> str:
+            segment_path = os.path.join(work_dir, f"segment_{index:03d}.mp4")
+            cmd = self._segment_cmd(
+                main_video, background_video, bg_duration, start, length,
+                filter_complex, final_output, overlay_inputs,
+                video_encoder_args(profile, threads=threads), segment_path, threads
+            )
+            run_ffmpeg(cmd, duration=length, label=f"セグメント{index + 1}")
+            logger.info(f"セグメント{index + 1}/{len(segments)} 完了 ({start:.1f}秒〜 {length:.1f}秒)")
+            return segment_path
+        
+        try:
+            print(f"動画を並列合成中... ({len(segments)}セグメント, {workers}並列, 各{threads}スレッド)")
+            # 各セグメントは独立したffmpegプロセスで実行される
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(encode_segment, index, start, length)
+                    for index, (start, length) in enumerate(segments)
+                ]
+                segment_paths = [future.result() for future in futures]
+            
+            concat_list = os.path.join(work_dir, 'segments.txt')
+            with open(concat_list, 'w') as f:
+                for segment_path in segment_paths:
+                    escaped_path = segment_path.replace("'", "'\\''")
+                    f.write(f"file '{escaped_path}'\n")
+            
+            # 映像はコピーで結合し、音声は元動画から一括でエンコード（継ぎ目の途切れを防ぐ）
+            cmd = [
+                'ffmpeg',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', concat_list,
+                '-i', main_video,
+                '-map', '0:v',
+                '-map', '1:a?',
+                '-t', str(main_info['duration']),
+                '-c:v', 'copy',
+                *audio_args,
+                *(FRAGMENTED_MP4_ARGS if fragmented else []),
+                '-y',
+                output_video
+            ]
+            run_ffmpeg(cmd, duration=main_info['duration'], label='結合')
+            print(f"合成完了: {output_video}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
     
     def process_with_auto_background(self, main_video: str, output_video: str,
                                    main_scale: float = 0.8,
-                                   disclaimer_text: Optional[str] = "※結果には個人差があり成果を保証するものではありません"):
-        """メイン処理：背景自動生成＋合成"""
+                                   disclaimer_text: Optional[str] = "※結果には個人差があり成果を保証するものではありません",
+                                   parallel: Optional[bool] = None,
+                                   rate_control: Optional[Dict] = None,
+                                   threads: Optional[int] = None,
+                                   draft: bool = False,
+                                   draft_seconds: Optional[float] = None,
+                                   main_info: Optional[Dict] = None,
+                                   fragmented: bool = False,
+                                   stall_timeout: Optional[float] = None):
+        """メイン処理：背景自動生成＋合成（ドラフトでは背景を生成せず仮の背景を使う）"""
         
         # メイン動画の情報取得
-        main_info = self.get_video_info(main_video)
+        main_info = main_info or self.get_video_info(main_video)
         output_width, output_height, orientation = self.determine_output_size(main_info)
         
-        # 背景動画の生成（Replicate API必須）
-        if not self.replicate_api_token:
-            raise ValueError("Replicate APIトークンが必須です")
-        
-        bg_video = self.generate_background_with_replicate(
-            orientation, 
-            main_info['duration'],
-            None  # 常にランダムな動物・自然背景
-        )
+        if draft:
+            bg_video = self.create_placeholder_background(orientation)
+        else:
+            # 背景動画の生成（Replicate API必須）
+            if not self.replicate_api_token:
+                raise ValueError("Replicate APIトークンが必須です")
+            
+            bg_video = self.generate_background_with_replicate(
+                orientation, 
+                main_info['duration'],
+                None  # 常にランダムな動物・自然背景
+            )
         
         if not bg_video:
             raise RuntimeError("背景動画の生成に失敗しました")
@@ -335,14 +864,22 @@ class VideoMergerWithAutoBG:
                 bg_video, 
                 output_video,
                 main_scale,
-                disclaimer_text
+                disclaimer_text,
+                parallel=parallel,
+                rate_control=rate_control,
+                threads=threads,
+                draft=draft,
+                draft_seconds=draft_seconds,
+                main_info=main_info,
+                fragmented=fragmented,
+                stall_timeout=stall_timeout
             )
             
             return result
             
         finally:
             # 一時ファイル削除
-            if os.path.exists(bg_video) and bg_video.startswith(('temp_', 'default_')):
+            if os.path.exists(bg_video) and os.path.basename(bg_video).startswith(('temp_', 'default_')):
                 os.remove(bg_video)
 
 
@@ -351,26 +888,64 @@ if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='自動背景生成付き動画合成ツール')
-    parser.add_argument('main_video', help='メイン動画ファイル')
-    parser.add_argument('output_video', help='出力動画ファイル')
+    parser.add_argument('main_video', nargs='?', help='メイン動画ファイル')
+    parser.add_argument('output_video', nargs='?', help='出力動画ファイル')
     # 背景は常に動物・自然のランダム生成
     parser.add_argument('--main-scale', type=float, default=0.8,
                        help='メイン動画のスケール（0.1-1.0）')
     parser.add_argument('--text', help='注意書きテキスト')
+    parser.add_argument('--parallel', action=argparse.BooleanOptionalAction, default=None,
+                       help='セグメント並列エンコード（省略時は動画の長さで自動判定）')
+    parser.add_argument('--max-size-mb', type=float, help='出力ファイルサイズの上限（MB）')
+    parser.add_argument('--max-kbps', type=float, help='出力ビットレートの上限（kbps）')
+    parser.add_argument('--draft', action='store_true',
+                       help='確認用の低解像度プロキシを作成（背景は生成せず仮の背景を使用）')
+    parser.add_argument('--draft-seconds', type=float, default=Config.DRAFT_SECONDS,
+                       help='ドラフトの長さの上限（秒、0で全体）')
+    # 一括合成モード
+    parser.add_argument('--batch', metavar='SOURCE',
+                       help='ディレクトリ・globパターン・マニフェスト（.json/.csv）を一括合成')
+    parser.add_argument('--output-dir', default=Config.OUTPUT_FOLDER, help='一括合成の出力先')
+    parser.add_argument('--workers', type=int, default=Config.BATCH_WORKERS, help='一括合成の同時実行数')
+    parser.add_argument('--background', help='一括合成で共通に使う背景動画')
+    parser.add_argument('--overwrite', action='store_true', help='一括合成で既存の出力も作り直す')
     # Replicate APIは常に使用
     
     args = parser.parse_args()
     
+    if args.batch:
+        from batch_merger import BatchMerger, load_jobs, print_summary
+        
+        # batch_merger.py のCLIと同じく、省略時は既定の注意書きを入れる
+        jobs = load_jobs(args.batch, args.output_dir, args.main_scale,
+                         args.text or Config.DEFAULT_DISCLAIMER_TEXT)
+        batch = BatchMerger(workers=args.workers, background_video=args.background,
+                            overwrite=args.overwrite)
+        summary = batch.run(jobs)
+        print_summary(summary)
+        raise SystemExit(0 if summary['failed'] == 0 else 1)
+    
+    if not args.main_video or not args.output_video:
+        parser.error('main_video と output_video を指定してください（一括合成は --batch）')
+    
+    rate_control = None
+    if args.max_size_mb is not None or args.max_kbps is not None:
+        rate_control = {'max_size_mb': args.max_size_mb, 'max_kbps': args.max_kbps}
+    
     # 処理実行
     merger = VideoMergerWithAutoBG()
     result = merger.process_with_auto_background(
         args.main_video,
         args.output_video,
         main_scale=args.main_scale,
-        disclaimer_text=args.text
+        disclaimer_text=args.text,
+        parallel=args.parallel,
+        rate_control=rate_control,
+        draft=args.draft,
+        draft_seconds=args.draft_seconds or None
     )
     
     print(f"\n完了！")
     print(f"出力: {result['output_path']}")
     print(f"サイズ: {result['output_size']} ({result['orientation']})")
-    print(f"長さ: {result['duration']:.1f}秒")
\ No newline at end of file
+    print(f"長さ: {result['duration']:.1f}秒")
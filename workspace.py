@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+作業フォルダの管理
+ジョブごとに一意の作業フォルダ（元動画・背景・合成結果・中間ファイル）を割り当て、
+合計サイズの上限と保持期間を超えた古いジョブのフォルダを削除する。
+中間ファイル（セグメント・試しエンコード）はtmpfs等の高速な領域に置ける
+"""
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import Config
+from resource_scheduler import free_disk_mb
+
+logger = logging.getLogger(__name__)
+
+# ジョブフォルダ内の段階ごとのサブフォルダ
+STAGES = ('source', 'background', 'render')
+SCRATCH_STAGE = 'scratch'
+# 実行中のジョブを示すファイル（中身はプロセスID）
+ACTIVE_MARKER = '.active'
+
+
+def directory_size(path: Path) -> int:
+    """フォルダ以下のファイルの合計サイズ（ハードリンクも各1回として数える）"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _format_mb(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f}MB"
+
+
+class JobWorkspace:
+    """1ジョブの作業フォルダ"""
+
+    def __init__(self, workspace: 'Workspace', path: Path, scratch: Path):
+        self.workspace = workspace
+        self.path = path
+        self.scratch = scratch
+        self.released = False
+        # 中間ファイルは解放時に消えるため、最大使用量を記録する
+        self.scratch_peak = 0
+
+    def stage_dir(self, stage: str) -> Path:
+        """段階（source / background / render / scratch）のフォルダ"""
+        if stage == SCRATCH_STAGE:
+            return self.scratch
+        if stage not in STAGES:
+            raise ValueError(f"不明な段階: {stage}")
+        path = self.path / stage
+        path.mkdir(exist_ok=True)
+        return path
+
+    def usage(self) -> Dict[str, int]:
+        """段階ごとの使用量（バイト）"""
+        usage = {stage: directory_size(self.path / stage) for stage in STAGES}
+        scratch = directory_size(self.scratch) if self.scratch.exists() else 0
+        self.scratch_peak = max(self.scratch_peak, scratch)
+        usage[SCRATCH_STAGE] = scratch
+        return usage
+
+    def release(self, keep: bool = True):
+        """
+        ジョブの終了（中間ファイルは削除し、keep=Falseならフォルダごと削除）
+        残したフォルダは保持期間・容量上限に従って後で削除される
+        """
+        if self.released:
+            return
+        usage = self.usage()
+        logger.info(
+            f"作業フォルダ使用量 {self.path.name}: "
+            + " / ".join(f"{stage} {_format_mb(size)}" for stage, size in usage.items() if stage != SCRATCH_STAGE)
+            + f" / {SCRATCH_STAGE} 最大 {_format_mb(self.scratch_peak)}"
+        )
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        if keep:
+            try:
+                (self.path / ACTIVE_MARKER).unlink()
+            except FileNotFoundError:
+                pass
+            # 最後に使った時刻としてLRUの順番に使う
+            os.utime(self.path)
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.released = True
+        self.workspace.enforce_quota()
+
+    def __enter__(self) -> 'JobWorkspace':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class Workspace:
+    """ジョブの作業フォルダを割り当て、容量上限・保持期間で古いものから削除する"""
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 scratch_root: Optional[str] = None, retention_hours: Optional[float] = None):
+        """
+        Args:
+            root: 作業フォルダの置き場所
+            max_bytes: 合計サイズの上限（0で無制限）
+            scratch_root: 中間ファイルの置き場所（/dev/shm 等。空き容量が足りなければrootを使う）
+            retention_hours: 終了したジョブのフォルダを残す時間（0で無制限）
+        """
+        self.root = Path(root or Config.WORKSPACE_DIR)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = Config.WORKSPACE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.scratch_root = scratch_root if scratch_root is not None else Config.WORKSPACE_SCRATCH_DIR
+        self.retention_hours = Config.WORKSPACE_RETENTION_HOURS if retention_hours is None else retention_hours
+
+    def _scratch_parent(self) -> Optional[Path]:
+        """中間ファイルを置けるtmpfs等のフォルダ（使えなければNone）"""
+        if not self.scratch_root or not os.path.isdir(self.scratch_root):
+            return None
+        if free_disk_mb(self.scratch_root) < Config.WORKSPACE_SCRATCH_MIN_FREE_MB:
+            logger.info(f"{self.scratch_root} の空きが少ないため中間ファイルは作業フォルダに置きます")
+            return None
+        parent = Path(self.scratch_root) / self.root.name
+        parent.mkdir(exist_ok=True)
+        return parent
+
+    def allocate(self, name: str) -> JobWorkspace:
+        """
+        ジョブ用の一意な作業フォルダを作成（同じ名前のジョブが同時に動いても衝突しない）
+
+        Args:
+            name: ジョブの名前（広告グループ名など。フォルダ名の一部になる）
+        """
+        self.enforce_quota()
+        slug = re.sub(r'[^\w.-]+', '_', name).strip('_')[:40] or 'job'
+        prefix = f"{time.strftime('%Y%m%d_%H%M%S')}_{slug}_"
+        path = Path(tempfile.mkdtemp(prefix=prefix, dir=self.root))
+        (path / ACTIVE_MARKER).write_text(str(os.getpid()))
+
+        scratch_parent = self._scratch_parent()
+        if scratch_parent:
+            scratch = Path(tempfile.mkdtemp(prefix=prefix, dir=scratch_parent))
+        else:
+            scratch = path / SCRATCH_STAGE
+            scratch.mkdir()
+        logger.info(f"作業フォルダ: {path}" + (f"（中間ファイル: {scratch}）" if scratch_parent else ""))
+        return JobWorkspace(self, path, scratch)
+
+    def _jobs(self) -> List[Path]:
+        return [path for path in self.root.iterdir() if path.is_dir()]
+
+    def _is_active(self, path: Path) -> bool:
+        """実行中のジョブか（異常終了したプロセスのジョブは終了扱い）"""
+        try:
+            pid = int((path / ACTIVE_MARKER).read_text())
+        except (OSError, ValueError):
+            return False
+        return _pid_alive(pid)
+
+    def usage(self) -> Dict[str, int]:
+        """段階ごとの合計使用量（バイト）"""
+        totals = {stage: 0 for stage in STAGES + (SCRATCH_STAGE,)}
+        for job in self._jobs():
+            for stage in totals:
+                # tmpfs上の中間ファイルは含まない（ジョブの終了時に削除される）
+                if (job / stage).is_dir():
+                    totals[stage] += directory_size(job / stage)
+        return totals
+
+    def total_bytes(self) -> int:
+        return sum(directory_size(job) for job in self._jobs())
+
+    def enforce_quota(self) -> List[Path]:
+        """
+        保持期間を過ぎたジョブと、容量上限を超えた分の古いジョブ（最後に使った順）を削除
+        実行中のジョブは削除しない
+
+        Returns:
+            削除したフォルダ
+        """
+        # 他のプロセスが削除したフォルダは飛ばす
+        finished = []
+        sizes = {}
+        for job in self._jobs():
+            try:
+                mtime = job.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            sizes[job] = directory_size(job)
+            if not self._is_active(job):
+                finished.append((mtime, job))
+        finished.sort()
+        total = sum(sizes.values())
+        expire_before = time.time() - self.retention_hours * 3600 if self.retention_hours else None
+
+        removed = []
+        for mtime, job in finished:
+            expired = expire_before is not None and mtime < expire_before
+            over_quota = self.max_bytes and total > self.max_bytes
+            if not expired and not over_quota:
+                continue
+            shutil.rmtree(job, ignore_errors=True)
+            total -= sizes[job]
+            removed.append(job)
+            logger.info(f"作業フォルダを削除: {job.name}（{'保持期間切れ' if expired else '容量上限'}, "
+                        f"{_format_mb(sizes[job])}）")
+
+        if self.max_bytes and total > self.max_bytes:
+            logger.warning(f"実行中のジョブだけで作業フォルダの上限を超えています: "
+                           f"{_format_mb(total)} / {_format_mb(self.max_bytes)}")
+        return removed
+
+
+# CLI使用例
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='作業フォルダの使用量確認・整理')
+    parser.add_argument('--cleanup', action='store_true', help='保持期間・容量上限に従って古いジョブを削除')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    workspace = Workspace()
+    if args.cleanup:
+        workspace.enforce_quota()
+
+    print(f"作業フォルダ: {workspace.root}")
+    for stage, size in workspace.usage().items():
+        print(f"  {stage}: {_format_mb(size)}")
+    print(f"  合計: {_format_mb(workspace.total_bytes())} / 上限 "
+          f"{_format_mb(workspace.max_bytes) if workspace.max_bytes else 'なし'}")